@@ -1,106 +1,355 @@
 import logging
+from typing import Iterator, List, Optional, Tuple
 
 import faiss
-import networkx as nx
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from sqlalchemy import select, update
 
+from src import embedding_store
 from src.config import settings
-from src.db import ImageRecord, SessionLocal
+from src.db import EMBEDDING_DIM, ImageRecord, SessionLocal, embedding_to_numpy
 
 logger = logging.getLogger(__name__)
 
+# Сколько векторов-запросов передавать в FAISS за один вызов.
+# Размер результата range_search зависит от данных, поэтому без разбиения
+# на блоки пиковое потребление памяти ничем не ограничено.
+SEARCH_BATCH_SIZE = 4096
 
-def cluster_images() -> None:
+# Индексы с приближенным сходством (int8, fp16 на GPU) ищут кандидатов с
+# порогом, сниженным на эту величину; затем сходство пар пересчитывается
+# точно во float32. Погрешность квантования int8 - около 1e-3
+RERANK_MARGIN = 0.01
+
+# Сколько строк с эмбеддингами получать из БД за один раз при загрузке
+LOAD_BATCH_SIZE = 4096
+
+
+def build_index(embeddings: np.ndarray) -> faiss.Index:
     """
-    Выполняет кластеризацию изображений на основе их эмбеддингов.
+    Строит индекс FAISS согласно `settings.FAISS_INDEX`.
 
-    Процесс включает следующие шаги:
-    1. Загрузка эмбеддингов из базы данных.
-    2. Построение индекса FAISS для быстрого поиска ближайших соседей.
-    3. Поиск пар изображений, сходство которых превышает заданный порог.
-    4. Построение графа, где рёбра соединяют похожие изображения.
-    5. Поиск связных компонент в графе, которые и являются кластерами.
-    6. Сохранение информации о кластерах (cluster_id) в базу данных.
+    Для нормализованных векторов скалярное произведение равно косинусному
+    сходству. `IndexFlatIP` дает точный поиск за O(N^2), `IndexHNSWFlat` -
+    приближенный примерно за O(N log N), что важно начиная с десятков
+    тысяч векторов. `IndexScalarQuantizer` хранит векторы в int8: в 4 раза
+    меньше памяти и трафика при переборе ценой погрешности сходства ~1e-3.
+    Точный индекс переносится на GPU с хранением во fp16, если это
+    разрешено `settings.FAISS_USE_GPU` и видеокарта доступна.
+
+    Args:
+        embeddings: Нормализованные векторы, shape (N, d).
+
+    Returns:
+        Индекс с добавленными векторами.
     """
-    logger.info("Загрузка эмбеддингов из БД...")
-    with SessionLocal() as session:
-        # Загружаем ID и векторы
-        # Внимание: для 100k векторов (768 float) это ~300MB RAM. Допустимо.
-        stmt = select(ImageRecord.id, ImageRecord.embedding).where(
-            ImageRecord.embedding.is_not(None)
+    n, d = embeddings.shape
+    kind = settings.FAISS_INDEX
+    if kind == "auto":
+        kind = "hnsw" if n >= settings.FAISS_HNSW_MIN_VECTORS else "flat"
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(
+            d, settings.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+    elif kind == "sq8":
+        index = faiss.IndexScalarQuantizer(
+            d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
         )
-        results = session.execute(stmt).all()
+    elif kind == "flat" and _gpu_available():
+        res = faiss.StandardGpuResources()
+        config = faiss.GpuIndexFlatConfig()
+        config.useFloat16 = True  # вдвое меньше видеопамяти, тензорные ядра
+        index = faiss.GpuIndexFlatIP(res, d, config)
+        kind = "flat, GPU fp16"
+    elif kind == "flat":
+        index = faiss.IndexFlatIP(d)
+    else:
+        raise ValueError(f"Неизвестный тип индекса FAISS: {settings.FAISS_INDEX}")
 
-    if not results:
-        logger.warning("Эмбеддинги для кластеризации не найдены.")
-        return
+    logger.info(f"Построение индекса FAISS ({kind}) для {n} векторов...")
+    if not index.is_trained:
+        # Квантователю нужны диапазоны значений по каждому измерению
+        index.train(embeddings)  # type: ignore
+    index.add(embeddings)  # type: ignore
+    return index
 
-    ids: np.ndarray = np.array([r.id for r in results], dtype=np.int64)
-    embeddings: np.ndarray = np.array([r.embedding for r in results], dtype=np.float32)
 
-    # Нормализация (на всякий случай, хотя CLIP уже нормализован)
-    faiss.normalize_L2(embeddings)
+def _gpu_available() -> bool:
+    """Проверяет, что поиск на GPU разрешен и возможен (сборка faiss-gpu)."""
+    return (
+        settings.FAISS_USE_GPU
+        and hasattr(faiss, "StandardGpuResources")
+        and faiss.get_num_gpus() > 0
+    )
 
-    d: int = embeddings.shape[1]
-    n: int = embeddings.shape[0]
 
-    logger.info(f"Построение индекса FAISS для {n} векторов...")
-    # Используем IndexFlatIP (Inner Product) = Cosine Similarity для нормализованных векторов
-    index = faiss.IndexFlatIP(d)
+def _supports_range_search(index: faiss.Index) -> bool:
+    """HNSW и GPU-индексы FAISS не поддерживают range_search."""
+    if isinstance(index, faiss.IndexHNSW):
+        return False
+    gpu_index_cls = getattr(faiss, "GpuIndex", None)
+    return gpu_index_cls is None or not isinstance(index, gpu_index_cls)
 
-    # Если есть GPU для FAISS:
-    # res = faiss.StandardGpuResources()
-    # index = faiss.index_cpu_to_gpu(res, 0, index)
 
-    index.add(embeddings)  # type: ignore
+def _has_exact_scores(index: faiss.Index) -> bool:
+    """Квантованный и GPU (fp16) индексы возвращают приближенное сходство."""
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return False
+    gpu_index_cls = getattr(faiss, "GpuIndex", None)
+    return gpu_index_cls is None or not isinstance(index, gpu_index_cls)
 
-    # Поиск соседей. Range Search эффективнее для кластеризации по порогу
-    # radius = threshold. Но FAISS range_search использует L2 distance для L2 индекса
-    # или Inner Product для IP индекса.
-    # Для IP: чем больше, тем ближе. Мы ищем соседей с similarity > threshold.
 
-    lims, _, indices = index.range_search(  # type: ignore
-        embeddings, settings.SIMILARITY_THRESHOLD
-    )
+def _range_pairs(
+    index: faiss.Index, queries: np.ndarray, threshold: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Пары (номер запроса, номер соседа) через range_search."""
+    # lims - это индексы начала/конца результатов для каждого запроса
+    lims, _, indices = index.range_search(queries, threshold)  # type: ignore
+    counts = np.diff(lims).astype(np.int64)
+    src = np.repeat(np.arange(len(queries)), counts)
+    return src, indices.astype(np.int64)
 
-    logger.info("Построение графа связей...")
-    G = nx.Graph()
-    G.add_nodes_from(ids)
 
-    # lims - это индексы начала/конца результатов для каждого вектора i
-    for i in range(n):
-        start, end = lims[i], lims[i + 1]
-        # Соседи вектора i
-        neighbors_indices = indices[start:end]
-        # neighbors_scores = D[start:end]
+def _knn_pairs(
+    index: faiss.Index, queries: np.ndarray, threshold: float, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Пары (номер запроса, номер соседа) через поиск k ближайших с порогом."""
+    scores, indices = index.search(queries, k)  # type: ignore
+    # -1 в indices означает, что соседей меньше k
+    mask = (indices >= 0) & (scores > threshold)
+    if k > 1 and np.any(mask[:, -1]):
+        logger.warning(
+            "Все %d соседей некоторых векторов выше порога: кластеры могут быть "
+            "неполными, увеличьте FAISS_KNN_K.",
+            k,
+        )
+    src = np.broadcast_to(np.arange(len(queries))[:, None], indices.shape)
+    return src[mask], indices[mask].astype(np.int64)
 
-        src_id = ids[i]
-        for j_idx in neighbors_indices:
-            if i == j_idx:
-                continue  # self-loop
-            dst_id = ids[j_idx]
-            G.add_edge(src_id, dst_id)
 
-    logger.info("Поиск связных компонент (кластеров)...")
-    components = list(nx.connected_components(G))
+def iter_similar_pairs(
+    index: faiss.Index, embeddings: np.ndarray, threshold: float
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Находит пары похожих векторов блоками по `SEARCH_BATCH_SIZE` запросов.
+
+    Индексы с поддержкой range_search опрашиваются по радиусу `threshold`,
+    остальные (HNSW, GPU) - поиском `settings.FAISS_KNN_K` ближайших соседей
+    с последующей фильтрацией по порогу. Блоки также ограничивают объем
+    видеопамяти под результаты на GPU. Для индексов с приближенным
+    сходством кандидаты ищутся с запасом `RERANK_MARGIN` и проверяются
+    точным скалярным произведением по `embeddings`.
+
+    Args:
+        index: Индекс FAISS, содержащий `embeddings`.
+        embeddings: Нормализованные векторы, shape (N, d).
+        threshold: Минимальное косинусное сходство для пары.
+
+    Yields:
+        Кортежи массивов (src, dst) с номерами строк в `embeddings`
+        для каждого блока запросов. Петли (i, i) исключены.
+    """
+    n = embeddings.shape[0]
+    use_knn = not _supports_range_search(index)
+    k = min(settings.FAISS_KNN_K, n)
+    rerank = not _has_exact_scores(index)
+    search_threshold = threshold - RERANK_MARGIN if rerank else threshold
+
+    for start in range(0, n, SEARCH_BATCH_SIZE):
+        queries = embeddings[start : start + SEARCH_BATCH_SIZE]
+        if use_knn:
+            src, dst = _knn_pairs(index, queries, search_threshold, k)
+        else:
+            src, dst = _range_pairs(index, queries, search_threshold)
+        src = src + start
+
+        keep = src != dst
+        if rerank:
+            exact = np.einsum("ij,ij->i", embeddings[src], embeddings[dst])
+            keep &= exact > threshold
+        yield src[keep], dst[keep]
+
+
+def find_components(n: int, src: np.ndarray, dst: np.ndarray) -> List[np.ndarray]:
+    """
+    Находит связные компоненты графа похожести размером больше 1.
+
+    Граф собирается в разреженную матрицу смежности, а компоненты ищет
+    `scipy.sparse.csgraph` на уровне C: без словарей на каждую вершину
+    и ребро, как у графа NetworkX.
+
+    Args:
+        n: Количество вершин (векторов).
+        src: Номера начальных вершин ребер.
+        dst: Номера конечных вершин ребер.
+
+    Returns:
+        Список массивов с номерами вершин каждой компоненты,
+        упорядоченный по меньшей вершине компоненты.
+    """
+    graph = coo_matrix(
+        (np.ones(len(src), dtype=bool), (src, dst)), shape=(n, n)
+    ).tocsr()
+    _, labels = connected_components(graph, directed=False)
+
+    # Группируем вершины по меткам: сортировка устойчивая, поэтому внутри
+    # группы номера вершин идут по возрастанию
+    order = np.argsort(labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    return [group for group in np.split(order, bounds) if len(group) > 1]
+
 
-    # Фильтруем одиночные (не кластеры)
-    clusters = [c for c in components if len(c) > 1]
+def normalize_rows(embeddings: np.ndarray) -> None:
+    """
+    Нормирует строки матрицы на месте (нулевые строки не меняются).
+
+    Args:
+        embeddings: Векторы float32, shape (N, d), доступные для записи.
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+
+
+def load_embeddings() -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Загружает идентификаторы и эмбеддинги всех проиндексированных изображений.
+
+    Сначала используется файловое хранилище `embedding_store`: из БД
+    читаются только id и отпечаток, и если хранилище согласовано с ней,
+    векторы берутся из файлов без построчного разбора. Иначе (первый
+    запуск, прерванная индексация, переиндексация файлов или подмена БД)
+    векторы загружаются из БД, а хранилище перезаписывается для следующих
+    запусков.
+
+    Векторы нормируются блоками по `LOAD_BATCH_SIZE` строк сразу после
+    загрузки, пока блок еще в кэше, а не отдельным проходом по матрице.
+
+    Returns:
+        Кортеж (ids, embeddings) с нормированными векторами,
+        отсортированный по id, или `None`, если эмбеддингов нет.
+    """
+    with SessionLocal() as session:
+        fingerprint = embedding_store.db_fingerprint(session)
+        stmt = (
+            select(ImageRecord.id)
+            .where(ImageRecord.embedding.is_not(None))
+            .order_by(ImageRecord.id)
+        )
+        db_ids = np.array(session.scalars(stmt).all(), dtype=np.int64)
+
+        if len(db_ids) == 0:
+            return None
+
+        stored = None
+        if embedding_store.read_fingerprint() == fingerprint:
+            stored = embedding_store.load()
+        if stored is not None and np.array_equal(stored[0], db_ids):
+            logger.info(f"Загрузка эмбеддингов из {embedding_store.store_dir()}...")
+            embeddings = stored[1]
+            for start in range(0, len(embeddings), LOAD_BATCH_SIZE):
+                normalize_rows(embeddings[start : start + LOAD_BATCH_SIZE])
+            return stored
+
+        logger.info("Загрузка эмбеддингов из БД...")
+        # Массивы выделяются заранее и заполняются построчно по мере чтения:
+        # без промежуточного списка из N векторов и второй копии данных.
+        # Записи, добавленные после чтения id, не учитываются
+        ids = np.empty(len(db_ids), dtype=np.int64)
+        embeddings = np.empty((len(db_ids), EMBEDDING_DIM), dtype=np.float32)
+        full_stmt = (
+            select(ImageRecord.id, ImageRecord.embedding)
+            .where(
+                ImageRecord.embedding.is_not(None),
+                ImageRecord.id <= int(db_ids[-1]),
+            )
+            .order_by(ImageRecord.id)
+            .execution_options(yield_per=LOAD_BATCH_SIZE)
+        )
+        count = 0
+        for row in session.execute(full_stmt):
+            if count == len(ids):
+                break
+            ids[count] = row.id
+            embeddings[count] = embedding_to_numpy(row.embedding)
+            count += 1
+            if count % LOAD_BATCH_SIZE == 0:
+                normalize_rows(embeddings[count - LOAD_BATCH_SIZE : count])
+        normalize_rows(embeddings[count - count % LOAD_BATCH_SIZE : count])
+        # Записи, удаленные после чтения id
+        ids, embeddings = ids[:count], embeddings[:count]
+
+    embedding_store.rewrite(ids, embeddings, fingerprint)
+    return ids, embeddings
+
+
+def cluster_images() -> None:
+    """
+    Выполняет кластеризацию изображений на основе их эмбеддингов.
+
+    Процесс включает следующие шаги:
+    1. Загрузка и нормализация эмбеддингов (из файлового хранилища или БД).
+    2. Построение индекса FAISS для быстрого поиска ближайших соседей.
+    3. Поиск пар изображений, сходство которых превышает заданный порог.
+    4. Построение разреженного графа, где рёбра соединяют похожие изображения.
+    5. Поиск связных компонент в графе, которые и являются кластерами.
+    6. Сохранение информации о кластерах (cluster_id) в базу данных.
+    """
+    loaded = load_embeddings()
+    if loaded is None:
+        logger.warning("Эмбеддинги для кластеризации не найдены.")
+        return
+    ids, embeddings = loaded
+
+    index = build_index(embeddings)
+
+    # Для IP: чем больше, тем ближе. Мы ищем соседей с similarity > threshold.
+    logger.info("Поиск похожих пар и построение графа связей...")
+    src_parts: List[np.ndarray] = []
+    dst_parts: List[np.ndarray] = []
+    for src, dst in iter_similar_pairs(
+        index, embeddings, settings.SIMILARITY_THRESHOLD
+    ):
+        src_parts.append(src.astype(np.int32))
+        dst_parts.append(dst.astype(np.int32))
+
+    logger.info("Поиск связных компонент (кластеров)...")
+    clusters = [
+        ids[rows]
+        for rows in find_components(
+            len(ids), np.concatenate(src_parts), np.concatenate(dst_parts)
+        )
+    ]
     logger.info(f"Найдено {len(clusters)} кластеров размером > 1.")
 
     logger.info("Сохранение информации о кластерах в БД...")
     with SessionLocal() as session:
         # Сначала сбрасываем старые кластеры
-        session.execute(update(ImageRecord).values(cluster_id=None))
+        session.execute(
+            update(ImageRecord)
+            .where(ImageRecord.cluster_id.is_not(None))
+            .values(cluster_id=None)
+        )
 
-        for cluster_idx, node_set in enumerate(clusters):
-            # cluster_idx + 1, чтобы ID начинались с 1
-            node_list = list(node_set)
+        if clusters:
+            all_ids = np.concatenate(clusters)
+            # Номера кластеров начинаются с 1
+            all_cids = np.repeat(
+                np.arange(1, len(clusters) + 1), [len(c) for c in clusters]
+            )
+            # Массовое обновление по первичному ключу: один executemany
+            # вместо отдельного UPDATE ... IN (...) на каждый кластер.
+            # tolist() дает int, а не np.int64: драйверы БД не умеют их связывать
             session.execute(
-                update(ImageRecord)
-                .where(ImageRecord.id.in_(node_list))
-                .values(cluster_id=cluster_idx + 1)
+                update(ImageRecord),
+                [
+                    {"id": image_id, "cluster_id": cluster_id}
+                    for image_id, cluster_id in zip(all_ids.tolist(), all_cids.tolist())
+                ],
             )
         session.commit()
 
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Optional
 
 from pydantic_settings import BaseSettings
 
@@ -12,19 +13,42 @@ class Settings(BaseSettings):
     # Для макс. качества: model_name="ViT-L-14", pretrained="laion2b_s32b_b82k"
     CLIP_MODEL_NAME: str = "ViT-B-16-SigLIP"
     CLIP_PRETRAINED: str = "webli"
-    BATCH_SIZE: int = 32  # Подбирать под VRAM. 64 ок для 8GB VRAM
+    # 0 - подобрать автоматически под свободную видеопамять (на CPU - 8)
+    BATCH_SIZE: int = 0
     DEVICE: str = "cuda"  # или cpu
     NUM_WORKERS: int = 4  # Кол-во воркеров для DataLoader
+    # Компиляция модели (torch.compile) на GPU: ускоряет проход, но первый
+    # батч ждет компиляции около минуты - на малых папках лучше выключить
+    TORCH_COMPILE: bool = True
+    # Декодирование JPEG на GPU (nvJPEG) вместо Pillow в воркерах DataLoader
+    GPU_JPEG_DECODE: bool = True
 
     # Clustering
     SIMILARITY_THRESHOLD: float = 0.95  # Косинусное сходство (0..1)
+    # Индекс FAISS: "flat" - точный поиск O(N^2), "hnsw" - приближенный,
+    # "sq8" - точный перебор по векторам, квантованным в int8 (в 4 раза
+    # меньше памяти), "auto" - hnsw начиная с FAISS_HNSW_MIN_VECTORS векторов
+    FAISS_INDEX: str = "auto"
+    FAISS_HNSW_MIN_VECTORS: int = 50_000
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 80
+    FAISS_HNSW_EF_SEARCH: int = 64
+    # Точный поиск на GPU (fp16), если доступна сборка faiss-gpu и видеокарта
+    FAISS_USE_GPU: bool = True
+    # Сколько соседей запрашивать у индексов без range_search (HNSW, GPU).
+    # Должно быть не меньше размера самого большого ожидаемого кластера.
+    FAISS_KNN_K: int = 200
 
     # Paths
     LOG_FILE: Path = Path("app.log")
-
-    model_config = {
-        "env_file": ".env"
-    }
+    # Копия эмбеддингов в плоских файлах для быстрой загрузки при кластеризации.
+    # По умолчанию рядом с файлом SQLite или в ~/.cache/image-dedup/embeddings
+    # для серверной БД (см. embedding_store.store_dir)
+    EMBEDDINGS_DIR: Optional[Path] = None
+    # Кэш миниатюр GUI
+    THUMBNAIL_CACHE_DIR: Path = Path.home() / ".cache" / "image-dedup" / "thumbs"
+
+    model_config = {"env_file": ".env"}
 
 
 settings = Settings()
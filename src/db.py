@@ -1,12 +1,20 @@
+import logging
 from datetime import datetime
 from typing import Any
 
-from pgvector.sqlalchemy import Vector
-from sqlalchemy import create_engine, text
+import numpy as np
+from pgvector import HalfVector
+from pgvector.sqlalchemy import HALFVEC
+from sqlalchemy import Connection, Engine, Index, create_engine, event, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
 
 from src.config import settings
 
+logger = logging.getLogger(__name__)
+
+# Размерность зависит от модели. ViT-B-16-SigLIP = 768
+EMBEDDING_DIM = 768
+
 
 class Base(DeclarativeBase):
     pass
@@ -21,8 +29,10 @@ class ImageRecord(Base):
     size_bytes: Mapped[int] = mapped_column()
     mtime: Mapped[float] = mapped_column()
 
-    # Размерность зависит от модели. ViT-B-16-SigLIP = 768
-    embedding: Mapped[Any] = mapped_column(Vector(768), nullable=True)
+    # halfvec (pgvector >= 0.7): 2 байта на значение вместо 4 - вдвое меньше
+    # данных при чтении и в индексе; точности fp16 для порога 0.95 достаточно.
+    # Таблицы, созданные со столбцом vector, переводит init_db.
+    embedding: Mapped[Any] = mapped_column(HALFVEC(EMBEDDING_DIM), nullable=True)
 
     cluster_id: Mapped[int | None] = mapped_column(index=True, nullable=True)
     reviewed: Mapped[bool] = mapped_column(default=False)
@@ -33,25 +43,107 @@ class ImageRecord(Base):
         default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
-    # Индекс для быстрого поиска по вектору (IVFFlat или HNSW)
-    # Для <100k строк можно обойтись без индекса или добавить позже.
-    # __table_args__ = (
-    #     Index(
-    #         "idx_images_embedding",
-    #         "embedding",
-    #         postgresql_using="hnsw",
-    #         postgresql_with={"m": 16, "ef_construction": 64},
-    #     ),
-    # )
+    # HNSW-индекс для поиска по скалярному произведению и индекс для GUI
+    __table_args__ = (
+        Index(
+            "idx_images_embedding",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "halfvec_ip_ops"},
+        ),
+        # Для загрузки неразобранных кластеров в GUI: выборка по reviewed
+        # и порядок (cluster_id, id) берутся из индекса без полного прохода
+        # по таблице. На существующей базе индекс создается так:
+        # CREATE INDEX idx_images_reviewed_cluster
+        #     ON images (reviewed, cluster_id, id);
+        Index("idx_images_reviewed_cluster", "reviewed", "cluster_id", "id"),
+    )
+
+
+def embedding_to_numpy(value: Any) -> np.ndarray:
+    """
+    Значение столбца `embedding` в виде массива NumPy.
+
+    Из Postgres pgvector возвращает `HalfVector`, который NumPy сам
+    не преобразует; SQLite (в тестах) возвращает обычный список.
+    """
+    if isinstance(value, HalfVector):
+        return value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+# Настройки соединений SQLite: журнал WAL вместо отката и синхронизация
+# только на контрольных точках (commit не ждет fsync), временные таблицы
+# и кэш страниц (256 МБ) в памяти, чтение файла базы через mmap
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144",
+    "PRAGMA mmap_size=1073741824",
+)
+
+
+def enable_sqlite_pragmas(engine: Engine) -> None:
+    """Применяет `SQLITE_PRAGMAS` к каждому новому соединению SQLite."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
 
 
 engine = create_engine(settings.DB_URL)
+enable_sqlite_pragmas(engine)
 SessionLocal = sessionmaker(bind=engine)
 
 
+def migrate_embedding_to_halfvec(conn: Connection) -> bool:
+    """
+    Переводит столбец `embedding` из vector в halfvec (только Postgres).
+
+    Базы, созданные до перехода на halfvec, хранят эмбеддинги в vector,
+    и запись векторов halfvec в такой столбец не проходит. Столбец
+    преобразуется на месте, HNSW-индекс пересоздается с `halfvec_ip_ops`.
+
+    Returns:
+        True, если столбец был преобразован.
+    """
+    column_type = conn.execute(
+        text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = to_regclass('images') AND attname = 'embedding' "
+            "AND NOT attisdropped"
+        )
+    ).scalar()
+    if column_type is None or not column_type.startswith("vector"):
+        return False
+
+    logger.info(f"Перевод столбца embedding из {column_type} в halfvec...")
+    embedding_index = next(
+        index
+        for index in ImageRecord.__table__.indexes
+        if index.name == "idx_images_embedding"
+    )
+    conn.execute(text("DROP INDEX IF EXISTS idx_images_embedding"))
+    conn.execute(
+        text(f"ALTER TABLE images ALTER COLUMN embedding TYPE halfvec({EMBEDDING_DIM})")
+    )
+    embedding_index.create(conn)
+    return True
+
+
 def init_db() -> None:
-    # Включаем расширение vector
-    with engine.connect() as conn:
-        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-        conn.commit()
+    # Включаем расширение vector (только Postgres; настройки SQLite
+    # применяются к каждому соединению в enable_sqlite_pragmas)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            migrate_embedding_to_halfvec(conn)
+            conn.commit()
     Base.metadata.create_all(engine)
@@ -0,0 +1,216 @@
+"""
+Файловое хранилище эмбеддингов рядом с базой данных.
+
+Загрузка всех векторов из PostgreSQL построчно (с созданием Python-объекта
+на каждое значение) - самая медленная часть кластеризации. Поэтому при
+индексации эмбеддинги дополнительно дописываются в два плоских бинарных
+файла в каталоге `store_dir()`:
+
+- `ids.i64` - идентификаторы записей (`int64`);
+- `embeddings.f16` - векторы, по `EMBEDDING_DIM` значений `float16` на запись.
+
+В БД векторы хранятся в halfvec, поэтому float16 в файле не теряет
+точности, а читать при кластеризации приходится вдвое меньше байт.
+
+Файлы только дописываются, поэтому при переиндексации одна запись может
+встречаться несколько раз - актуальной считается последняя. Читаются они
+через `np.memmap`, без разбора и копирования в Python-объекты.
+
+БД остается источником истины. Рядом с векторами хранится отпечаток БД
+(`db_fingerprint`), с которой хранилище было согласовано; он пишется
+после `rewrite` и после индексации, если до нее хранилище совпадало с БД.
+Потребитель сравнивает его с текущим отпечатком и при расхождении
+перестраивает хранилище из БД.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import BigInteger, cast, func, make_url, select
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db import EMBEDDING_DIM, ImageRecord
+
+IDS_FILE = "ids.i64"
+EMBEDDINGS_FILE = "embeddings.f16"
+FINGERPRINT_FILE = "fingerprint.json"
+
+# Каталог хранилищ для серверных БД (у них нет файла, рядом с которым
+# можно положить хранилище)
+CACHE_ROOT = Path.home() / ".cache" / "image-dedup" / "embeddings"
+
+_ID_BYTES = np.dtype(np.int64).itemsize
+_ROW_BYTES = np.dtype(np.float16).itemsize * EMBEDDING_DIM
+
+
+def store_dir() -> Path:
+    """
+    Каталог хранилища для текущей БД.
+
+    Явно заданный `settings.EMBEDDINGS_DIR` используется как есть. Иначе
+    для файла SQLite это `<файл БД>.embeddings` рядом с ним, а для
+    серверной БД - подкаталог `CACHE_ROOT`, названный по хосту, порту
+    и имени базы: разные базы не делят одно хранилище, и оно не зависит
+    от текущего каталога.
+    """
+    if settings.EMBEDDINGS_DIR is not None:
+        return settings.EMBEDDINGS_DIR
+
+    url = make_url(settings.DB_URL)
+    database = url.database
+    if url.get_backend_name() == "sqlite" and database and database != ":memory:":
+        db_path = Path(database).resolve()
+        return db_path.with_name(db_path.name + ".embeddings")
+
+    name = f"{url.host or 'local'}_{url.port or ''}_{url.database or 'memory'}"
+    return CACHE_ROOT / re.sub(r"[^\w.-]", "_", name)
+
+
+def _paths() -> Tuple[Path, Path]:
+    """Возвращает пути к файлам идентификаторов и векторов."""
+    root = store_dir()
+    return root / IDS_FILE, root / EMBEDDINGS_FILE
+
+
+def db_fingerprint(session: Session) -> List[int]:
+    """
+    Отпечаток записей с эмбеддингами в БД.
+
+    Количество записей, максимальный id, а также суммы размеров файлов
+    и времени их модификации (в целых секундах): переиндексация файла
+    обновляет его запись на месте, не меняя id, но почти всегда меняет
+    размер или mtime. Разметка кластеров и флаги из GUI на отпечаток
+    не влияют, поэтому хранилище не перестраивается после каждой
+    кластеризации.
+    """
+    stmt = select(
+        func.count(ImageRecord.id),
+        func.max(ImageRecord.id),
+        func.sum(ImageRecord.size_bytes),
+        func.sum(cast(ImageRecord.mtime, BigInteger)),
+    ).where(ImageRecord.embedding.is_not(None))
+    return [int(value or 0) for value in session.execute(stmt).one()]
+
+
+def read_fingerprint() -> Optional[List[int]]:
+    """Отпечаток БД, с которой согласовано хранилище, или `None`."""
+    path = store_dir() / FINGERPRINT_FILE
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def write_fingerprint(fingerprint: List[int]) -> None:
+    """Отмечает хранилище согласованным с БД с данным отпечатком."""
+    path = store_dir() / FINGERPRINT_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(fingerprint), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def invalidate() -> None:
+    """
+    Снимает отметку о согласованности с БД.
+
+    Вызывается перед записью в БД: если запись прервется, следующая
+    загрузка не поверит хранилищу и перестроит его.
+    """
+    (store_dir() / FINGERPRINT_FILE).unlink(missing_ok=True)
+
+
+def is_in_sync(session: Session) -> bool:
+    """Согласовано ли хранилище с текущим содержимым БД."""
+    return read_fingerprint() == db_fingerprint(session)
+
+
+def _complete_rows(ids_path: Path, emb_path: Path) -> int:
+    """Количество записей, целиком присутствующих в обоих файлах."""
+    if not ids_path.exists() or not emb_path.exists():
+        return 0
+    return min(
+        ids_path.stat().st_size // _ID_BYTES,
+        emb_path.stat().st_size // _ROW_BYTES,
+    )
+
+
+def append(ids: np.ndarray, embeddings: np.ndarray) -> None:
+    """
+    Дописывает эмбеддинги в конец хранилища.
+
+    Args:
+        ids: Идентификаторы записей `ImageRecord`, shape (N,).
+        embeddings: Векторы, shape (N, EMBEDDING_DIM).
+    """
+    if len(ids) == 0:
+        return
+
+    ids_path, emb_path = _paths()
+    ids_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Обрезаем недописанный хвост (например, после аварийного завершения),
+    # чтобы строки в обоих файлах оставались выровнены.
+    n = _complete_rows(ids_path, emb_path)
+    with open(emb_path, "ab") as f:
+        f.truncate(n * _ROW_BYTES)
+        f.write(np.ascontiguousarray(embeddings, dtype=np.float16).tobytes())
+    with open(ids_path, "ab") as f:
+        f.truncate(n * _ID_BYTES)
+        f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+
+
+def rewrite(ids: np.ndarray, embeddings: np.ndarray, fingerprint: List[int]) -> None:
+    """
+    Атомарно заменяет содержимое хранилища (компактная перезапись).
+
+    Args:
+        ids: Идентификаторы записей `ImageRecord`, shape (N,).
+        embeddings: Векторы, shape (N, EMBEDDING_DIM).
+        fingerprint: Отпечаток БД (`db_fingerprint`), снятый до чтения
+            этих векторов из нее.
+    """
+    ids_path, emb_path = _paths()
+    ids_path.parent.mkdir(parents=True, exist_ok=True)
+    invalidate()
+
+    for path, data in (
+        (emb_path, np.ascontiguousarray(embeddings, dtype=np.float16)),
+        (ids_path, np.ascontiguousarray(ids, dtype=np.int64)),
+    ):
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data.tobytes())
+        os.replace(tmp_path, path)
+    write_fingerprint(fingerprint)
+
+
+def load() -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Загружает актуальные эмбеддинги из хранилища.
+
+    Returns:
+        Кортеж (ids, embeddings), отсортированный по id, где для каждого id
+        взята последняя дописанная версия вектора. `embeddings` - копия
+        в памяти в `float32`, доступная для записи. `None`, если хранилище
+        пусто.
+    """
+    ids_path, emb_path = _paths()
+    n = _complete_rows(ids_path, emb_path)
+    if n == 0:
+        return None
+
+    ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(n,))
+    embeddings = np.memmap(
+        emb_path, dtype=np.float16, mode="r", shape=(n, EMBEDDING_DIM)
+    )
+
+    # np.unique берет первое вхождение, поэтому ищем по перевернутому массиву
+    unique_ids, first_in_reversed = np.unique(ids[::-1], return_index=True)
+    rows = n - 1 - first_in_reversed
+    return unique_ids, embeddings[rows].astype(np.float32)
@@ -7,19 +7,50 @@
 или проигнорировать кластер.
 
 Основные компоненты:
-- `ImageLoader`: QThread для асинхронной загрузки и масштабирования изображений.
+- `ThumbnailTask`: задача `QThreadPool` для загрузки и масштабирования одной
+  миниатюры в фоновом потоке.
 - `MainWindow`: Основное окно приложения, отображающее список кластеров и сетку
   с изображениями выбранного кластера.
 - `run_gui`: Функция для запуска приложения.
 """
+
+import hashlib
+import logging
+import os
+import shutil
 import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Optional, Tuple
-
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from PyQt6.QtGui import QAction, QPixmap
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from PyQt6.QtCore import (
+    QEventLoop,
+    QObject,
+    QRunnable,
+    QSignalBlocker,
+    QSize,
+    Qt,
+    QThreadPool,
+    QTimer,
+    pyqtSignal,
+)
+from PyQt6.QtGui import (
+    QAction,
+    QImage,
+    QImageIOHandler,
+    QImageReader,
+    QImageWriter,
+    QPixmap,
+    QPixmapCache,
+)
 from PyQt6.QtWidgets import (
     QApplication,
+    QCheckBox,
     QDialog,
     QGridLayout,
     QHBoxLayout,
@@ -30,53 +61,322 @@ from PyQt6.QtWidgets import (
     QMenu,
     QMenuBar,
     QMessageBox,
+    QProgressDialog,
     QPushButton,
     QScrollArea,
     QVBoxLayout,
     QWidget,
 )
-from sqlalchemy import select, update
+from sqlalchemy import Update, bindparam, case, or_, select, update
 from sqlalchemy.orm import Session
 
+from src.config import settings
 from src.db import ImageRecord, SessionLocal
 
+logger = logging.getLogger(__name__)
+
+# pyvips (libvips) - необязательная зависимость: `thumbnail` открывает файл,
+# уменьшает при декодировании и масштабирует за один потоковый проход.
+# Без него миниатюры декодирует QImageReader.
+try:
+    import pyvips
+except (ImportError, OSError):  # OSError - нет самой библиотеки libvips
+    pyvips = None
+
+# Задержка применения выбора кластера в списке, мс
+SELECTION_DEBOUNCE_MS = 150
+
+# Задержка перерисовки ImageViewer при изменении размера окна, мс
+RESIZE_DEBOUNCE_MS = 30
+
+# Задержка фиксации пометок "к удалению" после последнего изменения, мс
+COMMIT_DELAY_MS = 500
+
+# Не чаще какого интервала пересчитывать видимые ячейки при прокрутке, мс
+SCROLL_THROTTLE_MS = 50
+
+# Сколько рядов миниатюр выше и ниже видимой области загружать заранее
+LOOKAHEAD_ROWS = 2
+
+# Сколько строк кластеров читать из БД за одну порцию
+CLUSTER_FETCH_SIZE = 1000
+
+# Через сколько добавленных в список кластеров давать окну перерисоваться
+CLUSTER_LIST_BATCH = 200
+
+# Сколько записей сбрасывать за один шаг отмены всех пометок
+REVERT_CHUNK_SIZE = 500
+
+# Сколько файлов переименовывать параллельно при "удалении"
+RENAME_WORKERS = 8
+
+# Объем кэша готовых миниатюр в памяти (QPixmapCache), КБ
+PIXMAP_CACHE_KB = 200 * 1024
+
+# Сколько новых путей переименованных файлов фиксировать одним UPDATE
+RENAME_COMMIT_BATCH = 1000
+
+# Формат дискового кэша миниатюр: WebP в разы компактнее PNG, что
+# уменьшает объем чтения при повторном открытии кластера. PNG - если
+# плагин WebP в сборке Qt отсутствует.
+THUMBNAIL_FORMAT = "webp" if b"webp" in QImageWriter.supportedImageFormats() else "png"
+THUMBNAIL_QUALITY = 80
+
+# Запросы окна строятся один раз: параметры передаются через bindparam,
+# поэтому скомпилированный SQL берется из кэша SQLAlchemy и не собирается
+# заново при каждом действии
+
+# Записи всех неразобранных кластеров
+CLUSTER_ROWS_STMT = (
+    select(
+        ImageRecord.cluster_id,
+        ImageRecord.id,
+        ImageRecord.path,
+        ImageRecord.size_bytes,
+        ImageRecord.to_delete,
+        ImageRecord.file_hash,
+        ImageRecord.mtime,
+    )
+    .where(ImageRecord.cluster_id.is_not(None), ImageRecord.reviewed.is_(False))
+    .order_by(ImageRecord.cluster_id, ImageRecord.id)
+)
+MARKED_PATHS_STMT = select(ImageRecord.id, ImageRecord.path).where(
+    ImageRecord.to_delete.is_(True)
+)
+MARKED_OR_REVIEWED_IDS_STMT = select(ImageRecord.id).where(
+    or_(ImageRecord.to_delete.is_(True), ImageRecord.reviewed.is_(True))
+)
+# Пометка к удалению одной записи (id, value)
+SET_TO_DELETE_STMT = (
+    update(ImageRecord)
+    .where(ImageRecord.id == bindparam("record_id"))
+    .values(to_delete=bindparam("value"))
+)
+# Снятие всех пометок с записей из списка ids
+REVERT_STMT = (
+    update(ImageRecord)
+    .where(ImageRecord.id.in_(bindparam("ids", expanding=True)))
+    .values(to_delete=False, reviewed=False)
+)
 
-class ImageLoader(QThread):
+# Меняются только записи, показанные пользователю (ids): в кластере могут
+# остаться записи, разобранные до повторной кластеризации, - они не
+# загружаются в окно и не должны помечаться к удалению
+_CLUSTER_UPDATE = update(ImageRecord).where(
+    ImageRecord.cluster_id == bindparam("cid"),
+    ImageRecord.id.in_(bindparam("ids", expanding=True)),
+)
+# Оставить одно изображение (keep_id), остальные пометить к удалению
+KEEP_ONE_STMT = _CLUSTER_UPDATE.values(
+    reviewed=True,
+    to_delete=case((ImageRecord.id == bindparam("keep_id"), False), else_=True),
+)
+IGNORE_STMT = _CLUSTER_UPDATE.values(reviewed=True)
+DELETE_ALL_STMT = _CLUSTER_UPDATE.values(reviewed=True, to_delete=True)
+
+
+@dataclass(slots=True)
+class ClusterImage:
+    """
+    Изображение кластера в объеме, нужном интерфейсу.
+
+    Загружается выборкой отдельных колонок: без создания ORM-объектов
+    и отслеживания их состояния сессией.
     """
-    Поток для асинхронной загрузки изображений.
 
-    Загружает изображения из списка, масштабирует их до размера миниатюр
-    и отправляет сигнал `loaded` с готовым QPixmap.
+    id: int
+    path: str
+    size_bytes: Optional[int]
+    to_delete: bool
+    # Хеш содержимого и время изменения файла на момент индексации
+    file_hash: Optional[str]
+    mtime: Optional[float]
+
+
+class ThumbnailSignals(QObject):
+    """
+    Сигналы задач загрузки миниатюр.
+
+    `QRunnable` не является `QObject` и не может иметь сигналов, поэтому
+    задачи используют общий объект, живущий в GUI-потоке: сигнал из рабочего
+    потока доставляется в слот через очередь событий.
     """
 
-    loaded = pyqtSignal(int, str, QPixmap)  # idx_in_layout, path, pixmap
+    # generation, idx, ключ QPixmapCache, image
+    loaded = pyqtSignal(int, int, str, QImage)
+
 
-    def __init__(self, items: List[Tuple[int, str]]):
+class ThumbnailTask(QRunnable):
+    """
+    Задача для пула потоков: загружает одно изображение в размере миниатюры.
+
+    Готовые миниатюры сохраняются на диск в `settings.THUMBNAIL_CACHE_DIR`,
+    поэтому при повторном открытии кластера читается маленький файл вместо
+    декодирования исходного файла. Ключ кэша - хеш содержимого из БД, пока
+    файл не менялся после индексации: копии одного файла и переименованные
+    файлы используют одну миниатюру. Для измененного файла ключ строится
+    из пути, времени изменения и размера.
+
+    Результат отправляется как `QImage`: в отличие от `QPixmap`, его можно
+    безопасно создавать вне GUI-потока.
+    """
+
+    def __init__(
+        self,
+        generation: int,
+        idx: int,
+        record: ClusterImage,
+        signals: ThumbnailSignals,
+    ):
         """
-        Инициализирует загрузчик изображений.
+        Инициализирует задачу.
 
         Args:
-            items: Список кортежей, где каждый кортеж содержит
-                   индекс виджета в сетке и путь к файлу.
+            generation: Номер загрузки кластера; результаты устаревших
+                        загрузок отбрасываются получателем.
+            idx: Индекс виджета в сетке.
+            record: Изображение; поля копируются, так как запись может
+                    измениться в GUI-потоке во время работы задачи.
+            signals: Объект, через который отправляется результат.
         """
         super().__init__()
-        self.items = items
+        self.generation = generation
+        self.idx = idx
+        self.path_str = record.path
+        self.pixmap_key = pixmap_cache_key(record)
+        self.file_hash = record.file_hash
+        self.indexed_mtime = record.mtime
+        self.indexed_size = record.size_bytes
+        self.signals = signals
 
     def run(self) -> None:
-        """Запускает процесс загрузки изображений."""
-        for idx, path_str in self.items:
-            p = Path(path_str)
-            if p.exists():
-                pix = QPixmap(path_str)
-                if not pix.isNull():
-                    # Масштабируем для миниатюры
-                    pix = pix.scaled(
-                        300,
-                        300,
-                        Qt.AspectRatioMode.KeepAspectRatio,
-                        Qt.TransformationMode.SmoothTransformation,
-                    )
-                    self.loaded.emit(idx, path_str, pix)
+        """Загружает миниатюру из кэша или из файла и отправляет ее."""
+        try:
+            stat = os.stat(self.path_str)
+        except OSError:
+            # Файл не существует или недоступен: пустое изображение
+            # получатель показывает как заглушку
+            self.signals.loaded.emit(
+                self.generation, self.idx, self.pixmap_key, QImage()
+            )
+            return
+
+        # Отдельная проверка exists() не нужна: для отсутствующего
+        # файла кэша QImage просто окажется пустым
+        cache_path = thumbnail_cache_path(self.path_str, stat, self.content_hash(stat))
+        image = QImage(str(cache_path))
+        if image.isNull():
+            image = self.decode()
+            if not image.isNull():
+                save_thumbnail(image, cache_path)
+
+        self.signals.loaded.emit(self.generation, self.idx, self.pixmap_key, image)
+
+    def content_hash(self, stat: os.stat_result) -> Optional[str]:
+        """Хеш из БД, если файл не менялся после индексации, иначе `None`."""
+        if (
+            self.file_hash
+            and self.indexed_mtime is not None
+            and abs(stat.st_mtime - self.indexed_mtime) < 0.001
+            and stat.st_size == self.indexed_size
+        ):
+            return self.file_hash
+        return None
+
+    def decode(self) -> QImage:
+        """Декодирует исходный файл сразу в размере миниатюры."""
+        if pyvips is not None:
+            image = vips_thumbnail(self.path_str)
+            if not image.isNull():
+                return image
+
+        reader = QImageReader(self.path_str)
+        reader.setAutoTransform(True)  # Учитываем ориентацию из EXIF
+        size = reader.size()
+        if size.isValid():
+            # Декодер сразу выдает уменьшенное изображение (для JPEG -
+            # масштабированием в IDCT), без декодирования в полном размере
+            size.scale(300, 300, Qt.AspectRatioMode.KeepAspectRatio)
+            reader.setScaledSize(size)
+            return reader.read()
+
+        # Размер заранее неизвестен: декодируем целиком и уменьшаем.
+        # Для миниатюры быстрого масштабирования достаточно, сглаживание
+        # оставлено только для просмотра в ImageViewer.
+        image = reader.read()
+        if image.width() > 300 or image.height() > 300:
+            image = image.scaled(
+                300,
+                300,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.FastTransformation,
+            )
+        return image
+
+
+def vips_thumbnail(path_str: str) -> QImage:
+    """
+    Строит миниатюру средствами libvips; пустой `QImage` при ошибке,
+    чтобы вызывающий код перешел к QImageReader.
+    """
+    try:
+        # Ориентация из EXIF учитывается автоматически
+        vimg = pyvips.Image.thumbnail(path_str, 300, height=300, size="down")
+        vimg = vimg.colourspace("srgb")
+        if vimg.hasalpha():
+            vimg = vimg.flatten(background=255)
+        vimg = vimg.cast("uchar")[0:3]
+        buf = vimg.write_to_memory()
+    except pyvips.Error:
+        return QImage()
+    # copy() отвязывает изображение от буфера, который будет освобожден
+    return QImage(
+        buf, vimg.width, vimg.height, vimg.width * 3, QImage.Format.Format_RGB888
+    ).copy()
+
+
+def pixmap_cache_key(record: ClusterImage) -> str:
+    """
+    Ключ миниатюры в QPixmapCache: путь и время изменения файла из БД.
+    После переиндексации измененного файла ключ меняется, и старая
+    миниатюра из памяти не показывается.
+    """
+    return f"{record.path}|{record.mtime}"
+
+
+def thumbnail_cache_path(
+    path_str: str, stat: os.stat_result, content_hash: Optional[str] = None
+) -> Path:
+    """
+    Путь к миниатюре в дисковом кэше для данной версии файла.
+
+    Ключ - SHA256 содержимого, если он известен, иначе хеш пути, времени
+    изменения и размера. Ключи разной длины (64 и 32 символа) не пересекаются.
+    """
+    key = (
+        content_hash
+        or hashlib.blake2b(
+            f"{path_str}|{stat.st_mtime_ns}|{stat.st_size}".encode(), digest_size=16
+        ).hexdigest()
+    )
+    return settings.THUMBNAIL_CACHE_DIR / key[:2] / f"{key}.{THUMBNAIL_FORMAT}"
+
+
+def save_thumbnail(image: QImage, cache_path: Path) -> None:
+    """
+    Сохраняет миниатюру в кэш. Запись идет во временный файл с последующим
+    переименованием, чтобы параллельные задачи не прочитали неполный файл.
+    Ошибки записи не критичны: миниатюра просто не будет закэширована.
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(
+            f"{cache_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        if image.save(str(tmp_path), THUMBNAIL_FORMAT, THUMBNAIL_QUALITY):
+            os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
 
 
 class ImageViewer(QDialog):
@@ -84,12 +384,30 @@ class ImageViewer(QDialog):
     Диалоговое окно для просмотра одного изображения.
 
     Масштабирует изображение для заполнения окна с сохранением пропорций.
+    Исходник в полном разрешении в памяти не хранится: файл декодируется
+    сразу в размере, близком к размеру окна.
     """
 
     def __init__(self, image_path: str, parent=None):
         super().__init__(parent)
         self.image_path = image_path
-        self.pixmap = QPixmap(image_path)
+        # Размер изображения с учетом ориентации из EXIF (по заголовку файла)
+        reader = QImageReader(image_path)
+        reader.setAutoTransform(True)
+        self.source_size = reader.size()
+        rotate_90 = QImageIOHandler.Transformation.TransformationRotate90
+        self.rotated = bool(reader.transformation() & rotate_90)
+        if self.rotated:
+            self.source_size.transpose()
+        # Декодированная копия с запасом в 2 раза относительно окна,
+        # из которой масштабируется изображение при изменении размера
+        self.scaled_source: Optional[QPixmap] = None
+
+        # Частые события resize при перетаскивании угла окна объединяются
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(RESIZE_DEBOUNCE_MS)
+        self.resize_timer.timeout.connect(self.update_pixmap)
 
         self.setWindowTitle(f"Просмотр: {Path(image_path).name}")
         layout = QVBoxLayout(self)
@@ -99,11 +417,11 @@ class ImageViewer(QDialog):
         self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.image_label)
 
-        if self.pixmap.isNull():
+        if not self.source_size.isValid():
             self.image_label.setText("Не удалось загрузить изображение.")
         else:
             # Начальный размер с ограничением
-            initial_size = self.pixmap.size()
+            initial_size = QSize(self.source_size)
             if max(initial_size.width(), initial_size.height()) > 900:
                 initial_size = initial_size.scaled(
                     900, 900, Qt.AspectRatioMode.KeepAspectRatio
@@ -113,16 +431,44 @@ class ImageViewer(QDialog):
 
     def resizeEvent(self, a0) -> None:
         """Перерисовывает изображение при изменении размера окна."""
-        self.update_pixmap()
+        self.resize_timer.start()
         super().resizeEvent(a0)
 
+    def read_scaled(self, size: QSize) -> QImage:
+        """Декодирует файл в заданном размере (или полностью, если он пуст)."""
+        reader = QImageReader(self.image_path)
+        reader.setAutoTransform(True)
+        if size.isValid():
+            # Размер задается до поворота по EXIF
+            reader.setScaledSize(size.transposed() if self.rotated else size)
+        return reader.read()
+
     def update_pixmap(self) -> None:
-        """Масштабирует QPixmap до размера QLabel."""
-        if self.pixmap.isNull():
+        """Масштабирует изображение до размера QLabel."""
+        if not self.source_size.isValid():
             return
 
-        scaled_pixmap = self.pixmap.scaled(
-            self.image_label.size(),
+        target = self.image_label.size()
+        fitted = self.source_size.scaled(target, Qt.AspectRatioMode.KeepAspectRatio)
+        source = self.scaled_source
+        if source is None or (
+            source.width() < self.source_size.width()
+            and fitted.width() > source.width()
+        ):
+            # Копия меньше нового размера: декодируем заново с запасом
+            # в 2 раза, а если исходник не намного больше - целиком
+            cache_size = QSize()
+            if self.source_size.width() > 2 * fitted.width():
+                cache_size = fitted * 2
+            image = self.read_scaled(cache_size)
+            if image.isNull():
+                self.image_label.setText("Не удалось загрузить изображение.")
+                return
+            source = QPixmap.fromImage(image)
+            self.scaled_source = source
+
+        scaled_pixmap = source.scaled(
+            target,
             Qt.AspectRatioMode.KeepAspectRatio,
             Qt.TransformationMode.SmoothTransformation,
         )
@@ -137,22 +483,22 @@ class ImageLabel(QLabel):
     в `MainWindow` для отображения меню.
     """
 
-    def __init__(
-        self,
-        record_id: int,
-        image_path: str,
-        parent_window: "MainWindow",
-        *args,
-        **kwargs,
-    ):
+    def __init__(self, parent_window: "MainWindow", *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.record_id = record_id
-        self.image_path = image_path
+        self.record_id = 0
+        self.image_path = ""
         self.parent_window = parent_window
         # Включаем политику контекстного меню для вызова по сигналу
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.customContextMenuRequested.connect(self.show_context_menu)
 
+    def bind(self, record_id: int, image_path: str) -> None:
+        """Привязывает метку к записи и сбрасывает показанную миниатюру."""
+        self.record_id = record_id
+        self.image_path = image_path
+        self.clear()
+        self.setText("Загрузка...")
+
     def show_context_menu(self, pos) -> None:
         """Создает и отображает контекстное меню."""
         menu = QMenu(self)
@@ -196,6 +542,36 @@ class ImageLabel(QLabel):
         viewer.exec()
 
 
+class ImageSlot(QWidget):
+    """
+    Ячейка сетки: миниатюра и подпись с именем и размером файла.
+
+    Ячейки создаются один раз и переиспользуются при смене кластера:
+    меняется только привязка к записи, а не дерево виджетов.
+    """
+
+    def __init__(self, parent_window: "MainWindow"):
+        super().__init__()
+        vbox = QVBoxLayout(self)
+
+        self.image_label = ImageLabel(parent_window=parent_window)
+        self.image_label.setFixedSize(300, 300)
+        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.info_label = QLabel()
+
+        vbox.addWidget(self.image_label)
+        vbox.addWidget(self.info_label)
+
+    def bind(self, record: ClusterImage) -> None:
+        """Показывает в ячейке запись `record`."""
+        self.image_label.bind(record.id, record.path)
+        # Целые килобайты: без деления и форматирования float
+        size_kb = (record.size_bytes or 0) >> 10
+        # basename вместо Path(...).name: без создания объекта пути
+        name = os.path.basename(record.path)
+        self.info_label.setText(f"{name}\n{size_kb} КБ")
+
+
 class MainWindow(QMainWindow):
     """
     Основное окно приложения для просмотра дубликатов.
@@ -219,12 +595,63 @@ class MainWindow(QMainWindow):
 
         self.readonly = readonly
         if self.readonly:
-            print("readonly mode")
+            logger.info("GUI запущен в режиме только для чтения")
 
-        self.session: Session = SessionLocal()
+        # Пометки из контекстного меню фиксируются пачкой по таймеру,
+        # поэтому объекты не должны устаревать после commit
+        self.session: Session = SessionLocal(autoflush=False, expire_on_commit=False)
 
         self.current_cluster_id: Optional[int] = None
-        self.cluster_images: List[ImageRecord] = []
+        self.cluster_images: List[ClusterImage] = []
+        # Записи всех неразобранных кластеров: cluster_id -> записи по id
+        self.cluster_cache: Dict[int, List[ClusterImage]] = {}
+        # Переиспользуемые ячейки сетки, i-я стоит в позиции (i // 3, i % 3)
+        self.slots: List[ImageSlot] = []
+        # Метки миниатюр текущего кластера по id записи
+        self.id_to_label: Dict[int, ImageLabel] = {}
+        # Номера ячеек текущего кластера, для которых загрузка уже запущена
+        self.requested_thumbnails: Set[int] = set()
+
+        # Миниатюры декодируются параллельно в пуле потоков. Номер загрузки
+        # увеличивается при каждой смене кластера, чтобы отбросить
+        # результаты задач, запущенных для предыдущего кластера.
+        self.pool = QThreadPool.globalInstance()
+        self.pool.setMaxThreadCount(os.cpu_count() or 1)
+        self.load_generation = 0
+        self.thumbnail_signals = ThumbnailSignals()
+        self.thumbnail_signals.loaded.connect(self.on_image_loaded)
+        # Миниатюры, уже показанные в этом сеансе, при повторном выборе
+        # кластера (или в другом кластере) берутся из памяти
+        QPixmapCache.setCacheLimit(PIXMAP_CACHE_KB)
+
+        # Выбор кластера применяется с задержкой: при быстрой прокрутке
+        # списка стрелками загружается только кластер, на котором
+        # пользователь остановился
+        self.selection_timer = QTimer(self)
+        self.selection_timer.setSingleShot(True)
+        self.selection_timer.setInterval(SELECTION_DEBOUNCE_MS)
+        self.selection_timer.timeout.connect(self.apply_cluster_selection)
+
+        # События прокрутки приходят десятками в секунду; видимые ячейки
+        # пересчитываются не чаще раза в SCROLL_THROTTLE_MS
+        self.scroll_timer = QTimer(self)
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(SCROLL_THROTTLE_MS)
+        self.scroll_timer.timeout.connect(self.request_visible_thumbnails)
+
+        # Серия пометок фиксируется одним commit после паузы в действиях,
+        # а не отдельной транзакцией с fsync на каждый клик
+        self.commit_timer = QTimer(self)
+        self.commit_timer.setSingleShot(True)
+        self.commit_timer.setInterval(COMMIT_DELAY_MS)
+        self.commit_timer.timeout.connect(self.commit_pending)
+
+        # Пользователь отключил подтверждение "Удалить все" до конца сеанса
+        self.skip_delete_all_confirm = False
+
+        # Отмена всех пометок выполняется по частям между событиями GUI
+        self.revert_steps: Optional[Iterator[int]] = None
+        self.revert_progress: Optional[QProgressDialog] = None
 
         self.init_ui()
         self.init_menu()
@@ -241,7 +668,7 @@ class MainWindow(QMainWindow):
         # Панель слева: Список кластеров
         left_layout = QVBoxLayout()
         self.cluster_list = QListWidget()
-        self.cluster_list.itemClicked.connect(self.on_cluster_selected)
+        self.cluster_list.currentItemChanged.connect(self.on_current_cluster_changed)
         left_layout.addWidget(QLabel("Кластеры (группы > 1)"))
         left_layout.addWidget(self.cluster_list)
 
@@ -274,6 +701,11 @@ class MainWindow(QMainWindow):
         self.grid_layout = QGridLayout(self.grid_widget)
         self.scroll_area.setWidget(self.grid_widget)
         right_layout.addWidget(self.scroll_area)
+        # Миниатюры загружаются по мере появления ячеек в видимой области
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        if scroll_bar:
+            scroll_bar.valueChanged.connect(self.schedule_visible_thumbnails)
+            scroll_bar.rangeChanged.connect(self.schedule_visible_thumbnails)
 
         main_layout.addLayout(left_layout, 1)
         main_layout.addLayout(right_layout, 3)
@@ -299,30 +731,78 @@ class MainWindow(QMainWindow):
                 action_delete.setEnabled(False)
             commands_menu.addAction(action_delete)
 
+            # 3. Очистить кэш миниатюр
+            action_clear_cache = QAction("Очистить кэш миниатюр", self)
+            action_clear_cache.triggered.connect(self.action_clear_thumbnail_cache)
+            commands_menu.addAction(action_clear_cache)
+
             commands_menu.addSeparator()
 
-            # 3. Закрыть
+            # 4. Закрыть
             action_close = QAction("Закрыть", self)
             action_close.triggered.connect(self.close)
             commands_menu.addAction(action_close)
 
     def load_clusters(self) -> None:
-        """Загружает из БД список кластеров, требующих разбора."""
-        stmt = (
-            select(ImageRecord.cluster_id)
-            .where(ImageRecord.cluster_id.is_not(None), ImageRecord.reviewed.is_(False))
-            .distinct()
+        """
+        Загружает из БД список кластеров, требующих разбора.
+
+        Записи всех таких кластеров читаются одним запросом и группируются
+        в `self.cluster_cache`, так что выбор кластера не обращается к БД.
+        """
+        with QSignalBlocker(self.cluster_list):
+            self.cluster_list.clear()
+        self.cluster_cache = {}
+
+        # Строки читаются порциями (на PostgreSQL - серверным курсором),
+        # а кластеры попадают в список по мере чтения. Между порциями окно
+        # перерисовывается, но пользовательский ввод откладывается, чтобы
+        # не выбрать кластер, который еще не дочитан.
+        result = self.session.execute(
+            CLUSTER_ROWS_STMT, execution_options={"yield_per": CLUSTER_FETCH_SIZE}
         )
-        clusters = self.session.execute(stmt).scalars().all()
+        groups = groupby(result, key=itemgetter(0))
+        for n, (cid, rows) in enumerate(groups, start=1):
+            images = [ClusterImage(*row[1:]) for row in rows]
+            self.cluster_cache[cid] = images
+            # Номер кластера хранится в данных элемента, а не разбирается из текста
+            item = QListWidgetItem(f"Кластер #{cid} ({len(images)} фото)")
+            item.setData(Qt.ItemDataRole.UserRole, cid)
+            self.cluster_list.addItem(item)
+            if n % CLUSTER_LIST_BATCH == 0:
+                QApplication.processEvents(
+                    QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents
+                )
 
-        self.cluster_list.clear()
-        for cid in clusters:
-            self.cluster_list.addItem(f"Кластер #{cid}")
+    def on_current_cluster_changed(
+        self, current: Optional[QListWidgetItem], previous: Optional[QListWidgetItem]
+    ) -> None:
+        """Откладывает загрузку кластера до окончания быстрой смены выбора."""
+        if current is not None:
+            self.selection_timer.start()
+
+    def apply_cluster_selection(self) -> None:
+        """Загружает кластер, выбранный в списке на момент срабатывания таймера."""
+        self.commit_pending()
+        item = self.cluster_list.currentItem()
+        if item is not None:
+            self.on_cluster_selected(item)
+
+    def commit_pending(self) -> None:
+        """Фиксирует отложенные пометки, если они есть."""
+        self.commit_timer.stop()
+        if self.session.in_transaction():
+            self.session.commit()
+
+    def closeEvent(self, a0) -> None:
+        """Фиксирует отложенные изменения перед закрытием окна."""
+        self.commit_pending()
+        self.session.close()
+        super().closeEvent(a0)
 
     def on_cluster_selected(self, item: QListWidgetItem) -> None:
         """Обрабатывает выбор кластера из списка."""
-        txt = item.text()
-        cid = int(txt.split("#")[1])
+        cid: int = item.data(Qt.ItemDataRole.UserRole)
         self.current_cluster_id = cid
         self.load_cluster_images(cid)
 
@@ -334,92 +814,154 @@ class MainWindow(QMainWindow):
 
     def load_cluster_images(self, cluster_id: int) -> None:
         """Загружает и отображает изображения для выбранного кластера."""
-        # Очищаем сетку
-        for i in reversed(range(self.grid_layout.count())):
-            item = self.grid_layout.itemAt(i)
-            if item:
-                widget = item.widget()
-                if widget:
-                    widget.setParent(None)
-
-        stmt = (
-            select(ImageRecord)
-            .where(ImageRecord.cluster_id == cluster_id)
-            .order_by(ImageRecord.id)
-        )
-        self.cluster_images = list(self.session.execute(stmt).scalars().all())
-
-        load_queue: List[Tuple[int, str]] = []
-
+        # Отменяем еще не начатые задачи предыдущего кластера
+        self.pool.clear()
+        self.load_generation += 1
+
+        self.cluster_images = self.cluster_cache.get(cluster_id, [])
+
+        # Перерисовка сетки откладывается до конца перестановки ячеек,
+        # чтобы показ и скрытие каждой из них не вызывали отдельный repaint
+        self.grid_widget.setUpdatesEnabled(False)
+
+        # Недостающие ячейки создаются один раз, лишние скрываются
+        while len(self.slots) < len(self.cluster_images):
+            i = len(self.slots)
+            slot = ImageSlot(parent_window=self)
+            self.grid_layout.addWidget(slot, i // 3, i % 3)
+            self.slots.append(slot)
+        for slot in self.slots[len(self.cluster_images) :]:
+            slot.hide()
+
+        self.id_to_label = {
+            img_rec.id: slot.image_label
+            for img_rec, slot in zip(self.cluster_images, self.slots)
+        }
+
+        self.requested_thumbnails = set()
         for i, img_rec in enumerate(self.cluster_images):
-            # Контейнер для одного изображения
-            container = QWidget()
-            vbox = QVBoxLayout(container)
+            slot = self.slots[i]
+            slot.bind(img_rec)
+            slot.show()
 
-            lbl_img = ImageLabel(
-                record_id=img_rec.id, image_path=img_rec.path, parent_window=self
-            )
-            lbl_img.setFixedSize(300, 300)
-            lbl_img.setStyleSheet("border: 1px solid gray;")
-            lbl_img.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            lbl_img.setText("Загрузка...")
-
-            size_kb = (img_rec.size_bytes or 0) / 1024
-            lbl_info = QLabel(f"{Path(str(img_rec.path)).name}\n{size_kb:.1f} КБ")
-
-            vbox.addWidget(lbl_img)
-            vbox.addWidget(lbl_info)
+            self.update_image_style(img_rec)
 
-            # Кнопку больше не создаем, но оставим место для возможного возврата
-            # vbox.addWidget(btn_del)
+            pixmap = QPixmapCache.find(pixmap_cache_key(img_rec))
+            if pixmap is not None:
+                slot.image_label.setPixmap(pixmap)
+                self.requested_thumbnails.add(i)
 
-            self.grid_layout.addWidget(container, i // 3, i % 3)
+        self.grid_widget.setUpdatesEnabled(True)
 
-            # Сохраняем ссылки для последующей логики
-            container.setProperty("rec_id", img_rec.id)
-            container.setProperty("img_label", lbl_img)
+        # Асинхронная загрузка остальных видимых миниатюр. Запрос
+        # откладывается до обработки событий, чтобы раскладка успела
+        # расставить ячейки.
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        if scroll_bar:
+            scroll_bar.setValue(0)
+        QTimer.singleShot(0, self.request_visible_thumbnails)
 
-            self.update_image_style(img_rec)
+    def schedule_visible_thumbnails(self) -> None:
+        """Планирует пересчет видимых ячеек, если он еще не запланирован."""
+        if not self.scroll_timer.isActive():
+            self.scroll_timer.start()
 
-            load_queue.append((i, img_rec.path))
+    def request_visible_thumbnails(self) -> None:
+        """
+        Запускает загрузку миниатюр для ячеек в видимой области прокрутки
+        и в `LOOKAHEAD_ROWS` рядах над и под ней. Видимые ячейки получают
+        приоритет в пуле потоков.
+        """
+        if not self.cluster_images:
+            return
 
-        # Асинхронная загрузка
-        self.loader = ImageLoader(load_queue)
-        self.loader.loaded.connect(self.on_image_loaded)
-        self.loader.start()
+        viewport = self.scroll_area.viewport()
+        if viewport is None:
+            return
+        # Видимая часть сетки в ее собственных координатах
+        visible = viewport.rect().translated(-self.grid_widget.pos())
+        first = self.slots[0].geometry()
+        pitch = first.height() + max(self.grid_layout.verticalSpacing(), 0)
+        margin = LOOKAHEAD_ROWS * pitch
+        ahead = visible.adjusted(0, -margin, 0, margin)
+
+        # Ряды одинаковой высоты: диапазон рядов вычисляется сразу,
+        # без обхода всех ячеек кластера
+        first_row = max(0, (ahead.top() - first.top()) // max(pitch, 1))
+        last_row = (ahead.bottom() - first.top()) // max(pitch, 1)
+        end = min(len(self.cluster_images), (last_row + 1) * 3)
+        for i in range(first_row * 3, end):
+            if i in self.requested_thumbnails:
+                continue
+            img_rec = self.cluster_images[i]
+            geometry = self.slots[i].geometry()
+            if not geometry.intersects(ahead):
+                continue
+            self.requested_thumbnails.add(i)
+            self.pool.start(
+                ThumbnailTask(self.load_generation, i, img_rec, self.thumbnail_signals),
+                1 if geometry.intersects(visible) else 0,
+            )
 
-    def on_image_loaded(self, idx: int, path: str, pixmap: QPixmap) -> None:
+    def on_image_loaded(
+        self, generation: int, idx: int, pixmap_key: str, image: QImage
+    ) -> None:
         """Слот, вызываемый после загрузки изображения."""
-        # Находим виджет в сетке по его позиции
-        item = self.grid_layout.itemAtPosition(idx // 3, idx % 3)
-        if item:
-            widget = item.widget()
-            if widget:
-                lbl = widget.property("img_label")
-                if isinstance(lbl, QLabel):
-                    lbl.setPixmap(pixmap)
-                    lbl.setText("")
-
-    def update_image_style(self, record: ImageRecord) -> None:
+        pixmap = None
+        if not image.isNull():
+            # QPixmap можно создавать только в GUI-потоке. В кэш попадают
+            # и миниатюры уже покинутого кластера: декодирование оплачено.
+            pixmap = QPixmap.fromImage(image)
+            QPixmapCache.insert(pixmap_key, pixmap)
+
+        if generation != self.load_generation:
+            return  # Миниатюра другого кластера
+        if idx >= len(self.slots):
+            return
+        label = self.slots[idx].image_label
+        if pixmap is None:
+            label.setText("Не удалось\nзагрузить")
+            return
+        label.setPixmap(pixmap)
+
+    def update_image_style(self, record: ClusterImage) -> None:
         """Обновляет стиль виджета изображения в зависимости от его статуса."""
-        for i in range(self.grid_layout.count()):
-            item = self.grid_layout.itemAt(i)
-            if not item:
-                continue
+        lbl = self.id_to_label.get(record.id)
+        if lbl is None:
+            return
+        if record.to_delete:
+            # Красная рамка, если помечено к удалению
+            lbl.setStyleSheet(
+                "border: 2px solid red; background-color: rgba(255, 0, 0, 0.1);"
+            )
+        else:
+            # Серая рамка по умолчанию
+            lbl.setStyleSheet("border: 1px solid gray;")
+
+    def update_current_cluster(self, stmt: Update, **params) -> None:
+        """
+        Выполняет для текущего кластера один из заготовленных UPDATE
+        и фиксирует изменения.
 
-            container = item.widget()
-            if container and container.property("rec_id") == record.id:
-                lbl = container.property("img_label")
-                if isinstance(lbl, ImageLabel):
-                    if record.to_delete:
-                        # Красная рамка, если помечено к удалению
-                        lbl.setStyleSheet(
-                            "border: 2px solid red; background-color: rgba(255, 0, 0, 0.1);"
-                        )
-                    else:
-                        # Серая рамка по умолчанию
-                        lbl.setStyleSheet("border: 1px solid gray;")
-                break
+        Вместо изменения каждого ORM-объекта (N строковых UPDATE при
+        commit) выполняется один запрос. Поля `self.cluster_images`
+        вызывающий код обновляет сам, если они еще нужны интерфейсу.
+
+        Args:
+            stmt: Запрос с параметрами `cid` (номер кластера) и `ids`
+                (записи кластера, показанные в окне).
+            **params: Остальные параметры запроса.
+        """
+        self.session.execute(
+            stmt,
+            {
+                "cid": self.current_cluster_id,
+                "ids": [img.id for img in self.cluster_images],
+                **params,
+            },
+            execution_options={"synchronize_session": False},
+        )
+        self.commit_pending()
 
     def action_keep_first(self) -> None:
         """
@@ -433,15 +975,15 @@ class MainWindow(QMainWindow):
             return
 
         # Первый оставляем, остальные помечаем к удалению
-        first = True
-        for img in self.cluster_images:
-            img.reviewed = True
-            if not first:
-                img.to_delete = True
-                print(f"Помечено к удалению: {img.path}")
-            first = False
-
-        self.session.commit()
+        first_id = self.cluster_images[0].id if self.cluster_images else None
+        self.update_current_cluster(KEEP_ONE_STMT, keep_id=first_id)
+        logger.info(
+            "Кластер #%s: помечено к удалению %d из %d",
+            self.current_cluster_id,
+            max(len(self.cluster_images) - 1, 0),
+            len(self.cluster_images),
+        )
+
         self.remove_current_cluster_from_list()
 
     def action_ignore(self) -> None:
@@ -453,9 +995,7 @@ class MainWindow(QMainWindow):
         """
         if self.current_cluster_id is None:
             return
-        for img in self.cluster_images:
-            img.reviewed = True
-        self.session.commit()
+        self.update_current_cluster(IGNORE_STMT)
         self.remove_current_cluster_from_list()
 
     def action_delete_all(self) -> None:
@@ -468,25 +1008,43 @@ class MainWindow(QMainWindow):
         if self.current_cluster_id is None:
             return
 
-        # Запрашиваем подтверждение у пользователя
-        reply = QMessageBox.question(
-            self,
+        if not self.confirm_delete_all():
+            return
+
+        self.update_current_cluster(DELETE_ALL_STMT)
+        logger.info(
+            "Кластер #%s: помечены к удалению все %d",
+            self.current_cluster_id,
+            len(self.cluster_images),
+        )
+
+        self.remove_current_cluster_from_list()
+
+    def confirm_delete_all(self) -> bool:
+        """
+        Запрашивает подтверждение действия "Удалить все".
+
+        Пользователь может отключить вопрос до конца сеанса: при разборе
+        множества кластеров диалог на каждый клик заметно тормозит работу.
+        """
+        if self.skip_delete_all_confirm:
+            return True
+
+        box = QMessageBox(
+            QMessageBox.Icon.Question,
             "Подтверждение",
             "Вы уверены, что хотите пометить ВСЕ изображения в этом кластере к удалению?",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-            QMessageBox.StandardButton.No,
+            self,
         )
+        box.setDefaultButton(QMessageBox.StandardButton.No)
+        checkbox = QCheckBox("Не спрашивать снова в этом сеансе")
+        box.setCheckBox(checkbox)
 
-        if reply == QMessageBox.StandardButton.No:
-            return
-
-        for img in self.cluster_images:
-            img.reviewed = True
-            img.to_delete = True
-            print(f"Помечено к удалению: {img.path}")
-
-        self.session.commit()
-        self.remove_current_cluster_from_list()
+        if box.exec() != QMessageBox.StandardButton.Yes:
+            return False
+        self.skip_delete_all_confirm = checkbox.isChecked()
+        return True
 
     def remove_current_cluster_from_list(self) -> None:
         """
@@ -494,15 +1052,22 @@ class MainWindow(QMainWindow):
         """
         row = self.cluster_list.currentRow()
         if row != -1:
-            self.cluster_list.takeItem(row)
-
-        # Очищаем сетку
-        for i in reversed(range(self.grid_layout.count())):
-            item = self.grid_layout.itemAt(i)
-            if item:
-                widget = item.widget()
-                if widget:
-                    widget.setParent(None)
+            # Следующий кластер не выбираем автоматически: снимаем выделение,
+            # чтобы клик по любому элементу вызвал смену текущего
+            with QSignalBlocker(self.cluster_list):
+                self.cluster_list.takeItem(row)
+                self.cluster_list.setCurrentRow(-1)
+        if self.current_cluster_id is not None:
+            self.cluster_cache.pop(self.current_cluster_id, None)
+
+        # Очищаем сетку одной перерисовкой
+        self.grid_widget.setUpdatesEnabled(False)
+        for slot in self.slots:
+            slot.hide()
+        self.grid_widget.setUpdatesEnabled(True)
+        self.cluster_images = []
+        self.id_to_label = {}
+        self.requested_thumbnails = set()
         self.current_cluster_id = None
 
         # Деактивируем кнопки после обработки
@@ -512,41 +1077,46 @@ class MainWindow(QMainWindow):
 
     def mark_for_deletion(self, record_id: int) -> None:
         """Помечает одно изображение к удалению."""
-        record = self.session.get(ImageRecord, record_id)
+        record = self.set_to_delete(record_id, True)
         if record:
-            record.to_delete = True
-            self.session.commit()
-            print(f"Помечено к удалению: {record.path}")
-            self.update_image_style(record)
+            logger.debug("Помечено к удалению: %s", record.path)
 
     def unmark_for_deletion(self, record_id: int) -> None:
         """Снимает с изображения пометку к удалению."""
-        record = self.session.get(ImageRecord, record_id)
+        record = self.set_to_delete(record_id, False)
         if record:
-            record.to_delete = False
-            self.session.commit()
-            print(f"Снята пометка с: {record.path}")
-            self.update_image_style(record)
+            logger.debug("Снята пометка с: %s", record.path)
+
+    def set_to_delete(self, record_id: int, value: bool) -> Optional[ClusterImage]:
+        """Меняет пометку к удалению у изображения текущего кластера."""
+        record = next((img for img in self.cluster_images if img.id == record_id), None)
+        if record is None:
+            return None
+        self.session.execute(
+            SET_TO_DELETE_STMT,
+            {"record_id": record_id, "value": value},
+            execution_options={"synchronize_session": False},
+        )
+        self.commit_timer.start()
+        record.to_delete = value
+        self.update_image_style(record)
+        return record
 
     def keep_this_delete_others(self, record_to_keep_id: int) -> None:
         """Оставляет выбранное изображение, остальные в кластере помечает к удалению."""
         if self.current_cluster_id is None:
             return
 
-        for img in self.cluster_images:
-            if img.id == record_to_keep_id:
-                img.to_delete = False
-            else:
-                img.to_delete = True
-                print(f"Помечено к удалению: {img.path}")
-            img.reviewed = True  # Помечаем как просмотренное
-
-        self.session.commit()
-
-        # Обновляем стили всех изображений в кластере
-        for img in self.cluster_images:
-            self.update_image_style(img)
+        self.update_current_cluster(KEEP_ONE_STMT, keep_id=record_to_keep_id)
+        logger.info(
+            "Кластер #%s: оставлена запись id=%d, помечено к удалению %d",
+            self.current_cluster_id,
+            record_to_keep_id,
+            len(self.cluster_images) - 1,
+        )
 
+        # Кластер сразу убирается из списка, поэтому записи в памяти
+        # и стили его ячеек не обновляются
         self.remove_current_cluster_from_list()
 
     def action_revert_all_changes(self) -> None:
@@ -555,18 +1125,77 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Режим чтения", "Нельзя вносить изменения.")
             return
 
-        stmt = update(ImageRecord).values(to_delete=False, reviewed=False)
-        self.session.execute(stmt)
-        self.session.commit()
+        if self.revert_steps is not None:
+            return  # Предыдущая отмена еще выполняется
+
+        self.commit_pending()
+        ids = list(self.session.scalars(MARKED_OR_REVIEWED_IDS_STMT))
+
+        self.revert_progress = QProgressDialog(
+            "Снятие пометок...", "Прервать", 0, len(ids), self
+        )
+        self.revert_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.revert_steps = self.iter_revert_chunks(ids)
+        QTimer.singleShot(0, self.revert_step)
+
+    def iter_revert_chunks(self, ids: List[int]) -> Iterator[int]:
+        """
+        Снимает пометки частями по `REVERT_CHUNK_SIZE` записей.
+
+        Каждая часть фиксируется отдельно, поэтому прерванная отмена
+        оставляет базу в согласованном состоянии.
+
+        Yields:
+            Количество обработанных записей.
+        """
+        for start in range(0, len(ids), REVERT_CHUNK_SIZE):
+            chunk = ids[start : start + REVERT_CHUNK_SIZE]
+            self.session.execute(
+                REVERT_STMT,
+                {"ids": chunk},
+                execution_options={"synchronize_session": False},
+            )
+            self.session.commit()
+            yield start + len(chunk)
+
+    def revert_step(self) -> None:
+        """
+        Выполняет один шаг отмены пометок и планирует следующий, оставляя
+        GUI-потоку возможность обработать события между шагами.
+        """
+        if self.revert_steps is None or self.revert_progress is None:
+            return
+        if not self.revert_progress.wasCanceled():
+            done = next(self.revert_steps, None)
+            if done is not None:
+                self.revert_progress.setValue(done)
+                QTimer.singleShot(0, self.revert_step)
+                return
+
+        canceled = self.revert_progress.wasCanceled()
+        self.revert_progress.close()
+        self.revert_steps = None
+        self.revert_progress = None
+
+        self.load_clusters()  # Обновляем список и кэш кластеров
 
         # Обновляем вид кнопок в текущем кластере, если он выбран
         if self.current_cluster_id is not None:
             self.load_cluster_images(self.current_cluster_id)
 
-        QMessageBox.information(
-            self, "Готово", "Все пометки 'к удалению' и 'просмотрено' были сняты."
-        )
-        self.load_clusters()  # Обновляем список кластеров
+        if canceled:
+            QMessageBox.information(
+                self, "Прервано", "Отмена пометок прервана, часть пометок снята."
+            )
+        else:
+            QMessageBox.information(
+                self, "Готово", "Все пометки 'к удалению' и 'просмотрено' были сняты."
+            )
+
+    def action_clear_thumbnail_cache(self) -> None:
+        """Удаляет дисковый кэш миниатюр."""
+        shutil.rmtree(settings.THUMBNAIL_CACHE_DIR, ignore_errors=True)
+        QMessageBox.information(self, "Готово", "Кэш миниатюр очищен.")
 
     def action_delete_marked_files(self) -> None:
         """Переименовывает все файлы, помеченные к удалению."""
@@ -574,8 +1203,12 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Режим чтения", "Нельзя удалять файлы.")
             return
 
-        stmt = select(ImageRecord).where(ImageRecord.to_delete.is_(True))
-        records_to_delete = list(self.session.execute(stmt).scalars().all())
+        self.commit_pending()
+
+        # Нужны только id и путь: полные объекты тянули бы и эмбеддинги
+        records_to_delete: List[Tuple[int, str]] = [
+            (rec_id, path) for rec_id, path in self.session.execute(MARKED_PATHS_STMT)
+        ]
 
         if not records_to_delete:
             QMessageBox.information(
@@ -595,27 +1228,113 @@ class MainWindow(QMainWindow):
         )
 
         if reply == QMessageBox.StandardButton.Yes:
-            deleted_count = 0
             errors = []
+
+            progress = QProgressDialog(
+                "Переименование файлов...", "", 0, len(records_to_delete), self
+            )
+            progress.setCancelButton(None)
+            progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+            # Наличие файлов проверяется одним чтением каталога на каждую
+            # родительскую папку, а не отдельным stat на каждый файл
+            by_parent: Dict[Path, List[Tuple[int, str]]] = defaultdict(list)
             for rec in records_to_delete:
-                try:
-                    p = Path(rec.path)
-                    new_path = p.with_suffix(p.suffix + "._deleted")
-                    if p.exists():
-                        p.rename(new_path)
-                        rec.path = str(new_path)
-                        deleted_count += 1
-                except Exception as e:
-                    errors.append(f"Не удалось переименовать {rec.path}: {e}")
+                by_parent[Path(rec[1]).parent].append(rec)
 
-            self.session.commit()
+            # Переименования выполняются в пуле потоков, а GUI-поток только
+            # собирает результаты и обновляет прогресс
+            with ThreadPoolExecutor(max_workers=RENAME_WORKERS) as executor:
+                listings = dict(
+                    zip(by_parent, executor.map(list_file_names, by_parent))
+                )
+                futures = {}
+                missing = 0
+                for parent, records in by_parent.items():
+                    for rec_id, path in records:
+                        if Path(path).name in listings[parent]:
+                            future = executor.submit(rename_to_deleted, Path(path))
+                            futures[future] = (rec_id, path)
+                        else:
+                            missing += 1
+                progress.setValue(missing)
+
+                # Новые пути сохраняются массовыми UPDATE по первичному ключу
+                # порциями по RENAME_COMMIT_BATCH: при сбое посреди операции
+                # база расходится с диском не больше чем на одну порцию
+                new_paths: Dict[int, str] = {}
+                pending: List[Dict[str, object]] = []
+                for done, future in enumerate(as_completed(futures), missing + 1):
+                    rec_id, path = futures[future]
+                    try:
+                        new_path = future.result()
+                        if new_path is not None:
+                            new_paths[rec_id] = str(new_path)
+                            pending.append({"id": rec_id, "path": str(new_path)})
+                    except Exception as e:
+                        errors.append(f"Не удалось переименовать {path}: {e}")
+                    if len(pending) >= RENAME_COMMIT_BATCH:
+                        self.save_renamed_paths(pending)
+                    progress.setValue(done)
+                    QApplication.processEvents()
+                self.save_renamed_paths(pending)
+
+            deleted_count = len(new_paths)
 
             msg = f"Переименовано {deleted_count} файлов."
             if errors:
                 msg += "\n\nОшибки:\n" + "\n".join(errors)
 
             QMessageBox.information(self, "Отчет", msg)
-            self.load_clusters()  # Обновляем список кластеров
+            # Переименование не меняет состав кластеров: вместо повторного
+            # чтения из БД обновляем пути в кэше
+            self.apply_renamed_paths(new_paths)
+
+    def save_renamed_paths(self, pending: List[Dict[str, object]]) -> None:
+        """Сохраняет накопленные новые пути одним UPDATE и очищает список."""
+        if pending:
+            self.session.execute(update(ImageRecord), pending)
+            self.session.commit()
+            pending.clear()
+
+    def apply_renamed_paths(self, new_paths: Dict[int, str]) -> None:
+        """Обновляет пути переименованных записей в кэше кластеров."""
+        if not new_paths:
+            return
+        for images in self.cluster_cache.values():
+            for img in images:
+                path = new_paths.get(img.id)
+                if path is not None:
+                    img.path = path
+        # Подписи и меню ячеек текущего кластера ссылаются на старые пути
+        if self.current_cluster_id is not None and any(
+            img.id in new_paths for img in self.cluster_images
+        ):
+            self.load_cluster_images(self.current_cluster_id)
+
+
+def list_file_names(directory: Path) -> Set[str]:
+    """Имена записей каталога; пустое множество, если каталог недоступен."""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+    except OSError:
+        return set()
+
+
+def rename_to_deleted(path: Path) -> Optional[Path]:
+    """
+    Переименовывает файл, добавляя суффикс `._deleted`.
+
+    Returns:
+        Новый путь или `None`, если файла уже нет.
+    """
+    new_path = path.with_suffix(path.suffix + "._deleted")
+    try:
+        path.rename(new_path)
+    except FileNotFoundError:
+        return None  # Файл удален после чтения каталога
+    return new_path
 
 
 def run_gui(readonly: bool) -> None:
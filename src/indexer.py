@@ -7,21 +7,31 @@
 проиндексированных и неизмененных файлов) и пакетную обработку
 для эффективности.
 """
+
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import open_clip
 import torch
 from open_clip.model import CLIP
 from PIL import Image, UnidentifiedImageError
 from sqlalchemy import select
-from torch.cuda.amp.autocast_mode import autocast
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
 from torch.utils.data import DataLoader, Dataset
+from torchvision.io import ImageReadMode, decode_jpeg
+from torchvision.transforms import InterpolationMode
+from torchvision.transforms.v2.functional import center_crop, resize
 
+from src import embedding_store
 from src.config import settings
-from src.db import ImageRecord, SessionLocal
-from src.utils import get_file_hash, is_image_file
+from src.db import ImageRecord, SessionLocal, embedding_to_numpy
+from src.utils import IMAGE_SUFFIXES, get_file_hash
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +39,38 @@ logger = logging.getLogger(__name__)
 PreprocessFn = Any  # open_clip может возвращать разные типы, Any - проще всего
 # Возвращаемый тип для __getitem__
 DatasetItem = Tuple[torch.Tensor, str, bool]
+# Элемент JpegBytesDataset: (байты файла, путь, валидность)
+RawItem = Tuple[torch.Tensor, str, bool]
+# Ключ группы побайтовых дубликатов: (размер в байтах, SHA256)
+DuplicateKey = Tuple[int, str]
+# Батч, ожидающий записи: (эмбеддинги на хосте, событие копирования,
+# пути, флаги валидности)
+PendingBatch = Tuple[torch.Tensor, Optional[torch.cuda.Event], List[str], List[bool]]
+
+# Минимальный размер, до которого JPEG уменьшается прямо при декодировании.
+# Вдвое больше входа модели (224), чтобы уменьшение в preprocess оставалось
+# сглаженным.
+DRAFT_SIZE = (448, 448)
+
+# Сколько батчей заранее готовит каждый воркер DataLoader: декодирование
+# JPEG неравномерно по времени, запас сглаживает простои GPU
+PREFETCH_BATCHES = 4
+
+# Сигнатура начала JPEG-файла (маркер SOI)
+JPEG_SIGNATURE = b"\xff\xd8"
+
+# Размеры батча, перебираемые при автоподборе (settings.BATCH_SIZE = 0)
+BATCH_PROBE_SIZES = (8, 16, 32, 64, 128, 256)
+# Доля видеопамяти, оставляемая свободной при автоподборе батча
+BATCH_MEMORY_HEADROOM = 0.15
+# Батч на CPU: больший не ускоряет вычисления, но увеличивает задержку
+CPU_BATCH_SIZE = 8
+
+# Сколько путей проверять на наличие в БД одним запросом
+EXISTING_QUERY_CHUNK = 500
+
+# Потоков для хеширования файлов: работа в основном упирается в диск
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
 
 class ImageDataset(Dataset[DatasetItem]):
@@ -70,7 +112,13 @@ class ImageDataset(Dataset[DatasetItem]):
         """
         path = self.file_paths[idx]
         try:
-            image = Image.open(path).convert("RGB")
+            with Image.open(path) as source:
+                # draft() включает уменьшение в 2-8 раз внутри libjpeg: полный
+                # растр фотографии не декодируется. Вызывать его нужно до
+                # любого чтения пикселей - copy()/load() до draft() заставили
+                # бы декодировать файл целиком. Для не-JPEG вызов ничего не делает.
+                source.draft("RGB", DRAFT_SIZE)
+                image = source.convert("RGB")
             image_tensor = self.preprocess(image)
             return image_tensor, str(path), True
         except (UnidentifiedImageError, OSError) as e:
@@ -80,37 +128,478 @@ class ImageDataset(Dataset[DatasetItem]):
             return torch.zeros((3, 224, 224)), str(path), False
 
 
+class JpegBytesDataset(Dataset[RawItem]):
+    """
+    `Dataset`, отдающий содержимое JPEG-файлов без декодирования.
+
+    Воркеры `DataLoader` только читают файлы, а декодирование (nvJPEG)
+    и предобработка выполняются на GPU в `GpuPreprocess`. Нечитаемые
+    файлы и файлы без сигнатуры JPEG помечаются флагом `valid=False`.
+    """
+
+    def __init__(self, file_paths: List[Path]) -> None:
+        """
+        Инициализирует датасет.
+
+        Args:
+            file_paths: Список путей к файлам изображений.
+        """
+        self.file_paths = file_paths
+
+    def __len__(self) -> int:
+        """Возвращает общее количество изображений в датасете."""
+        return len(self.file_paths)
+
+    def __getitem__(self, idx: int) -> RawItem:
+        """
+        Читает файл по индексу.
+
+        Returns:
+            Кортеж (data, path, is_valid), где `data` - байты файла
+            в виде одномерного тензора `uint8`.
+        """
+        path = self.file_paths[idx]
+        try:
+            data = bytearray(path.read_bytes())
+        except OSError as e:
+            logger.debug(f"Не удалось прочитать файл {path}: {e}")
+            data = bytearray()
+        if not data.startswith(JPEG_SIGNATURE):
+            return torch.empty(0, dtype=torch.uint8), str(path), False
+        return torch.frombuffer(data, dtype=torch.uint8), str(path), True
+
+
+def collate_raw(
+    items: List[RawItem],
+) -> Tuple[List[torch.Tensor], List[str], torch.Tensor]:
+    """Собирает батч `JpegBytesDataset`: файлы разной длины идут списком."""
+    data, paths, valid = zip(*items)
+    return list(data), list(paths), torch.tensor(valid)
+
+
+class GpuPreprocess:
+    """
+    Декодирование JPEG через nvJPEG и предобработка CLIP на GPU.
+
+    Повторяет предобработку open_clip для режимов `squash` и `shortest`
+    с квадратным входом: изменение размера, центральная обрезка,
+    нормализация. Процессор при этом только читает файлы с диска.
+    """
+
+    def __init__(self, cfg: Dict[str, Any], device: str) -> None:
+        """
+        Args:
+            cfg: Параметры предобработки модели (`get_model_preprocess_cfg`).
+            device: CUDA-устройство модели.
+        """
+        size = cfg["size"]
+        self.size = (size, size) if isinstance(size, int) else tuple(size)
+        self.squash = cfg["resize_mode"] == "squash"
+        self.interpolation = (
+            InterpolationMode.BICUBIC
+            if cfg["interpolation"] == "bicubic"
+            else InterpolationMode.BILINEAR
+        )
+        self.mean = torch.tensor(cfg["mean"], device=device).view(3, 1, 1)
+        self.std = torch.tensor(cfg["std"], device=device).view(3, 1, 1)
+        self.device = device
+
+    @staticmethod
+    def supports(cfg: Dict[str, Any]) -> bool:
+        """Проверяет, что предобработку модели можно повторить на GPU."""
+        size = cfg["size"]
+        square = isinstance(size, int) or size[0] == size[1]
+        return cfg["resize_mode"] == "squash" or (
+            cfg["resize_mode"] == "shortest" and square
+        )
+
+    def _decode(self, data: torch.Tensor) -> Optional[torch.Tensor]:
+        """Декодирует JPEG на GPU; форматы, которые nvJPEG не поддерживает
+        (например, CMYK), декодируются на процессоре."""
+        for device in (self.device, "cpu"):
+            try:
+                image = decode_jpeg(data, mode=ImageReadMode.RGB, device=device)
+                return image.to(self.device)
+            except RuntimeError as e:
+                logger.debug(f"Ошибка декодирования JPEG на {device}: {e}")
+        return None
+
+    def _resize(self, image: torch.Tensor) -> torch.Tensor:
+        """Приводит изображение к размеру входа модели."""
+        if self.squash:
+            return resize(image, list(self.size), self.interpolation, antialias=True)
+        image = resize(image, [self.size[0]], self.interpolation, antialias=True)
+        return center_crop(image, list(self.size))
+
+    def __call__(
+        self, data: List[torch.Tensor], valid: torch.Tensor
+    ) -> Tuple[torch.Tensor, List[bool]]:
+        """
+        Декодирует и подготавливает батч.
+
+        Args:
+            data: Содержимое файлов из `JpegBytesDataset`.
+            valid: Флаги успешного чтения файлов.
+
+        Returns:
+            Кортеж (батч float32 на GPU, флаги успешного декодирования).
+        """
+        images: List[torch.Tensor] = []
+        decoded: List[bool] = []
+        for item, ok in zip(data, valid.tolist()):
+            image = self._decode(item) if ok else None
+            if image is None:
+                images.append(
+                    torch.zeros((3, *self.size), dtype=torch.uint8, device=self.device)
+                )
+            else:
+                images.append(self._resize(image))
+            decoded.append(image is not None)
+        batch = torch.stack(images).float().div_(255)
+        return (batch - self.mean) / self.std, decoded
+
+
 def scan_directory(root: Path) -> List[Path]:
     """
     Рекурсивно сканирует директорию и возвращает список путей к файлам изображений.
 
+    Обход через `os.scandir`: тип записи известен из чтения каталога,
+    без отдельного `stat` на каждый файл, а `Path` создается только для
+    подходящих по расширению файлов. Недоступные каталоги пропускаются.
+
     Args:
         root: Корневая директория для сканирования.
 
     Returns:
         Список объектов `Path` для найденных изображений.
     """
-    return [p for p in root.rglob("*") if p.is_file() and is_image_file(p)]
+    files: List[Path] = []
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(
+                        IMAGE_SUFFIXES
+                    ):
+                        files.append(Path(entry.path))
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать каталог: {e}")
+    return files
+
+
+def find_existing(session: Session, files: List[Path]) -> Dict[str, Tuple[float, int]]:
+    """
+    Ищет в БД записи для найденных файлов.
+
+    Пути запрашиваются пачками по `EXISTING_QUERY_CHUNK` через
+    `path IN (...)` по уникальному индексу: читаются только записи
+    сканируемой папки, а не вся таблица.
+
+    Args:
+        session: Сессия БД.
+        files: Пути к файлам.
 
+    Returns:
+        Словарь {путь: (mtime, размер)} для файлов, уже присутствующих в БД.
+    """
+    paths = [str(p) for p in files]
+    existing: Dict[str, Tuple[float, int]] = {}
+    for start in range(0, len(paths), EXISTING_QUERY_CHUNK):
+        stmt = select(
+            ImageRecord.path, ImageRecord.mtime, ImageRecord.size_bytes
+        ).where(ImageRecord.path.in_(paths[start : start + EXISTING_QUERY_CHUNK]))
+        for row in session.execute(stmt):
+            existing[row.path] = (row.mtime, row.size_bytes)
+    return existing
+
+
+def _size_and_hash(path: Path) -> Tuple[int, str]:
+    """Размер и SHA256 файла; пустой хеш, если файл не читается."""
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return 0, ""
+    return size, get_file_hash(path)
+
+
+def group_duplicates(
+    files: List[Path], workers: int = HASH_WORKERS
+) -> Dict[DuplicateKey, List[Path]]:
+    """
+    Группирует побайтовые дубликаты по размеру и хешу содержимого.
 
-def index_images(root_dir: Path, limit: int = 0, force: bool = False) -> None:
+    Эмбеддинг CLIP достаточно вычислить для одного файла из группы.
+    Нечитаемые файлы (пустой хеш) пропускаются с предупреждением.
+    Файлы хешируются в `workers` потоках: чтение с диска и SHA256
+    отпускают GIL, поэтому ожидание ввода-вывода перекрывается.
+
+    Args:
+        files: Список путей к файлам.
+        workers: Количество потоков хеширования.
+
+    Returns:
+        Словарь {(размер, хеш): [пути]} с сохранением исходного порядка.
+    """
+    groups: Dict[DuplicateKey, List[Path]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map возвращает результаты в порядке files
+        for p, (size, file_hash) in zip(files, executor.map(_size_and_hash, files)):
+            if not file_hash:
+                logger.warning(f"Пропуск нечитаемого файла: {p}")
+                continue
+            groups.setdefault((size, file_hash), []).append(p)
+    return groups
+
+
+def find_known_embeddings(
+    session: Session, keys: List[DuplicateKey]
+) -> Dict[DuplicateKey, Any]:
+    """
+    Ищет в БД уже вычисленные эмбеддинги для файлов с тем же содержимым.
+
+    Хеши запрашиваются пачками по `EXISTING_QUERY_CHUNK`: число параметров
+    одного запроса в PostgreSQL ограничено 65535.
+
+    Args:
+        session: Сессия БД.
+        keys: Ключи (размер, хеш) искомых групп.
+
+    Returns:
+        Словарь {(размер, хеш): эмбеддинг} для найденных групп.
+    """
+    if not keys:
+        return {}
+    wanted = set(keys)
+    hashes = sorted({file_hash for _, file_hash in keys})
+    known: Dict[DuplicateKey, Any] = {}
+    for start in range(0, len(hashes), EXISTING_QUERY_CHUNK):
+        stmt = select(
+            ImageRecord.size_bytes, ImageRecord.file_hash, ImageRecord.embedding
+        ).where(
+            ImageRecord.file_hash.in_(hashes[start : start + EXISTING_QUERY_CHUNK]),
+            ImageRecord.embedding.is_not(None),
+        )
+        for row in session.execute(stmt):
+            key = (row.size_bytes, row.file_hash)
+            if key in wanted:
+                known[key] = embedding_to_numpy(row.embedding)
+    return known
+
+
+# Сколько строк передавать в одну команду UPSERT
+UPSERT_BATCH_SIZE = 500
+
+# Столбцы, перезаписываемые при повторной индексации файла
+_UPSERT_COLUMNS = (
+    "mtime",
+    "size_bytes",
+    "file_hash",
+    "embedding",
+    "reviewed",
+    "cluster_id",
+    "to_delete",
+    "updated_at",
+)
+
+
+def _record_values(path: Path, file_hash: str, embedding: Any) -> Dict[str, Any]:
+    """Значения столбцов записи об изображении с новым эмбеддингом."""
+    stat_res = path.stat()
+    return {
+        "path": str(path),
+        "mtime": stat_res.st_mtime,
+        "size_bytes": stat_res.st_size,
+        "file_hash": file_hash,
+        "embedding": embedding,
+        "reviewed": False,
+        "cluster_id": None,  # Сбрасываем кластер при переиндексации
+        "to_delete": False,
+        # Столбец без часового пояса, как и default в db.py: храним UTC
+        "updated_at": datetime.now(timezone.utc).replace(tzinfo=None),
+    }
+
+
+def _upsert_records(session: Session, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Создает или обновляет записи об изображениях пакетно.
+
+    Вместо SELECT и отдельного INSERT/UPDATE на каждый файл выполняется
+    INSERT ... ON CONFLICT (path) DO UPDATE на `UPSERT_BATCH_SIZE` строк.
+
+    Args:
+        session: Сессия БД.
+        rows: Значения столбцов записей (см. `_record_values`).
+
+    Returns:
+        Словарь {путь: id записи}.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        insert = postgresql.insert
+    else:
+        insert = sqlite.insert
+    stmt = insert(ImageRecord)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImageRecord.path],
+        set_={name: stmt.excluded[name] for name in _UPSERT_COLUMNS},
+    ).returning(ImageRecord.path, ImageRecord.id)
+
+    ids: Dict[str, int] = {}
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        result = session.execute(stmt.values(rows[start : start + UPSERT_BATCH_SIZE]))
+        ids.update(result.all())
+    return ids
+
+
+def _model_dtype(device: str) -> torch.dtype:
+    """Тип весов модели: bf16 (или fp16 на старых GPU) на CUDA, fp32 на CPU."""
+    if torch.device(device).type != "cuda":
+        return torch.float32
+    return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+
+def probe_batch_size(model: CLIP, device: str, dtype: torch.dtype) -> int:
+    """
+    Подбирает наибольший батч из `BATCH_PROBE_SIZES`, помещающийся на GPU.
+
+    Размеры пробуются по возрастанию прогоном нулевого батча через модель.
+    Перебор останавливается на нехватке памяти или когда пиковое
+    потребление превышает `1 - BATCH_MEMORY_HEADROOM` доступной процессу
+    видеопамяти: свободной плюс уже занятой этим процессом (модель, кэш
+    аллокатора). Память других процессов на той же видеокарте в бюджет
+    не входит, запас нужен под фрагментацию и рост их потребления.
+
+    Args:
+        model: Загруженная модель CLIP.
+        device: Устройство модели.
+        dtype: Тип весов модели.
+
+    Returns:
+        Размер батча; `CPU_BATCH_SIZE` для CPU.
+    """
+    if torch.device(device).type != "cuda":
+        return CPU_BATCH_SIZE
+
+    size = getattr(model.visual, "image_size", 224)
+    height, width = size if isinstance(size, tuple) else (size, size)
+    free, _ = torch.cuda.mem_get_info(device)
+    budget = free + torch.cuda.memory_reserved(device)
+    limit = budget * (1 - BATCH_MEMORY_HEADROOM)
+
+    best = BATCH_PROBE_SIZES[0]
+    with torch.inference_mode():
+        for batch_size in BATCH_PROBE_SIZES:
+            torch.cuda.reset_peak_memory_stats(device)
+            try:
+                probe = torch.zeros(
+                    (batch_size, 3, height, width), device=device, dtype=dtype
+                )
+                model.encode_image(probe)
+                torch.cuda.synchronize(device)
+            except torch.cuda.OutOfMemoryError:
+                break
+            if torch.cuda.max_memory_allocated(device) > limit:
+                break
+            best = batch_size
+    torch.cuda.empty_cache()
+    logger.info(f"Размер батча подобран под видеопамять: {best}")
+    return best
+
+
+def _gpu_preprocess(model: CLIP, device: str) -> Optional[GpuPreprocess]:
+    """Предобработка на GPU, если она включена и применима к модели."""
+    if not settings.GPU_JPEG_DECODE or torch.device(device).type != "cuda":
+        return None
+    cfg = open_clip.get_model_preprocess_cfg(model)
+    return GpuPreprocess(cfg, device) if GpuPreprocess.supports(cfg) else None
+
+
+def _pad_batch(batch: torch.Tensor, size: int) -> torch.Tensor:
+    """Дополняет батч нулевыми изображениями до `size` элементов."""
+    padding = batch.new_zeros((size - len(batch), *batch.shape[1:]))
+    return torch.cat([batch, padding])
+
+
+def _store_batch(
+    session: Session,
+    representatives: Dict[str, Tuple[DuplicateKey, List[Path]]],
+    features: torch.Tensor,
+    copied: Optional[torch.cuda.Event],
+    batch_paths: List[str],
+    batch_valid: List[bool],
+) -> None:
+    """
+    Сохраняет эмбеддинги батча в БД и файловое хранилище.
+
+    Args:
+        session: Сессия БД.
+        representatives: {путь представителя: (ключ группы, пути группы)}.
+        features: Нормированные эмбеддинги батча (fp16) в памяти хоста.
+        copied: Событие завершения копирования `features` с GPU.
+        batch_paths: Пути изображений батча.
+        batch_valid: Флаги успешного чтения изображений.
+    """
+    if copied is not None:
+        copied.synchronize()
+    features_cpu = features.numpy()
+    batch_rows: List[Dict[str, Any]] = []
+    feature_rows: List[int] = []
+
+    for i, path_str in enumerate(batch_paths):
+        if not batch_valid[i]:
+            logger.warning(f"Пропуск поврежденного изображения: {path_str}")
+            continue
+
+        key, paths = representatives[path_str]
+        # HALFVEC принимает массив numpy: без списка из float
+        embedding = features_cpu[i]
+        for p in paths:
+            batch_rows.append(_record_values(p, key[1], embedding))
+            feature_rows.append(i)
+
+    # Одна команда UPSERT и один commit на батч
+    ids = _upsert_records(session, batch_rows)
+    session.commit()
+    stored_ids = np.array([ids[row["path"]] for row in batch_rows], dtype=np.int64)
+    embedding_store.append(stored_ids, features_cpu[feature_rows])
+    logger.info(f"Обработан батч из {len(batch_paths)} изображений.")
+
+
+def _finish_indexing(store_in_sync: bool) -> None:
+    """Снова отмечает файловое хранилище согласованным с БД после записи."""
+    if store_in_sync:
+        with SessionLocal() as session:
+            embedding_store.write_fingerprint(embedding_store.db_fingerprint(session))
+    logger.info("Индексация успешно завершена.")
+
+
+def index_images(
+    root_dir: Path, limit: int = 0, force: bool = False, workers: int = 0
+) -> None:
     """
     Основная функция для индексации изображений в директории.
 
     Процесс состоит из нескольких шагов:
     1. Сканирование директории для поиска всех файлов изображений.
     2. Фильтрация файлов: исключение тех, что уже есть в БД и не изменялись.
-    3. Загрузка модели CLIP.
-    4. Создание `DataLoader` для пакетной обработки.
-    5. Вычисление эмбеддингов и сохранение/обновление записей в БД.
+    3. Группировка побайтовых дубликатов: эмбеддинг вычисляется для одного
+       файла группы или берется из БД, если такое содержимое уже известно.
+    4. Загрузка модели CLIP.
+    5. Создание `DataLoader` для пакетной обработки.
+    6. Вычисление эмбеддингов и сохранение/обновление записей в БД.
 
     Args:
         root_dir: Директория с изображениями для индексации.
         limit: Максимальное количество файлов для обработки (0 - без лимита).
         force: Если `True`, переиндексировать все файлы, игнорируя кэш.
+        workers: Количество потоков хеширования файлов
+            (0 - `HASH_WORKERS`, по числу ядер).
     """
     logger.info(f"Сканирование директории: {root_dir}...")
-    all_files = scan_directory(root_dir)
+    # В БД хранятся абсолютные пути, независимо от того, как указана папка
+    all_files = scan_directory(root_dir.absolute())
     if limit > 0:
         all_files = all_files[:limit]
 
@@ -119,17 +608,12 @@ def index_images(root_dir: Path, limit: int = 0, force: bool = False) -> None:
     # Шаг 1: Фильтрация файлов для обеспечения идемпотентности
     files_to_process: List[Path] = []
     with SessionLocal() as session:
-        # Загружаем существующие записи для быстрой проверки
-        stmt = select(ImageRecord.path, ImageRecord.mtime, ImageRecord.size_bytes)
-        existing_rows = session.execute(stmt).all()
-        existing_map = {row.path: (row.mtime, row.size_bytes) for row in existing_rows}
+        existing_map = {} if force else find_existing(session, all_files)
 
     for p in all_files:
-        p_str = str(p.absolute())
-        stat = p.stat()
-
-        if not force and p_str in existing_map:
-            old_mtime, old_size = existing_map[p_str]
+        if str(p) in existing_map:
+            stat = p.stat()
+            old_mtime, old_size = existing_map[str(p)]
             # Сравниваем время модификации и размер для определения изменений
             if abs(stat.st_mtime - old_mtime) < 0.001 and stat.st_size == old_size:
                 continue  # Файл не изменился, пропускаем
@@ -141,7 +625,42 @@ def index_images(root_dir: Path, limit: int = 0, force: bool = False) -> None:
         logger.info("Нет файлов для индексации. Завершение.")
         return
 
-    # Шаг 2: Подготовка модели
+    # Файловое хранилище останется согласованным с БД, только если было
+    # согласовано до записи; до конца индексации отметка снимается
+    with SessionLocal() as session:
+        store_in_sync = embedding_store.is_in_sync(session)
+    embedding_store.invalidate()
+
+    # Шаг 2: Группировка побайтовых дубликатов
+    groups = group_duplicates(files_to_process, workers or HASH_WORKERS)
+    if not force:
+        with SessionLocal() as session:
+            known = find_known_embeddings(session, list(groups))
+            rows: List[Dict[str, Any]] = []
+            for key, embedding in known.items():
+                for p in groups.pop(key):
+                    rows.append(_record_values(p, key[1], embedding))
+            ids = _upsert_records(session, rows)
+            session.commit()
+        stored_ids = np.array([ids[row["path"]] for row in rows], dtype=np.int64)
+        stored_embeddings = np.array(
+            [row["embedding"] for row in rows], dtype=np.float32
+        )
+        embedding_store.append(stored_ids, stored_embeddings)
+        if rows:
+            logger.info(f"Эмбеддинги взяты из БД для {len(rows)} копий файлов.")
+
+    # По одному представителю на группу; остальные получат его эмбеддинг
+    representatives = {str(paths[0]): (key, paths) for key, paths in groups.items()}
+    logger.info(
+        f"Уникальных по содержимому файлов для вычисления эмбеддингов: "
+        f"{len(representatives)}"
+    )
+    if not representatives:
+        _finish_indexing(store_in_sync)
+        return
+
+    # Шаг 3: Подготовка модели
     device = settings.DEVICE if torch.cuda.is_available() else "cpu"
     logger.info(f"Загрузка модели {settings.CLIP_MODEL_NAME} на устройстве {device}...")
     model: CLIP
@@ -152,53 +671,73 @@ def index_images(root_dir: Path, limit: int = 0, force: bool = False) -> None:
         device=device,
     )
     model.eval()
-
-    dataset = ImageDataset(files_to_process, preprocess)
-    dataloader: DataLoader[DatasetItem] = DataLoader(
+    # Веса сразу в половинной точности вместо autocast: без приведения
+    # типов на каждом проходе и вдвое меньше памяти под активации
+    model_dtype = _model_dtype(device)
+    model.to(dtype=model_dtype)
+
+    batch_size = settings.BATCH_SIZE or probe_batch_size(model, device, model_dtype)
+    encode_image = model.encode_image
+    compiled = settings.TORCH_COMPILE and torch.device(device).type == "cuda"
+    if compiled:
+        # reduce-overhead записывает проход в CUDA Graph: форма входа
+        # должна быть постоянной, поэтому последний батч дополняется нулями
+        encode_image = torch.compile(encode_image, mode="reduce-overhead")
+
+    files = [paths[0] for paths in groups.values()]
+    gpu_preprocess = _gpu_preprocess(model, device)
+    dataset: Dataset[Any]
+    if gpu_preprocess is not None:
+        logger.info("JPEG декодируются на GPU (nvJPEG).")
+        dataset = JpegBytesDataset(files)
+    else:
+        dataset = ImageDataset(files, preprocess)
+    dataloader: DataLoader[Any] = DataLoader(
         dataset,
-        batch_size=settings.BATCH_SIZE,
+        batch_size=batch_size,
+        collate_fn=collate_raw if gpu_preprocess is not None else None,
         num_workers=settings.NUM_WORKERS,
-        pin_memory=True,
+        # Закрепленная память нужна только для асинхронного копирования на GPU
+        pin_memory=torch.device(device).type == "cuda",
+        # prefetch_factor допустим только при параллельной загрузке
+        prefetch_factor=PREFETCH_BATCHES if settings.NUM_WORKERS > 0 else None,
     )
 
-    # Шаг 3: Вычисление эмбеддингов и сохранение в БД
-    with SessionLocal() as session:
-        with torch.no_grad(), autocast(enabled=(device == "cuda")):
-            for batch_imgs, batch_paths, batch_valid in dataloader:
-                batch_imgs = batch_imgs.to(device)
-
-                # Вычисляем эмбеддинги для всего батча,
-                # затем отфильтровываем невалидные изображения.
-                features = model.encode_image(batch_imgs)
-                features /= features.norm(dim=-1, keepdim=True)
-
-                features_cpu = features.cpu().numpy()
-
-                for i, path_str in enumerate(batch_paths):
-                    if not batch_valid[i]:
-                        logger.warning(f"Пропуск поврежденного изображения: {path_str}")
-                        continue
-
-                    p_obj = Path(path_str)
-                    stat_res = p_obj.stat()
-                    file_hash = get_file_hash(p_obj)
-
-                    # Логика Upsert: обновляем существующую запись или создаем новую
-                    record = session.query(ImageRecord).filter_by(path=path_str).first()
-                    if record is None:
-                        record = ImageRecord(path=path_str)
-                        session.add(record)
-
-                    # Обновляем поля записи
-                    record.mtime = stat_res.st_mtime
-                    record.size_bytes = stat_res.st_size
-                    record.file_hash = file_hash
-                    record.embedding = features_cpu[i].tolist()
-                    record.reviewed = False
-                    record.cluster_id = None  # Сбрасываем кластер при переиндексации
-                    record.to_delete = False
-
-                session.commit()
-                logger.info(f"Обработан батч из {len(batch_paths)} изображений.")
-
-    logger.info("Индексация успешно завершена.")
+    # Шаг 4: Вычисление эмбеддингов и сохранение в БД.
+    # Результаты батча записываются в БД после запуска следующего батча:
+    # копирование с GPU и запись в БД идут, пока GPU считает дальше.
+    on_cuda = torch.device(device).type == "cuda"
+    pending: Optional[PendingBatch] = None
+    with SessionLocal() as session, torch.inference_mode():
+        for batch_imgs, batch_paths, batch_valid in dataloader:
+            if gpu_preprocess is not None:
+                batch_imgs, batch_valid = gpu_preprocess(batch_imgs, batch_valid)
+            batch_imgs = batch_imgs.to(device, dtype=model_dtype, non_blocking=True)
+
+            # Вычисляем эмбеддинги для всего батча,
+            # затем отфильтровываем невалидные изображения.
+            # Нормируем во fp32: сумма квадратов в bf16 теряет точность
+            n = len(batch_imgs)
+            if compiled and n < batch_size:
+                batch_imgs = _pad_batch(batch_imgs, batch_size)
+            features = encode_image(batch_imgs)[:n].float()
+            features /= features.norm(dim=-1, keepdim=True)
+
+            # В БД векторы хранятся в halfvec, храним ту же точность
+            # и в файловом хранилище. Приводим к fp16 еще на устройстве:
+            # вдвое меньше данных при копировании с GPU. Копирование
+            # с non_blocking идет в закрепленную память без ожидания GPU,
+            # о его завершении сообщает событие.
+            features_host = features.half().to("cpu", non_blocking=True)
+            copied = torch.cuda.Event() if on_cuda else None
+            if copied is not None:
+                copied.record()
+
+            if pending is not None:
+                _store_batch(session, representatives, *pending)
+            pending = (features_host, copied, list(batch_paths), list(batch_valid))
+
+        if pending is not None:
+            _store_batch(session, representatives, *pending)
+
+    _finish_indexing(store_in_sync)
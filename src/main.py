@@ -4,22 +4,22 @@
 Этот модуль использует Typer для создания интерфейса командной строки (CLI)
 с вложенными командами для управления медиафайлами и поиском дубликатов.
 """
+
 from pathlib import Path
 from typing import Annotated, Optional
 
 import typer
 
 # --- Импорты из под-модулей ---
-# Прямые импорты, так как структура проекта теперь плоская внутри src
-from .clusterer import cluster_images
-from .db import init_db
-from .gui import run_gui
-from .indexer import index_images
+# Прямые импорты, так как структура проекта теперь плоская внутри src.
+# Тяжелые модули (torch, open_clip, faiss, Qt, а также SQLAlchemy с
+# созданием движка БД) импортируются внутри команд, чтобы --help
+# и легкие команды запускались без них
 from .utils import setup_logging
 
-# Импорты из нового модуля 'manage'
-from .manage.sorter import process_files
-from .manage.mp4_fixer import Mp4DateFixer, DEFAULT_TZ
+# Импорты из нового модуля 'manage' (mp4_fixer использует только
+# стандартную библиотеку, а его константы нужны для значений по умолчанию)
+from .manage.mp4_fixer import Mp4DateFixer, DEFAULT_TZ, DEFAULT_WORKERS
 
 
 # --- Главное приложение ---
@@ -40,6 +40,8 @@ duplicates_app = typer.Typer(
 @duplicates_app.command("init")
 def duplicates_init() -> None:
     """Инициализирует таблицы в базе данных для поиска дубликатов."""
+    from .db import init_db
+
     init_db()
     typer.echo("База данных для дубликатов успешно инициализирована.")
 
@@ -56,17 +58,27 @@ def duplicates_index(
     force: Annotated[
         bool, typer.Option("--force", help="Принудительно переиндексировать все файлы")
     ] = False,
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers", help="Кол-во потоков хеширования файлов (0 = по числу ядер)"
+        ),
+    ] = 0,
 ) -> None:
     """Сканирует папку с изображениями и вычисляет для них эмбеддинги."""
+    from .indexer import index_images
+
     if not path.exists():
         typer.echo(f"Ошибка: Указанный путь не существует: {path}")
         raise typer.Exit(code=1)
-    index_images(path, limit, force)
+    index_images(path, limit, force, workers)
 
 
 @duplicates_app.command("cluster")
 def duplicates_cluster() -> None:
     """Группирует похожие изображения на основе их эмбеддингов."""
+    from .clusterer import cluster_images
+
     cluster_images()
 
 
@@ -83,6 +95,8 @@ def duplicates_review(
     ] = False,
 ) -> None:
     """Запускает GUI для ручного разбора кластеров дубликатов."""
+    from .gui import run_gui
+
     run_gui(readonly=readonly)
 
 
@@ -111,18 +125,27 @@ def manage_sort(
         ),
     ] = None,
     recursive: Annotated[
-        bool, typer.Option("-R", "--recursive", help="Рекурсивный обход исходной папки.")
+        bool,
+        typer.Option("-R", "--recursive", help="Рекурсивный обход исходной папки."),
     ] = False,
 ) -> None:
     """Сортирует фото и видео по папкам на основе даты создания."""
-    source_path = load_path.resolve()
-    destination_path = save_path.resolve() if save_path else source_path
+    from .manage.sorter import process_files
+
+    # absolute() не обходит компоненты пути с lstat, в отличие от resolve():
+    # символические ссылки раскрывать не нужно
+    source_path = load_path.absolute()
+    destination_path = save_path.absolute() if save_path else source_path
 
     if not source_path.is_dir():
         typer.echo(f"Ошибка: Исходная папка '{source_path}' не существует.")
         raise typer.Exit(1)
 
-    destination_path.mkdir(exist_ok=True)
+    try:
+        destination_path.mkdir(exist_ok=True)
+    except (FileExistsError, NotADirectoryError):
+        typer.echo(f"Ошибка: Путь '{destination_path}' не является папкой.")
+        raise typer.Exit(1)
     process_files(source_path, destination_path, recursive)
     typer.echo("Сортировка завершена.")
 
@@ -134,16 +157,44 @@ def manage_fix_mp4_date(
         bool, typer.Option("--dry-run", help="Не изменять файлы, только логировать.")
     ] = False,
     limit: Annotated[
-        Optional[int], typer.Option("--limit", help="Макс. кол-во файлов для обработки.")
+        Optional[int],
+        typer.Option("--limit", help="Макс. кол-во файлов для обработки."),
     ] = None,
     timezone: Annotated[
-        str, typer.Option("--timezone", help=f"Временная зона (по умолчанию: {DEFAULT_TZ})")
+        str,
+        typer.Option("--timezone", help=f"Временная зона (по умолчанию: {DEFAULT_TZ})"),
     ] = DEFAULT_TZ,
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers", help="Кол-во параллельных процессов exiftool для записи."
+        ),
+    ] = DEFAULT_WORKERS,
+    paranoid: Annotated[
+        bool,
+        typer.Option(
+            "--paranoid",
+            help="Проверять каждую запись повторным чтением (с бэкапом и откатом).",
+        ),
+    ] = False,
+    force: Annotated[
+        bool,
+        typer.Option(
+            "--force",
+            help="Проверять метаданные и у файлов, чье время изменения уже совпадает.",
+        ),
+    ] = False,
 ) -> None:
     """Обновляет метаданные MP4 на основе даты из имени родительской папки."""
     try:
         fixer = Mp4DateFixer(
-            root=root, dry_run=dry_run, limit=limit, timezone_str=timezone
+            root=root,
+            dry_run=dry_run,
+            limit=limit,
+            timezone_str=timezone,
+            workers=workers,
+            paranoid=paranoid,
+            force=force,
         )
         fixer.run()
         typer.echo("Исправление дат MP4 завершено.")
@@ -0,0 +1,87 @@
+"""
+Кэш дат съемки для `manage sort`.
+
+Чтение EXIF и запуск ffprobe/exiftool стоят десятки-сотни миллисекунд на
+файл, поэтому найденные даты сохраняются в небольшой SQLite-базе. Ключ -
+устройство, inode, время изменения и размер файла: при изменении файла
+запись автоматически перестает совпадать, а перемещение в пределах одной
+файловой системы (именно так `sort` раскладывает файлы) ключ не меняет.
+"""
+
+import datetime
+import os
+import sqlite3
+from pathlib import Path
+from types import TracebackType
+from typing import List, Optional, Self, Tuple, Type
+
+# Имя файла кэша в исходной папке
+DATE_CACHE_NAME = ".exif_cache.sqlite3"
+
+# Сколько новых записей накапливать перед записью в базу
+FLUSH_EVERY = 128
+
+CacheKey = Tuple[int, int, int, int]
+
+
+def cache_key(stat: os.stat_result) -> CacheKey:
+    """Ключ кэша по результату `stat` файла."""
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class DateCache:
+    """Персистентный кэш `ключ файла -> дата` поверх SQLite."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dates ("
+            " dev INTEGER, ino INTEGER, mtime_ns INTEGER, size INTEGER,"
+            " date TEXT NOT NULL,"
+            " PRIMARY KEY (dev, ino, mtime_ns, size))"
+        )
+        self._pending: List[Tuple[int, int, int, int, str]] = []
+
+    def get(self, stat: os.stat_result) -> Optional[datetime.date]:
+        """Возвращает сохраненную дату или `None`, если файла нет в кэше."""
+        row = self.conn.execute(
+            "SELECT date FROM dates"
+            " WHERE dev = ? AND ino = ? AND mtime_ns = ? AND size = ?",
+            cache_key(stat),
+        ).fetchone()
+        return datetime.date.fromisoformat(row[0]) if row else None
+
+    def put(self, stat: os.stat_result, date: datetime.date) -> None:
+        """Добавляет дату в кэш; запись в базу идет пачками."""
+        self._pending.append((*cache_key(stat), date.isoformat()))
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        """Записывает накопленные даты одной транзакцией."""
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO dates VALUES (?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending.clear()
+
+    def close(self) -> None:
+        """Сохраняет несохраненные записи и закрывает базу."""
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import queue
 import sys
 import re
 import json
@@ -9,10 +10,13 @@ import shutil
 import logging
 import argparse
 import subprocess
+import threading
+from functools import cache
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from typing import Optional, Dict, Any
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Self, Tuple
 
 # --- Конфигурация ---
 TARGET_TIME = "12:00:00"
@@ -32,6 +36,19 @@ TARGET_TAGS = [
 # Тег, по которому определяем, нужно ли менять файл (Вариант Б: Мягкий режим)
 PRIMARY_CHECK_TAG = "QuickTime:CreateDate"
 
+# Потоков записи по умолчанию (у каждого свой процесс exiftool). Больше
+# 4 на обычном диске не ускоряет: упираемся в ввод-вывод
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Сколько файлов передавать в одну команду чтения метаданных
+METADATA_BATCH_SIZE = 256
+
+# Дата YYYY-MM-DD в начале имени папки
+DATE_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})")
+
+# Отчет exiftool об успешной записи хотя бы одного файла
+UPDATED_RE = re.compile(r"^\s*[1-9]\d* image files updated", re.MULTILINE)
+
 # --- Логирование ---
 logger = logging.getLogger("Mp4Fixer")
 
@@ -50,19 +67,184 @@ def setup_logging(log_path: str, verbose: bool):
     logger.addHandler(console_handler)
 
 
+def iter_mp4_files(root: Path) -> Iterator[Path]:
+    """
+    Рекурсивно перечисляет MP4 файлы (без учета регистра расширения).
+
+    Обход через `os.scandir`: тип записи известен из чтения каталога, поэтому
+    нет отдельного `stat` на каждый файл, а `Path` создается только для MP4.
+    """
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(".mp4") and entry.is_file():
+                        yield Path(entry.path)
+        except OSError as e:
+            logger.warning(f"Could not read directory: {e}")
+
+
+@cache
+def date_from_folder_name(folder_name: str) -> Optional[str]:
+    """
+    Дата из имени папки. Кэшируется: в одной папке обычно много файлов.
+    """
+    match = DATE_RE.match(folder_name)
+    return match.group(1) if match else None
+
+
+@cache
+def target_datetime(date_str: str, tz: ZoneInfo) -> datetime:
+    """
+    Создает aware datetime объект: YYYY-MM-DD TARGET_TIME в зоне tz.
+    """
+    dt_str = f"{date_str} {TARGET_TIME}"
+    # Парсим как naive и присваиваем таймзону
+    dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
+    return dt.replace(tzinfo=tz)
+
+
 class ExifToolError(Exception):
     pass
 
 
+class ExifToolDaemon:
+    """
+    Долгоживущий процесс exiftool в режиме `-stay_open`.
+
+    Запуск exiftool (загрузка интерпретатора Perl и модулей) занимает
+    ~200 мс, а чтение тегов одного файла - миллисекунды. Поэтому процесс
+    запускается один раз, а команды передаются ему построчно через stdin.
+    Конец вывода каждой команды отмечается маркером `{readyN}` в stdout
+    и такой же строкой в stderr (через `-echo4`). Stderr непрерывно
+    вычитывается отдельным потоком в очередь: иначе при множестве ошибок
+    в пачке файлов exiftool заблокировался бы на записи в заполненный
+    канал stderr, так и не выдав маркер в stdout.
+    """
+
+    def __init__(self) -> None:
+        self.process: Optional[subprocess.Popen] = None
+        self.counter = 0
+        self._stderr_lines: "queue.Queue[str]" = queue.Queue()
+        self._stderr_thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(
+            ["exiftool", "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+        )
+        self._stderr_lines = queue.Queue()
+        self._stderr_thread = threading.Thread(
+            target=self._drain,
+            args=(self.process.stderr, self._stderr_lines),
+            daemon=True,
+        )
+        self._stderr_thread.start()
+
+    @staticmethod
+    def _drain(stream: IO[str], lines: "queue.Queue[str]") -> None:
+        """Переносит строки потока в очередь; пустая строка - конец потока."""
+        for line in stream:
+            lines.put(line)
+        lines.put("")
+
+    def execute(self, *args: str) -> Tuple[str, str]:
+        """
+        Выполняет одну команду exiftool (запускает процесс при первом вызове).
+
+        Returns:
+            Кортеж (stdout, stderr) команды.
+        """
+        if self.process is None:
+            self.start()
+        assert self.process is not None
+        assert self.process.stdin and self.process.stdout
+
+        self.counter += 1
+        marker = f"{{ready{self.counter}}}"
+        # Аргументы передаются по одному в строке, поэтому пробелы
+        # в путях не требуют экранирования
+        lines = [*args, "-echo4", marker, f"-execute{self.counter}"]
+        try:
+            self.process.stdin.write("\n".join(lines) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise ExifToolError(f"exiftool is not running: {e}") from e
+        return (
+            self._read_until(self.process.stdout.readline, marker),
+            self._read_until(self._stderr_lines.get, marker),
+        )
+
+    @staticmethod
+    def _read_until(readline: Callable[[], str], marker: str) -> str:
+        output = []
+        while True:
+            line = readline()
+            if not line:
+                raise ExifToolError("exiftool terminated unexpectedly")
+            if line.rstrip("\r\n") == marker:
+                return "".join(output)
+            output.append(line)
+
+    def close(self) -> None:
+        """Завершает процесс exiftool."""
+        if self.process is None:
+            return
+        try:
+            assert self.process.stdin is not None
+            self.process.stdin.write("-stay_open\nFalse\n")
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        if self._stderr_thread is not None:
+            self._stderr_thread.join(timeout=10)
+            self._stderr_thread = None
+        if self.process.stdout is not None:
+            self.process.stdout.close()
+        self.process = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
 class Mp4DateFixer:
     def __init__(
-        self, root: Path, dry_run: bool, limit: Optional[int], timezone_str: str
+        self,
+        root: Path,
+        dry_run: bool,
+        limit: Optional[int],
+        timezone_str: str,
+        workers: int = DEFAULT_WORKERS,
+        paranoid: bool = False,
+        force: bool = False,
     ):
         self.root = root
         self.dry_run = dry_run
         self.limit = limit
+        self.workers = max(1, workers)
+        # Проверять каждую запись повторным чтением (с бэкапом и откатом)
+        self.paranoid = paranoid
+        # Читать метаданные даже у файлов с уже выставленным mtime
+        self.force = force
         self.processed_count = 0
         self.tz = ZoneInfo(timezone_str)
+        # У каждого потока свой процесс exiftool: команды одного процесса
+        # выполняются строго по очереди
+        self._local = threading.local()
+        self._daemons: List[ExifToolDaemon] = []
+        self._daemons_lock = threading.Lock()
 
         # Проверка наличия exiftool
         if not shutil.which("exiftool"):
@@ -70,49 +252,85 @@ class Mp4DateFixer:
                 "Exiftool not found. Please install: sudo apt install libimage-exiftool-perl"
             )
 
+    @property
+    def exiftool(self) -> ExifToolDaemon:
+        """Процесс exiftool текущего потока."""
+        daemon = getattr(self._local, "daemon", None)
+        if daemon is None:
+            daemon = self._local.daemon = ExifToolDaemon()
+            with self._daemons_lock:
+                self._daemons.append(daemon)
+        return daemon
+
+    def close(self) -> None:
+        """Завершает процессы exiftool всех потоков."""
+        with self._daemons_lock:
+            daemons, self._daemons = self._daemons, []
+        for daemon in daemons:
+            daemon.close()
+
     def get_date_from_folder(self, file_path: Path) -> Optional[str]:
         """
         Извлекает дату YYYY-MM-DD из имени РОДИТЕЛЬСКОЙ папки.
         """
-        parent_name = file_path.parent.name
         # Строгое начало строки, формат YYYY-MM-DD
-        match = re.match(r"^(\d{4}-\d{2}-\d{2})", parent_name)
-        if match:
-            return match.group(1)
-        return None
+        return date_from_folder_name(file_path.parent.name)
 
-    def get_metadata(self, file_path: Path) -> Dict[str, Any]:
+    def get_metadata(self, file_path: Path, fast: bool = True) -> Dict[str, Any]:
         """
-        Читает метаданные через exiftool.
+        Читает метаданные одного файла через exiftool.
+        """
+        return self.get_metadata_batch([file_path], fast).get(str(file_path), {})
+
+    def get_metadata_batch(
+        self, file_paths: List[Path], fast: bool = True
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Читает метаданные нескольких файлов одной командой exiftool.
         Используем -api QuickTimeUTC, чтобы получить время с учетом UTC коррекции.
+        Запрашивается только PRIMARY_CHECK_TAG. Флаг -fast (при fast=True)
+        пропускает поиск трейлеров; -fast2 не подходит: на нем exiftool
+        прекращает чтение на атоме mdat, а у многих камер moov идет после него.
+
+        Returns:
+            Словарь {путь: метаданные}; нечитаемых файлов в нем нет.
         """
-        cmd = [
-            "exiftool",
+        args = [
             "-j",  # JSON output
             "-G1",  # Group names (QuickTime:CreateDate)
-            "-a",  # Allow duplicates
+            *(["-fast"] if fast else []),  # Skip trailer scans
             "-api",
             "QuickTimeUTC",  # Interpret QuickTime integers as UTC
-            str(file_path),
+            f"-{PRIMARY_CHECK_TAG}",  # Only the tag we compare
+            *map(str, file_paths),
         ]
 
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            data = json.loads(result.stdout)
-            return data[0] if data else {}
-        except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
-            logger.error(f"Failed to read metadata for {file_path}: {e}")
+            stdout, stderr = self.exiftool.execute(*args)
+        except ExifToolError as e:
+            logger.error(f"Failed to read metadata: {e}")
+            return {}
+        # Ошибки отдельных файлов exiftool пишет в stderr, а в JSON
+        # такие файлы просто отсутствуют
+        for line in stderr.splitlines():
+            if line.startswith("Error"):
+                logger.error(f"Failed to read metadata: {line}")
+            elif line.strip():
+                logger.debug(f"Exiftool: {line}")
+        if not stdout.strip():
+            return {}
+        try:
+            data = json.loads(stdout)
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse exiftool output: {e}")
             return {}
+        return {item["SourceFile"]: item for item in data}
 
     def construct_target_datetime(self, date_str: str) -> datetime:
         """
         Создает aware datetime объект: YYYY-MM-DD 12:00:00 MSK
         """
-        dt_str = f"{date_str} {TARGET_TIME}"
-        # Парсим как naive
-        dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
-        # Присваиваем таймзону
-        return dt.replace(tzinfo=self.tz)
+        return target_datetime(date_str, self.tz)
 
     def is_update_needed(
         self, current_meta: Dict[str, Any], target_dt: datetime
@@ -158,23 +376,42 @@ class Mp4DateFixer:
             return
 
         # 1. Exiftool Update
-        # Мы НЕ используем -overwrite_original, чтобы создался бэкап для верификации
-        cmd = [
-            "exiftool",
+        args = [
             "-api",
             "QuickTimeUTC",
             "-P",  # Preserve file modification time (мы его потом сами выставим, но пусть пока держит)
         ]
+        # В обычном режиме доверяем отчету exiftool и пишем без бэкапа.
+        # В режиме paranoid бэкап создается, чтобы проверить результат
+        # повторным чтением и откатить изменения при расхождении
+        if not self.paranoid:
+            args.append("-overwrite_original_in_place")
 
         for tag in TARGET_TAGS:
-            cmd.append(f"-{tag}={exif_date_str}")
+            args.append(f"-{tag}={exif_date_str}")
 
-        cmd.append(str(file_path))
+        args.append(str(file_path))
 
         try:
-            subprocess.run(cmd, capture_output=True, text=True, check=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Exiftool write failed for {file_path}: {e.stderr}")
+            stdout, stderr = self.exiftool.execute(*args)
+        except ExifToolError as e:
+            logger.error(f"Exiftool write failed for {file_path}: {e}")
+            return
+        # В режиме stay_open код возврата недоступен: успех определяем
+        # по отчету exiftool "1 image files updated"
+        if not UPDATED_RE.search(stdout):
+            logger.error(f"Exiftool write failed for {file_path}: {stderr.strip()}")
+            return
+
+        if not self.paranoid:
+            # Файл записан, но exiftool что-то сообщил: перечитываем теги.
+            # Бэкапа нет, поэтому откатить изменения уже нельзя
+            if stderr.strip():
+                logger.warning(f"Exiftool: {stderr.strip()}")
+                if not self.verify_update(file_path, target_dt):
+                    logger.error(f"Verification FAILED for {file_path}.")
+                    return
+            self.set_fs_times(file_path, target_dt)
             return
 
         # 2. Verification
@@ -189,25 +426,30 @@ class Mp4DateFixer:
                     logger.warning(f"Could not delete backup {backup_file}: {e}")
 
             # 3. Update Filesystem Timestamps (mtime/atime)
-            try:
-                ts = target_dt.timestamp()
-                os.utime(file_path, (ts, ts))
-                logger.info(
-                    f"Success: Metadata and FS times updated for {file_path.name}"
-                )
-            except OSError as e:
-                logger.error(f"Failed to update filesystem times for {file_path}: {e}")
+            self.set_fs_times(file_path, target_dt)
 
         else:
             # Failure: Restore backup
             logger.error(f"Verification FAILED for {file_path}. Restoring backup.")
             self.restore_backup(file_path)
 
+    def set_fs_times(self, file_path: Path, target_dt: datetime):
+        """
+        Выставляет mtime/atime файла равными целевой дате.
+        """
+        try:
+            ts = target_dt.timestamp()
+            os.utime(file_path, (ts, ts))
+            logger.info(f"Success: Metadata and FS times updated for {file_path.name}")
+        except OSError as e:
+            logger.error(f"Failed to update filesystem times for {file_path}: {e}")
+
     def verify_update(self, file_path: Path, target_dt: datetime) -> bool:
         """
-        Читает файл заново и проверяет PRIMARY_CHECK_TAG.
+        Читает файл заново (полным разбором, без -fast) и проверяет
+        PRIMARY_CHECK_TAG.
         """
-        meta = self.get_metadata(file_path)
+        meta = self.get_metadata(file_path, fast=False)
         if not meta:
             return False
         return not self.is_update_needed(meta, target_dt)
@@ -226,23 +468,24 @@ class Mp4DateFixer:
         else:
             logger.critical(f"CRITICAL: Backup file not found for {file_path}!")
 
+    def limit_reached(self) -> bool:
+        return bool(self.limit) and self.processed_count >= self.limit
+
     def run(self):
+        try:
+            self._run()
+        finally:
+            self.close()
+
+    def _run(self):
         logger.info(f"Starting scan in: {self.root}")
-        mp4_files = sorted(
-            [
-                f
-                for f in self.root.rglob("*")
-                if f.is_file() and f.suffix.lower() == ".mp4"
-            ]
-        )  # Сортировка для порядка в логах, поиск без учета регистра
+        # Сортировка для порядка в логах
+        mp4_files = sorted(iter_mp4_files(self.root))
 
         logger.info(f"Found {len(mp4_files)} MP4 files.")
 
+        targets: List[Tuple[Path, datetime]] = []
         for file_path in mp4_files:
-            if self.limit and self.processed_count >= self.limit:
-                logger.info(f"Limit of {self.limit} files reached.")
-                break
-
             # 1. Check folder date
             date_str = self.get_date_from_folder(file_path)
             if not date_str:
@@ -256,14 +499,49 @@ class Mp4DateFixer:
                 logger.error(f"Invalid date format in folder {file_path.parent}: {e}")
                 continue
 
-            # 3. Check current state
-            current_meta = self.get_metadata(file_path)
-            if not self.is_update_needed(current_meta, target_dt):
-                logger.debug(f"Skipping {file_path.name}: Metadata already correct.")
-                continue
-
-            # 4. Update
-            self.update_file(file_path, target_dt)
-            self.processed_count += 1
-
-
+            # mtime выставляется последним шагом update_file, поэтому
+            # совпадение mtime означает, что файл уже обработан
+            if not self.force:
+                try:
+                    mtime = file_path.stat().st_mtime
+                except OSError as e:
+                    logger.error(f"Could not stat {file_path}: {e}")
+                    continue
+                if abs(mtime - target_dt.timestamp()) < 1.0:
+                    logger.debug(f"Skipping {file_path.name}: mtime already matches.")
+                    continue
+            targets.append((file_path, target_dt))
+
+        # Метаданные читаются пачками в этом потоке (одна команда exiftool
+        # на пачку), а запись идет параллельно в пуле потоков, пока
+        # читаются следующие пачки
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures: List[Future] = []
+            for start in range(0, len(targets), METADATA_BATCH_SIZE):
+                if self.limit_reached():
+                    logger.info(f"Limit of {self.limit} files reached.")
+                    break
+                batch = targets[start : start + METADATA_BATCH_SIZE]
+                metadata = self.get_metadata_batch([path for path, _ in batch])
+
+                for file_path, target_dt in batch:
+                    if self.limit_reached():
+                        break
+
+                    # 3. Check current state
+                    current_meta = metadata.get(str(file_path), {})
+                    if not self.is_update_needed(current_meta, target_dt):
+                        logger.debug(
+                            f"Skipping {file_path.name}: Metadata already correct."
+                        )
+                        continue
+
+                    # 4. Update
+                    futures.append(
+                        executor.submit(self.update_file, file_path, target_dt)
+                    )
+                    self.processed_count += 1
+
+            # Пробрасываем исключения из потоков
+            for future in futures:
+                future.result()
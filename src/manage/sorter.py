@@ -1,21 +1,127 @@
 import argparse
+import asyncio
 import datetime
+import errno
+import io
 import json
+import os
+import re
+import shutil
+import sqlite3
 import subprocess
-import zlib
+from collections import defaultdict
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional
 
 import exifread
 
+from ._crc import crc32_file
+from ._date_cache import DATE_CACHE_NAME, DateCache
+
+# Сколько байт из начала файлов сравнивать перед подсчетом CRC32
+HEAD_COMPARE_SIZE = 4096
+
+# Сколько байт из начала JPEG читать для поиска EXIF. Сегмент APP1 не
+# превышает 64 КиБ, но перед ним может стоять APP0 (JFIF) с миниатюрой.
+EXIF_PROBE_SIZE = 128 * 1024
+
+# Сколько файлов обрабатывается одновременно (задача упирается в I/O и
+# внешние процессы, поэтому потоков больше, чем ядер)
+MAX_CONCURRENCY = (os.cpu_count() or 1) * 2
+
+FFPROBE_CMD = [
+    "ffprobe",
+    "-v",
+    "quiet",
+    "-print_format",
+    "json",
+    "-show_format",
+    "-show_streams",
+]
+# exiftool читает список файлов из argfile (stdin), поэтому, в отличие от
+# ffprobe, одним процессом обрабатывает целую пачку видео. QuickTime хранит
+# время в UTC, как и creation_time у ffprobe.
+EXIFTOOL_BATCH_CMD = [
+    "exiftool",
+    "-j",
+    "-fast",
+    "-charset",
+    "filename=utf8",
+    "-QuickTime:CreateDate",
+    "-@",
+    "-",
+]
+# Сколько видеофайлов передавать в один вызов exiftool
+VIDEO_BATCH_SIZE = 256
+
+# Поддерживаемые расширения (в нижнем регистре)
+JPG_EXT = frozenset({".jpg", ".jpeg"})
+MOV_EXT = frozenset({".mov", ".mp4", ".mkv", ".avi", ".mts"})
+
+FFPROBE_ERRORS = (
+    subprocess.CalledProcessError,
+    FileNotFoundError,
+    json.JSONDecodeError,
+    KeyError,
+    ValueError,
+)
+
 
 def calculate_crc32(file_path: Path) -> int:
-    """Вычисляет CRC32 для файла."""
-    hash_crc32 = 0
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_crc32 = zlib.crc32(chunk, hash_crc32)
-    return hash_crc32
+    """Вычисляет CRC32 для файла (реализация выбирается в `_crc`)."""
+    return crc32_file(file_path)
+
+
+def is_same_content(source_path: Path, dest_path: Path) -> bool:
+    """
+    Проверяет, совпадает ли содержимое двух файлов.
+
+    Проверки идут от дешевых к дорогим: размер, первые `HEAD_COMPARE_SIZE`
+    байт и только затем CRC32 обоих файлов целиком.
+    """
+    if source_path.stat().st_size != dest_path.stat().st_size:
+        return False
+
+    with open(source_path, "rb") as src, open(dest_path, "rb") as dst:
+        if src.read(HEAD_COMPARE_SIZE) != dst.read(HEAD_COMPARE_SIZE):
+            return False
+
+    return calculate_crc32(source_path) == calculate_crc32(dest_path)
+
+
+def move_file(source_path: Path, dest_path: Path) -> None:
+    """
+    Перемещает файл, в том числе между файловыми системами.
+
+    В пределах одной ФС это атомарный `os.rename`. Между разными
+    (например, NAS -> локальный диск) rename завершается ошибкой EXDEV,
+    и файл копируется через `shutil.move`, который использует
+    `copy_file_range`/`sendfile` без копирования через пространство
+    пользователя.
+    """
+    try:
+        os.rename(source_path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, dest_path)
+
+
+def next_free_index(dest_dir: Path, stem: str, suffix: str) -> int:
+    """
+    Возвращает номер для имени `{stem}_{N}{suffix}`, больший всех занятых.
+
+    Папка читается один раз, вместо проверки `exists()` для каждого
+    номера подряд: при тысячах коллизий это O(1) вызовов на файл вместо O(N).
+    """
+    pattern = re.compile(rf"{re.escape(stem)}_(\d+){re.escape(suffix)}")
+    used = 0
+    with os.scandir(dest_dir) as it:
+        for entry in it:
+            match = pattern.fullmatch(entry.name)
+            if match:
+                used = max(used, int(match.group(1)))
+    return used + 1
 
 
 def safe_move_file(source_path: Path, dest_dir: Path):
@@ -28,11 +134,8 @@ def safe_move_file(source_path: Path, dest_dir: Path):
     dest_path = dest_dir / source_path.name
 
     if dest_path.exists():
-        # Файл с таким именем уже существует, сравниваем CRC32
-        source_crc = calculate_crc32(source_path)
-        dest_crc = calculate_crc32(dest_path)
-
-        if source_crc == dest_crc:
+        # Файл с таким именем уже существует, сравниваем содержимое
+        if is_same_content(source_path, dest_path):
             # Файлы идентичны, пропускаем
             print(f"Skipping identical file: {source_path.name}")
             # Удаляем исходный файл, так как он является дубликатом
@@ -41,12 +144,13 @@ def safe_move_file(source_path: Path, dest_dir: Path):
             return
         else:
             # Файлы разные, ищем новое имя
-            i = 1
+            i = next_free_index(dest_dir, source_path.stem, source_path.suffix)
             while True:
                 new_name = f"{source_path.stem}_{i}{source_path.suffix}"
                 new_dest_path = dest_dir / new_name
+                # Проверка на случай, если имя занял сторонний процесс
                 if not new_dest_path.exists():
-                    source_path.rename(new_dest_path)
+                    move_file(source_path, new_dest_path)
                     print(
                         f"File '{source_path.name}' renamed to '{new_name}' and moved to '{dest_dir}'"
                     )
@@ -54,22 +158,64 @@ def safe_move_file(source_path: Path, dest_dir: Path):
                 i += 1
     else:
         # Файл не существует, просто перемещаем
-        source_path.rename(dest_path)
+        move_file(source_path, dest_path)
         print(f"File '{source_path.name}' moved to '{dest_dir}'")
 
 
+def get_mtime_date(file_path: Path) -> datetime.date:
+    """Возвращает дату изменения файла."""
+    return datetime.datetime.fromtimestamp(file_path.stat().st_mtime).date()
+
+
 def get_jpg_creation_date(file_path: Path) -> datetime.date:
-    """Извлекает дату создания из JPEG файла (EXIF или дата изменения)."""
+    """
+    Извлекает дату создания из JPEG файла (EXIF или дата изменения).
+
+    Читается только начало файла (`EXIF_PROBE_SIZE`), где находится EXIF;
+    сами данные изображения с диска не загружаются.
+    """
     with open(file_path, "rb") as f:
-        tags = exifread.process_file(f, details=False, stop_tag="EXIF DateTimeOriginal")
-        if "EXIF DateTimeOriginal" in tags:
-            date_str = str(tags["EXIF DateTimeOriginal"])
-            try:
-                return datetime.datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S").date()
-            except ValueError:
-                pass  # Если формат даты некорректный, переходим к дате изменения
+        head = io.BytesIO(f.read(EXIF_PROBE_SIZE))
 
-    return datetime.datetime.fromtimestamp(file_path.stat().st_mtime).date()
+    tags = exifread.process_file(head, details=False, stop_tag="EXIF DateTimeOriginal")
+    if "EXIF DateTimeOriginal" in tags:
+        date_str = str(tags["EXIF DateTimeOriginal"])
+        try:
+            return datetime.datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S").date()
+        except ValueError:
+            pass  # Если формат даты некорректный, переходим к дате изменения
+
+    return get_mtime_date(file_path)
+
+
+def parse_ffprobe_output(output: str) -> Optional[datetime.date]:
+    """Извлекает дату создания из JSON-вывода ffprobe."""
+    data = json.loads(output)
+
+    creation_time_str: Optional[str] = None
+    if "format" in data and "tags" in data.get("format", {}):
+        creation_time_str = data["format"]["tags"].get("creation_time")
+
+    if not creation_time_str and "streams" in data:
+        for stream in data.get("streams", []):
+            if "tags" in stream:
+                creation_time_str = stream["tags"].get("creation_time")
+                if creation_time_str:
+                    break
+
+    if not creation_time_str:
+        return None
+
+    # ffprobe может возвращать время в разных форматах, пробуем несколько
+    try:
+        if creation_time_str.endswith("Z"):
+            creation_time_str = creation_time_str[:-1] + "+00:00"
+        return datetime.datetime.fromisoformat(creation_time_str).date()
+    except ValueError:
+        # Попробуем разобрать другой возможный формат
+        return datetime.datetime.strptime(
+            creation_time_str, "%Y-%m-%dT%H:%M:%S.%f"
+        ).date()
 
 
 def get_mov_creation_date(file_path: Path) -> datetime.date:
@@ -78,94 +224,210 @@ def get_mov_creation_date(file_path: Path) -> datetime.date:
     Если дата создания недоступна, возвращает дату изменения файла.
     """
     try:
-        cmd = [
-            "ffprobe",
-            "-v",
-            "quiet",
-            "-print_format",
-            "json",
-            "-show_format",
-            "-show_streams",
-            str(file_path),
-        ]
         result = subprocess.run(
-            cmd,
+            [*FFPROBE_CMD, str(file_path)],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             check=True,
             text=True,
             encoding="utf-8",
         )
-        data = json.loads(result.stdout)
-
-        creation_time_str: Optional[str] = None
-        if "format" in data and "tags" in data.get("format", {}):
-            creation_time_str = data["format"]["tags"].get("creation_time")
-
-        if not creation_time_str and "streams" in data:
-            for stream in data.get("streams", []):
-                if "tags" in stream:
-                    creation_time_str = stream["tags"].get("creation_time")
-                    if creation_time_str:
-                        break
-
-        if creation_time_str:
-            # ffprobe может возвращать время в разных форматах, пробуем несколько
-            try:
-                if creation_time_str.endswith("Z"):
-                    creation_time_str = creation_time_str[:-1] + "+00:00"
-                return datetime.datetime.fromisoformat(creation_time_str).date()
-            except ValueError:
-                # Попробуем разобрать другой возможный формат
-                return datetime.datetime.strptime(
-                    creation_time_str, "%Y-%m-%dT%H:%M:%S.%f"
-                ).date()
-
-    except (
-        subprocess.CalledProcessError,
-        FileNotFoundError,
-        json.JSONDecodeError,
-        KeyError,
-        ValueError,
-    ) as e:
+        date = parse_ffprobe_output(result.stdout)
+        if date:
+            return date
+    except FFPROBE_ERRORS as e:
         print(f"Could not get creation date for {file_path.name} via ffprobe: {e}")
 
-    return datetime.datetime.fromtimestamp(file_path.stat().st_mtime).date()
+    return get_mtime_date(file_path)
 
 
-def process_files(source_dir: Path, save_dir: Path, recursive: bool):
-    """Рекурсивно обходит папки и перемещает файлы."""
-    print(f"Processing files from: {source_dir}")
-    if recursive:
-        # Используем rglob для рекурсивного поиска
-        files_to_process = source_dir.rglob("*")
-    else:
-        # Используем glob для нерекурсивного поиска
-        files_to_process = source_dir.glob("*")
+def get_mov_creation_dates_batch(paths: List[Path]) -> Dict[Path, datetime.date]:
+    """
+    Извлекает даты создания для пачки видеофайлов одним вызовом exiftool.
+
+    Возвращает даты только для файлов, у которых удалось разобрать
+    `QuickTime:CreateDate`. Остальные (а также все файлы, если exiftool
+    не установлен) следует обработать поштучно через ffprobe.
+    """
+    if not paths or shutil.which(EXIFTOOL_BATCH_CMD[0]) is None:
+        return {}
+
+    wanted = set(paths)
+    try:
+        # Ненулевой код возврата означает ошибку лишь в части файлов,
+        # JSON для остальных все равно выводится
+        result = subprocess.run(
+            EXIFTOOL_BATCH_CMD,
+            input="\n".join(str(p) for p in paths),
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+        )
+        records = json.loads(result.stdout or "[]")
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Batch date read via exiftool failed: {e}")
+        return {}
+
+    dates: Dict[Path, datetime.date] = {}
+    for record in records:
+        path = Path(record.get("SourceFile", ""))
+        value = record.get("CreateDate")
+        if path not in wanted or not isinstance(value, str):
+            continue
+        try:
+            dates[path] = datetime.datetime.strptime(
+                value[:19], "%Y:%m:%d %H:%M:%S"
+            ).date()
+        except ValueError:
+            # Например, "0000:00:00 00:00:00" - пусть разбирается ffprobe
+            continue
+    return dates
+
+
+# Расширение -> функция определения даты. Одна проверка по словарю
+# вместо нескольких проверок вхождения в список на каждый файл.
+DISPATCH: Dict[str, Callable[[Path], datetime.date]] = {
+    **{ext: get_jpg_creation_date for ext in JPG_EXT},
+    **{ext: get_mov_creation_date for ext in MOV_EXT},
+}
+
+
+async def get_mov_creation_date_async(file_path: Path) -> datetime.date:
+    """
+    Асинхронная версия `get_mov_creation_date`: ffprobe запускается
+    как подпроцесс, не блокируя цикл событий.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *FFPROBE_CMD,
+            str(file_path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(
+                proc.returncode or 0, FFPROBE_CMD[0], stdout, stderr
+            )
+        date = parse_ffprobe_output(stdout.decode("utf-8"))
+        if date:
+            return date
+    except FFPROBE_ERRORS as e:
+        print(f"Could not get creation date for {file_path.name} via ffprobe: {e}")
+
+    return get_mtime_date(file_path)
 
-    # Фильтруем, оставляя только файлы
-    files_to_process = [f for f in files_to_process if f.is_file()]
 
-    for file_path in files_to_process:
+async def _process_files_async(
+    files: List[Path], save_dir: Path, cache: Optional[DateCache] = None
+) -> None:
+    """
+    Конкурентно определяет даты файлов и перемещает их.
+
+    Даты, найденные в `cache`, повторно не вычисляются; новые даты
+    сохраняются в него. Остальные даты видео сначала читаются пачками
+    через exiftool. Затем
+    `MAX_CONCURRENCY` воркеров разбирают общий итератор файлов: EXIF читается
+    в пуле потоков, ffprobe (для видео, не попавших в пакетный результат)
+    запускается асинхронным подпроцессом. Перемещения в одну папку
+    сериализуются блокировкой, чтобы избежать гонок при переименовании.
+    """
+    loop = asyncio.get_running_loop()
+    dir_locks: defaultdict[Path, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    # Расширение вычисляется один раз; неподдерживаемые файлы отсеиваются сразу
+    supported = [(f, ext) for f in files if (ext := f.suffix.lower()) in DISPATCH]
+
+    stats: Dict[Path, os.stat_result] = {}
+    cached_dates: Dict[Path, datetime.date] = {}
+    if cache is not None:
+        for f, _ in supported:
+            stats[f] = f.stat()
+            cached_date = cache.get(stats[f])
+            if cached_date is not None:
+                cached_dates[f] = cached_date
+
+    videos = [f for f, ext in supported if ext in MOV_EXT and f not in cached_dates]
+    video_dates: Dict[Path, datetime.date] = {}
+    for batch_dates in await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                None, get_mov_creation_dates_batch, videos[i : i + VIDEO_BATCH_SIZE]
+            )
+            for i in range(0, len(videos), VIDEO_BATCH_SIZE)
+        )
+    ):
+        video_dates.update(batch_dates)
+
+    async def process_one(file_path: Path, ext: str) -> None:
         try:
-            date: Optional[datetime.date] = None
-            suffix = file_path.suffix.lower()
+            date: Optional[datetime.date] = cached_dates.get(file_path)
 
-            if suffix in [".jpg", ".jpeg"]:
-                date = get_jpg_creation_date(file_path)
-            elif suffix in [".mov", ".mp4", ".mkv", ".avi", ".mts"]:
-                date = get_mov_creation_date(file_path)
-            else:
-                # Пропускаем неподдерживаемые файлы
-                continue
+            if date is None:
+                if ext in MOV_EXT:
+                    date = video_dates.get(file_path)
+                    if date is None:
+                        date = await get_mov_creation_date_async(file_path)
+                else:
+                    date = await loop.run_in_executor(None, DISPATCH[ext], file_path)
+                if cache is not None and date:
+                    cache.put(stats[file_path], date)
 
             if date:
                 target_dir = save_dir / date.isoformat()
                 print(f"Processing: {file_path.name} -> {target_dir}")
-                safe_move_file(file_path, target_dir)
+                async with dir_locks[target_dir]:
+                    await loop.run_in_executor(
+                        None, safe_move_file, file_path, target_dir
+                    )
 
         except Exception as e:
             # Логируем ошибку, но продолжаем обработку других файлов
             print(f"FATAL: Error processing {file_path.name}: {e}")
 
+    files_iter = iter(supported)
+
+    async def worker() -> None:
+        # Итератор общий: next() вызывается синхронно, гонок нет
+        for file_path, ext in files_iter:
+            await process_one(file_path, ext)
+
+    await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENCY)))
+
 
+def iter_files(root: Path, recursive: bool) -> Iterator[Path]:
+    """
+    Обходит директорию через `os.scandir` и возвращает пути к файлам.
+
+    `DirEntry.is_dir()`/`is_file()` берут тип из результата readdir без
+    отдельного stat на каждый элемент, в отличие от `rglob` + `is_file`.
+    Символические ссылки на папки не раскрываются.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(Path(entry.path))
+                elif entry.is_file():
+                    yield Path(entry.path)
+
+
+def process_files(source_dir: Path, save_dir: Path, recursive: bool):
+    """Рекурсивно обходит папки и перемещает файлы."""
+    print(f"Processing files from: {source_dir}")
+    files_to_process = list(iter_files(source_dir, recursive))
+
+    try:
+        cache: Optional[DateCache] = DateCache(source_dir / DATE_CACHE_NAME)
+    except sqlite3.Error as e:
+        # Например, исходная папка только для чтения: работаем без кэша
+        print(f"WARNING: Date cache is disabled: {e}")
+        cache = None
+
+    try:
+        asyncio.run(_process_files_async(files_to_process, save_dir, cache))
+    finally:
+        if cache is not None:
+            cache.close()
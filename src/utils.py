@@ -4,12 +4,16 @@
 Этот модуль содержит функции для настройки логирования, вычисления хешей файлов
 и проверки расширений файлов изображений.
 """
+
 import hashlib
 import logging
 from pathlib import Path
 
 from src.config import settings
 
+# Расширения поддерживаемых изображений (в нижнем регистре)
+IMAGE_SUFFIXES = (".jpg", ".jpeg")
+
 
 def setup_logging() -> None:
     """
@@ -25,26 +29,24 @@ def setup_logging() -> None:
     )
 
 
-def get_file_hash(path: Path, chunk_size: int = 8192) -> str:
+def get_file_hash(path: Path) -> str:
     """
     Вычисляет хеш-сумму SHA256 для файла.
 
-    Читает файл по частям, чтобы избежать проблем с большими файлами.
+    `hashlib.file_digest` читает файл в собственный буфер и передает его
+    в OpenSSL без промежуточных объектов `bytes`, где SHA256 считается
+    с аппаратным ускорением (SHA-NI), если процессор его поддерживает.
 
     Args:
         path: Путь к файлу.
-        chunk_size: Размер части для чтения в байтах.
 
     Returns:
         Строка с хеш-суммой в шестнадцатеричном формате или пустая строка
         в случае ошибки чтения файла.
     """
-    sha = hashlib.sha256()
     try:
         with open(path, "rb") as f:
-            while chunk := f.read(chunk_size):
-                sha.update(chunk)
-        return sha.hexdigest()
+            return hashlib.file_digest(f, "sha256").hexdigest()
     except OSError:
         # В случае ошибки (например, файл не найден) возвращаем пустой хеш
         return ""
@@ -61,4 +63,4 @@ def is_image_file(path: Path) -> bool:
         True, если расширение файла соответствует одному из поддерживаемых
         форматов изображений, иначе False.
     """
-    return path.suffix.lower() in {".jpg", ".jpeg"}
+    return path.name.lower().endswith(IMAGE_SUFFIXES)
@@ -4,25 +4,70 @@
 """
 
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 
+from src.config import settings
 from src.db import Base
 
 # Используем БД в памяти для тестов
 TEST_DB_URL = "sqlite:///:memory:"
 
 
-@pytest.fixture(scope="function")
-def session():
+@pytest.fixture(autouse=True)
+def embeddings_dir(tmp_path, monkeypatch):
+    """
+    Перенаправляет файловое хранилище эмбеддингов во временную директорию,
+    чтобы тесты не писали в рабочий каталог.
+    """
+    path = tmp_path / "embeddings"
+    monkeypatch.setattr(settings, "EMBEDDINGS_DIR", path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def engine():
     """
-    Фикстура для создания и очистки сессии БД для каждого теста.
-    Доступна для всех тестов в проекте.
+    Движок БД в памяти со схемой, создаваемой один раз на всю сессию тестов.
+
+    StaticPool держит единственное соединение, иначе у каждого нового
+    соединения была бы своя пустая база `:memory:`.
     """
-    engine = create_engine(TEST_DB_URL)
+    engine = create_engine(
+        TEST_DB_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+    # pysqlite сам открывает и закрывает транзакции, из-за чего SAVEPOINT
+    # не работает; передаем управление транзакциями SQLAlchemy
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    db_session = Session()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def session(engine):
+    """
+    Сессия БД для одного теста. Доступна для всех тестов в проекте.
+
+    Тест работает внутри внешней транзакции, которая откатывается после
+    него: `commit()` в тесте лишь фиксирует SAVEPOINT, поэтому тесты
+    не видят данных друг друга, а таблицы не пересоздаются.
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+    db_session = Session(bind=connection, join_transaction_mode="create_savepoint")
     yield db_session
     db_session.close()
-    Base.metadata.drop_all(engine)
\ No newline at end of file
+    transaction.rollback()
+    connection.close()
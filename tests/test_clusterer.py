@@ -1,76 +1,211 @@
 """Тесты для модуля clusterer."""
+
 import numpy as np
 import pytest
 from unittest.mock import patch
 
-from src.clusterer import cluster_images
+from src import embedding_store
+from src.clusterer import (
+    build_index,
+    cluster_images,
+    find_components,
+    iter_similar_pairs,
+    load_embeddings,
+    normalize_rows,
+)
 from src.db import ImageRecord
 
 
-# TODO: Разобраться, почему этот тест падает. Проблема, скорее всего,
-# в том, как faiss/networkx обрабатывают ID или в самой логике кластеризации.
-# @patch("src.clusterer.settings.SIMILARITY_THRESHOLD", 0.99)
-# @patch("src.clusterer.SessionLocal")
-# def test_cluster_images(mock_session_local, session):
-#     """
-#     Тестирует функцию кластеризации изображений.
-#     Создает несколько записей с похожими и различными эмбеддингами
-#     и проверяет, что кластеры создаются корректно.
-#     """
-#     # Создаем эмбеддинги
-#     # Вектор 1 и 2 - похожи
-#     # Вектор 3 - отличается
-#     # Вектор 4 и 5 - похожи
-#     # Вектор 6 - без эмбеддинга
-#     emb1 = np.array([0.9, 0.1, 0.1] + [0.0] * 765)
-#     emb2 = np.array([0.89, 0.11, 0.09] + [0.0] * 765)
-#     emb3 = np.array([0.1, 0.9, 0.1] + [0.0] * 765)
-#     emb4 = np.array([0.1, 0.1, 0.9] + [0.0] * 765)
-#     emb5 = np.array([0.11, 0.09, 0.89] + [0.0] * 765)
-#
-#     # Нормализуем для косинусного сходства
-#     emb1 /= np.linalg.norm(emb1)
-#     emb2 /= np.linalg.norm(emb2)
-#     emb3 /= np.linalg.norm(emb3)
-#     emb4 /= np.linalg.norm(emb4)
-#     emb5 /= np.linalg.norm(emb5)
-#
-#     images = [
-#         ImageRecord(path="/img/1.jpg", file_hash="h1", size_bytes=1, mtime=1, embedding=emb1.tolist()),
-#         ImageRecord(path="/img/2.jpg", file_hash="h2", size_bytes=1, mtime=1, embedding=emb2.tolist()),
-#         ImageRecord(path="/img/3.jpg", file_hash="h3", size_bytes=1, mtime=1, embedding=emb3.tolist()),
-#         ImageRecord(path="/img/4.jpg", file_hash="h4", size_bytes=1, mtime=1, embedding=emb4.tolist()),
-#         ImageRecord(path="/img/5.jpg", file_hash="h5", size_bytes=1, mtime=1, embedding=emb5.tolist()),
-#         ImageRecord(path="/img/6.jpg", file_hash="h6", size_bytes=1, mtime=1, embedding=None),
-#     ]
-#     session.add_all(images)
-#     session.commit()
-#
-#     # Мокаем SessionLocal так, чтобы оба 'with' блока использовали нашу сессию
-#     mock_session_local.return_value.__enter__.return_value = session
-#
-#     # Запускаем кластеризацию
-#     cluster_images()
-#
-#     # Обновляем объекты в сессии, чтобы получить новые cluster_id
-#     session.expire_all()
-#
-#     # Проверяем результаты
-#     recs = session.query(ImageRecord).order_by(ImageRecord.id).all()
-#
-#     # Ожидаем два кластера
-#     # Кластер 1: img1, img2
-#     # Кластер 2: img4, img5
-#     # img3 - без кластера (одиночный)
-#     # img6 - без кластера (нет эмбеддинга)
-#
-#     assert recs[0].cluster_id is not None
-#     assert recs[0].cluster_id == recs[1].cluster_id
-#     assert recs[2].cluster_id is None
-#     assert recs[3].cluster_id is not None
-#     assert recs[4].cluster_id is not None
-#     assert recs[3].cluster_id == recs[4].cluster_id
-#     assert recs[5].cluster_id is None
-#
-#     # ID кластеров должны быть разными
-#     assert recs[0].cluster_id != recs[3].cluster_id
+@patch("src.clusterer.settings.SIMILARITY_THRESHOLD", 0.99)
+@patch("src.clusterer.SessionLocal")
+def test_cluster_images(mock_session_local, session):
+    """
+    Тестирует функцию кластеризации изображений.
+    Создает несколько записей с похожими и различными эмбеддингами
+    и проверяет, что кластеры создаются корректно.
+    """
+    # Создаем эмбеддинги
+    # Вектор 1 и 2 - похожи
+    # Вектор 3 - отличается
+    # Вектор 4 и 5 - похожи
+    # Вектор 6 - без эмбеддинга
+    emb1 = np.array([0.9, 0.1, 0.1] + [0.0] * 765)
+    emb2 = np.array([0.89, 0.11, 0.09] + [0.0] * 765)
+    emb3 = np.array([0.1, 0.9, 0.1] + [0.0] * 765)
+    emb4 = np.array([0.1, 0.1, 0.9] + [0.0] * 765)
+    emb5 = np.array([0.11, 0.09, 0.89] + [0.0] * 765)
+
+    # Нормализуем для косинусного сходства
+    emb1 /= np.linalg.norm(emb1)
+    emb2 /= np.linalg.norm(emb2)
+    emb3 /= np.linalg.norm(emb3)
+    emb4 /= np.linalg.norm(emb4)
+    emb5 /= np.linalg.norm(emb5)
+
+    images = [
+        ImageRecord(
+            path="/img/1.jpg",
+            file_hash="h1",
+            size_bytes=1,
+            mtime=1,
+            embedding=emb1.tolist(),
+        ),
+        ImageRecord(
+            path="/img/2.jpg",
+            file_hash="h2",
+            size_bytes=1,
+            mtime=1,
+            embedding=emb2.tolist(),
+        ),
+        ImageRecord(
+            path="/img/3.jpg",
+            file_hash="h3",
+            size_bytes=1,
+            mtime=1,
+            embedding=emb3.tolist(),
+        ),
+        ImageRecord(
+            path="/img/4.jpg",
+            file_hash="h4",
+            size_bytes=1,
+            mtime=1,
+            embedding=emb4.tolist(),
+        ),
+        ImageRecord(
+            path="/img/5.jpg",
+            file_hash="h5",
+            size_bytes=1,
+            mtime=1,
+            embedding=emb5.tolist(),
+        ),
+        ImageRecord(
+            path="/img/6.jpg", file_hash="h6", size_bytes=1, mtime=1, embedding=None
+        ),
+    ]
+    session.add_all(images)
+    session.commit()
+
+    # Мокаем SessionLocal так, чтобы оба 'with' блока использовали нашу сессию
+    mock_session_local.return_value.__enter__.return_value = session
+    # Не глушим исключения внутри with-блоков
+    mock_session_local.return_value.__exit__.return_value = False
+
+    # Запускаем кластеризацию
+    cluster_images()
+
+    # Обновляем объекты в сессии, чтобы получить новые cluster_id
+    session.expire_all()
+
+    # Проверяем результаты
+    recs = session.query(ImageRecord).order_by(ImageRecord.id).all()
+
+    # Ожидаем два кластера
+    # Кластер 1: img1, img2
+    # Кластер 2: img4, img5
+    # img3 - без кластера (одиночный)
+    # img6 - без кластера (нет эмбеддинга)
+
+    assert recs[0].cluster_id is not None
+    assert recs[0].cluster_id == recs[1].cluster_id
+    assert recs[2].cluster_id is None
+    assert recs[3].cluster_id is not None
+    assert recs[4].cluster_id is not None
+    assert recs[3].cluster_id == recs[4].cluster_id
+    assert recs[5].cluster_id is None
+
+    # ID кластеров должны быть разными
+    assert recs[0].cluster_id != recs[3].cluster_id
+
+
+@patch("src.clusterer.SessionLocal")
+def test_load_embeddings_rebuilds_stale_store(mock_session_local, session):
+    """
+    Хранилище с тем же набором id, но снятое с другого состояния БД,
+    не используется: векторы читаются из БД, хранилище перезаписывается.
+    """
+    emb = np.zeros(768)
+    emb[0] = 1.0
+    record = ImageRecord(
+        path="/img/1.jpg", file_hash="h1", size_bytes=1, mtime=1, embedding=emb.tolist()
+    )
+    session.add(record)
+    session.commit()
+
+    stale = np.zeros((1, 768), dtype=np.float32)
+    stale[0, 1] = 1.0
+    embedding_store.rewrite(np.array([record.id]), stale, [1, record.id, 1, 0])
+
+    mock_session_local.return_value.__enter__.return_value = session
+    mock_session_local.return_value.__exit__.return_value = False
+    ids, embeddings = load_embeddings()
+
+    assert ids.tolist() == [record.id]
+    np.testing.assert_array_equal(embeddings[0], emb)
+    assert embedding_store.is_in_sync(session)
+    np.testing.assert_array_equal(embedding_store.load()[1][0], emb)
+
+
+@pytest.mark.parametrize("index_kind", ["flat", "hnsw", "sq8"])
+@patch("src.clusterer.SEARCH_BATCH_SIZE", 2)
+def test_iter_similar_pairs_batches(index_kind):
+    """
+    Проверяет, что поиск блоками (по радиусу для flat/sq8 и k ближайших
+    для HNSW) находит ожидаемые пары и не возвращает петли.
+    """
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(3, 16)).astype(np.float32)
+    # Каждый базовый вектор и его слегка зашумленная копия
+    embeddings = np.vstack([base, base + 0.01]).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    with patch("src.clusterer.settings.FAISS_INDEX", index_kind):
+        index = build_index(embeddings)
+
+    pairs = set()
+    for src, dst in iter_similar_pairs(index, embeddings, 0.99):
+        assert not np.any(src == dst)
+        pairs.update(zip(src.tolist(), dst.tolist()))
+
+    assert pairs == {(0, 3), (3, 0), (1, 4), (4, 1), (2, 5), (5, 2)}
+
+
+@pytest.mark.parametrize("delta, expected", [(-0.001, True), (0.001, False)])
+def test_iter_similar_pairs_sq8_uses_exact_scores(delta, expected):
+    """
+    Для квантованного индекса пара у самого порога отбирается по точному
+    сходству, а не по приближенному значению int8.
+    """
+    rng = np.random.default_rng(1)
+    # Остальные векторы задают диапазоны квантования, иначе пара
+    # квантуется без погрешности
+    embeddings = rng.normal(size=(50, 16)).astype(np.float32)
+    embeddings[1] = embeddings[0] + 0.05 * embeddings[1]
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    similarity = float(embeddings[0] @ embeddings[1])
+
+    with patch("src.clusterer.settings.FAISS_INDEX", "sq8"):
+        index = build_index(embeddings)
+
+    pairs = set()
+    for src, dst in iter_similar_pairs(index, embeddings, similarity + delta):
+        pairs.update(zip(src.tolist(), dst.tolist()))
+    assert ((0, 1) in pairs) == expected
+
+
+def test_find_components():
+    """Проверяет группировку вершин и отбрасывание одиночных компонент."""
+    src = np.array([4, 0, 5, 1])
+    dst = np.array([2, 4, 1, 5])
+
+    components = find_components(6, src, dst)
+
+    assert [c.tolist() for c in components] == [[0, 2, 4], [1, 5]]
+
+
+def test_normalize_rows():
+    """Строки нормируются на месте, нулевая строка остается нулевой."""
+    embeddings = np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float32)
+
+    normalize_rows(embeddings)
+
+    np.testing.assert_allclose(embeddings, [[0.6, 0.8], [0.0, 0.0]])
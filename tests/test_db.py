@@ -1,37 +1,55 @@
 """Тесты для модуля db."""
-import os
+
 from pathlib import Path
-from sqlalchemy import create_engine, inspect
-from sqlalchemy.orm import sessionmaker
+from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pytest
+from pgvector import HalfVector
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.pool import StaticPool
 
-from src.db import Base, init_db, ImageRecord
-
+from src.db import (
+    ImageRecord,
+    embedding_to_numpy,
+    enable_sqlite_pragmas,
+    init_db,
+    migrate_embedding_to_halfvec,
+)
 
 # Используем БД в памяти для тестов
 TEST_DB_URL = "sqlite:///:memory:"
 
 
-
-
-def test_init_db(tmp_path: Path):
+def test_init_db():
     """
     Тестирует инициализацию базы данных.
     Проверяет, что таблицы создаются корректно.
     """
-    # Используем временный файл для SQLite БД
-    db_file = tmp_path / "test.db"
-    engine = create_engine(f"sqlite:///{db_file}")
-
-    # Модифицируем init_db для работы с тестовым движком
-    def test_init_db_func():
-        Base.metadata.create_all(engine)
+    # Одна общая БД в памяти: StaticPool отдает всем одно соединение
+    engine = create_engine(
+        TEST_DB_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
 
-    test_init_db_func()
+    with patch("src.db.engine", engine):
+        init_db()
 
     inspector = inspect(engine)
     assert "images" in inspector.get_table_names()
+    indexes = {ix["name"] for ix in inspector.get_indexes("images")}
+    assert "idx_images_reviewed_cluster" in indexes
+
+
+def test_enable_sqlite_pragmas(tmp_path: Path):
+    """Соединения с файловой SQLite открываются в режиме WAL."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    enable_sqlite_pragmas(engine)
+
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
 
 
 def test_image_record_creation(session):
@@ -54,3 +72,38 @@ def test_image_record_creation(session):
     assert retrieved_image.path == image_path
     assert retrieved_image.size_bytes == 1024
     assert len(retrieved_image.embedding) == 768
+
+
+def test_embedding_to_numpy():
+    """Значения pgvector и обычные списки преобразуются в массивы."""
+    from_pg = embedding_to_numpy(HalfVector([0.5, 1.0]))
+    from_list = embedding_to_numpy([0.5, 1.0])
+
+    assert isinstance(from_pg, np.ndarray)
+    np.testing.assert_array_equal(from_pg, [0.5, 1.0])
+    assert from_list.dtype == np.float32
+    np.testing.assert_array_equal(from_list, [0.5, 1.0])
+
+
+@pytest.mark.parametrize(
+    "column_type, migrated",
+    [("vector(768)", True), ("halfvec(768)", False), (None, False)],
+)
+def test_migrate_embedding_to_halfvec(column_type, migrated):
+    """Столбец vector переводится в halfvec, индекс пересоздается."""
+    conn = MagicMock()
+    conn.execute.return_value.scalar.return_value = column_type
+
+    with patch("sqlalchemy.Index.create") as create_index:
+        assert migrate_embedding_to_halfvec(conn) is migrated
+
+    statements = [str(call.args[0]) for call in conn.execute.call_args_list[1:]]
+    if migrated:
+        assert statements == [
+            "DROP INDEX IF EXISTS idx_images_embedding",
+            "ALTER TABLE images ALTER COLUMN embedding TYPE halfvec(768)",
+        ]
+        create_index.assert_called_once_with(conn)
+    else:
+        assert statements == []
+        create_index.assert_not_called()
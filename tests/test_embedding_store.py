@@ -0,0 +1,108 @@
+"""Тесты для модуля embedding_store."""
+
+import numpy as np
+
+from src import embedding_store
+from src.config import settings
+from src.db import EMBEDDING_DIM, ImageRecord
+
+
+def _vectors(n: int, seed: int) -> np.ndarray:
+    # Значения с точностью float16, как у векторов из halfvec
+    vectors = np.random.default_rng(seed).random((n, EMBEDDING_DIM), dtype=np.float32)
+    return vectors.astype(np.float16).astype(np.float32)
+
+
+def test_load_empty():
+    """Пустое хранилище возвращает None."""
+    assert embedding_store.load() is None
+
+
+def test_append_keeps_last_version(embeddings_dir):
+    """
+    Проверяет дозапись: при повторной индексации записи актуальным
+    считается последний вектор, результат отсортирован по id.
+    """
+    first = _vectors(3, seed=1)
+    second = _vectors(2, seed=2)
+    embedding_store.append(np.array([5, 1, 3]), first)
+    embedding_store.append(np.array([1, 7]), second)
+
+    # Имитируем недописанный хвост после аварийного завершения
+    with open(embeddings_dir / embedding_store.IDS_FILE, "ab") as f:
+        f.write(np.array([9], dtype=np.int64).tobytes())
+
+    ids, embeddings = embedding_store.load()
+
+    assert ids.tolist() == [1, 3, 5, 7]
+    assert embeddings.dtype == np.float32
+    np.testing.assert_array_equal(embeddings[0], second[0])
+    np.testing.assert_array_equal(embeddings[1], first[2])
+    np.testing.assert_array_equal(embeddings[2], first[0])
+    np.testing.assert_array_equal(embeddings[3], second[1])
+
+
+def test_rewrite_replaces_content():
+    """Перезапись полностью заменяет старое содержимое."""
+    embedding_store.append(np.array([1, 2]), _vectors(2, seed=1))
+    vectors = _vectors(1, seed=3)
+    embedding_store.rewrite(np.array([4]), vectors, [1, 4, 1, 1])
+
+    ids, embeddings = embedding_store.load()
+
+    assert ids.tolist() == [4]
+    np.testing.assert_array_equal(embeddings, vectors)
+    assert embedding_store.read_fingerprint() == [1, 4, 1, 1]
+
+
+def test_store_dir_next_to_sqlite_db(tmp_path, monkeypatch):
+    """Хранилище по умолчанию лежит рядом с файлом БД, а не в текущем каталоге."""
+    monkeypatch.setattr(settings, "EMBEDDINGS_DIR", None)
+    monkeypatch.setattr(settings, "DB_URL", f"sqlite:///{tmp_path / 'images.db'}")
+    monkeypatch.chdir(tmp_path.parent)
+
+    assert embedding_store.store_dir() == tmp_path / "images.db.embeddings"
+
+
+def test_store_dir_per_server_db(monkeypatch):
+    """У разных серверных баз разные хранилища."""
+    monkeypatch.setattr(settings, "EMBEDDINGS_DIR", None)
+    dirs = set()
+    for name in ("first", "second"):
+        monkeypatch.setattr(settings, "DB_URL", f"postgresql://u@db:5432/{name}")
+        dirs.add(embedding_store.store_dir())
+
+    assert len(dirs) == 2
+    assert all(path.parent == embedding_store.CACHE_ROOT for path in dirs)
+
+
+def test_fingerprint_detects_reindexed_file(session):
+    """
+    Переиндексация файла на месте не меняет набор id, но меняет отпечаток:
+    хранилище с прежним вектором больше не считается согласованным.
+    """
+    record = ImageRecord(
+        path="/img/1.jpg",
+        file_hash="h1",
+        size_bytes=10,
+        mtime=100.0,
+        embedding=_vectors(1, seed=1)[0].tolist(),
+    )
+    session.add(record)
+    session.commit()
+    embedding_store.write_fingerprint(embedding_store.db_fingerprint(session))
+    assert embedding_store.is_in_sync(session)
+
+    record.mtime = 200.0
+    record.embedding = _vectors(1, seed=2)[0].tolist()
+    session.commit()
+
+    assert not embedding_store.is_in_sync(session)
+
+
+def test_invalidate_removes_fingerprint():
+    """После снятия отметки хранилище не согласовано ни с какой БД."""
+    embedding_store.write_fingerprint([0, 0, 0, 0])
+    embedding_store.invalidate()
+
+    assert embedding_store.read_fingerprint() is None
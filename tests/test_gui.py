@@ -0,0 +1,61 @@
+"""Тесты для запросов окна разбора кластеров (модуль gui)."""
+
+from src.db import ImageRecord
+from src.gui import CLUSTER_ROWS_STMT, KEEP_ONE_STMT, ClusterImage, pixmap_cache_key
+
+
+def test_keep_one_ignores_hidden_reviewed_rows(session):
+    """
+    Запись, разобранная до повторной кластеризации, не показывается в окне
+    и не должна помечаться к удалению действием над кластером.
+    """
+    session.add_all(
+        [
+            ImageRecord(
+                path="/img/kept.jpg",
+                file_hash="h1",
+                size_bytes=1,
+                mtime=1,
+                cluster_id=1,
+                reviewed=True,
+            ),
+            ImageRecord(
+                path="/img/a.jpg",
+                file_hash="h2",
+                size_bytes=1,
+                mtime=1,
+                cluster_id=1,
+            ),
+            ImageRecord(
+                path="/img/b.jpg",
+                file_hash="h3",
+                size_bytes=1,
+                mtime=1,
+                cluster_id=1,
+            ),
+        ]
+    )
+    session.commit()
+
+    shown = [row.id for row in session.execute(CLUSTER_ROWS_STMT)]
+    hidden = session.query(ImageRecord).filter_by(path="/img/kept.jpg").one()
+    assert hidden.id not in shown
+
+    session.execute(
+        KEEP_ONE_STMT,
+        {"cid": 1, "ids": shown, "keep_id": shown[0]},
+        execution_options={"synchronize_session": False},
+    )
+    session.commit()
+    session.expire_all()
+
+    flags = {r.path: r.to_delete for r in session.query(ImageRecord)}
+    assert flags == {"/img/kept.jpg": False, "/img/a.jpg": False, "/img/b.jpg": True}
+
+
+def test_pixmap_cache_key_changes_with_mtime():
+    """Переиндексированный файл по тому же пути получает новый ключ миниатюры."""
+    old = ClusterImage(1, "/img/a.jpg", 10, False, "h1", 100.0)
+    new = ClusterImage(1, "/img/a.jpg", 12, False, "h2", 200.0)
+
+    assert pixmap_cache_key(old) != pixmap_cache_key(new)
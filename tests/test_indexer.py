@@ -1,23 +1,40 @@
 """Тесты для модуля indexer."""
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
-import torch
+import numpy as np
+import open_clip
 import pytest
+import torch
 from PIL import Image
 
-from src.indexer import ImageDataset, scan_directory, index_images
-from src.db import SessionLocal, ImageRecord
+from src.db import ImageRecord
+from src.indexer import (
+    DRAFT_SIZE,
+    GpuPreprocess,
+    ImageDataset,
+    JpegBytesDataset,
+    collate_raw,
+    find_known_embeddings,
+    index_images,
+    probe_batch_size,
+    scan_directory,
+)
+from src.utils import get_file_hash
 
 
-@pytest.fixture
-def temp_image_dir(tmp_path: Path) -> Path:
-    """Фикстура для создания временной директории с тестовыми изображениями."""
-    image_dir = tmp_path / "images"
-    image_dir.mkdir()
+@pytest.fixture(scope="session")
+def temp_image_dir(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """
+    Фикстура для создания временной директории с тестовыми изображениями.
+    Создается один раз на сессию: тесты только читают эти файлы.
+    """
+    image_dir = tmp_path_factory.mktemp("images")
     # Гарантированно создаем файлы, которые пройдут проверку is_image_file
     Image.new("RGB", (10, 10)).save(image_dir / "img1.jpeg")
-    Image.new("RGB", (10, 10)).save(image_dir / "img2.jpg") # Используем .jpg
+    Image.new("RGB", (10, 10)).save(image_dir / "img2.jpg")  # Используем .jpg
     (image_dir / "not_an_image.txt").touch()
     # "Битый" файл - имеет расширение, но пустой
     (image_dir / "broken.jpg").touch()
@@ -25,9 +42,37 @@ def temp_image_dir(tmp_path: Path) -> Path:
     return image_dir
 
 
-def test_scan_directory(temp_image_dir: Path):
-    """Тестирует функцию сканирования директории."""
-    files = scan_directory(temp_image_dir)
+@pytest.fixture(scope="session")
+def _clip_pair():
+    """Мок модели CLIP и ее предобработки, создаваемый один раз на сессию."""
+    model = MagicMock()
+    preprocess = MagicMock(return_value=torch.zeros(3, 224, 224))
+    return model, preprocess
+
+
+@pytest.fixture
+def clip_stub(_clip_pair):
+    """
+    Общий мок (модель, предобработка); эмбеддинги тест задает сам через
+    `model.encode_image.return_value`. История вызовов сбрасывается.
+    """
+    yield _clip_pair
+    for stub in _clip_pair:
+        stub.reset_mock()
+
+
+def test_scan_directory(temp_image_dir: Path, monkeypatch):
+    """
+    Тестирует функцию сканирования директории. Тип и имя файлов берутся
+    из `os.scandir`, без `stat` на каждый путь.
+    """
+
+    def fail_stat(self, *args, **kwargs):
+        raise AssertionError(f"stat() вызван для {self}")
+
+    with monkeypatch.context() as m:
+        m.setattr(Path, "stat", fail_stat)
+        files = scan_directory(temp_image_dir)
     # Ожидаем найти все файлы с "имиджевыми" расширениями, включая битые
     assert len(files) == 3
     paths = {p.name for p in files}
@@ -40,7 +85,7 @@ def test_scan_directory(temp_image_dir: Path):
 def test_image_dataset(temp_image_dir: Path):
     """Тестирует ImageDataset, включая обработку поврежденных файлов."""
     files = [
-        temp_image_dir / "img1.jpeg", # Используем .jpeg, как в фикстуре
+        temp_image_dir / "img1.jpeg",  # Используем .jpeg, как в фикстуре
         temp_image_dir / "broken.jpg",  # Этот файл вызовет ошибку
     ]
     # Мок предобработки
@@ -59,32 +104,97 @@ def test_image_dataset(temp_image_dir: Path):
     img, path, is_valid = dataset[1]
     assert not is_valid
     assert path == str(files[1])
-    assert isinstance(img, torch.Tensor) # Должен вернуть тензор-пустышку
+    assert isinstance(img, torch.Tensor)  # Должен вернуть тензор-пустышку
+
+
+def test_image_dataset_decodes_reduced_jpeg(tmp_path: Path):
+    """Большой JPEG декодируется уменьшенным, но не меньше DRAFT_SIZE."""
+    path = tmp_path / "large.jpg"
+    Image.new("RGB", (2000, 1500), (120, 30, 200)).save(path)
+    sizes = []
+    preprocess = MagicMock(
+        side_effect=lambda image: sizes.append(image.size) or torch.zeros(3)
+    )
 
+    _, _, is_valid = ImageDataset([path], preprocess)[0]
 
+    assert is_valid
+    width, height = sizes[0]
+    assert width * height <= 2000 * 1500 // 4
+    assert min(width, height) >= min(DRAFT_SIZE)
+
+
+@pytest.mark.parametrize("resize_mode", ["squash", "shortest"])
+def test_gpu_preprocess_matches_clip_transform(
+    temp_image_dir: Path, tmp_path: Path, resize_mode: str
+):
+    """
+    Предобработка из байтов JPEG совпадает с предобработкой open_clip
+    через Pillow (проверяется на CPU), битые файлы помечаются невалидными.
+    """
+    pixels = np.zeros((200, 300, 3), dtype=np.uint8)
+    pixels[:, :, 0] = np.linspace(0, 255, 300, dtype=np.uint8)
+    pixels[50:100, 50:150] = (200, 30, 90)
+    path = tmp_path / "photo.jpg"
+    Image.fromarray(pixels).save(path, quality=95)
+    cfg = {
+        "size": 224,
+        "mean": (0.48, 0.45, 0.4),
+        "std": (0.26, 0.26, 0.27),
+        "interpolation": "bicubic",
+        "resize_mode": resize_mode,
+    }
+    reference = open_clip.image_transform(
+        224,
+        is_train=False,
+        mean=cfg["mean"],
+        std=cfg["std"],
+        resize_mode=resize_mode,
+        interpolation="bicubic",
+    )(Image.open(path))
+
+    dataset = JpegBytesDataset([path, temp_image_dir / "broken.jpg"])
+    data, paths, valid = collate_raw([dataset[0], dataset[1]])
+    batch, decoded = GpuPreprocess(cfg, "cpu")(data, valid)
+
+    assert paths == [str(path), str(temp_image_dir / "broken.jpg")]
+    assert decoded == [True, False]
+    assert batch.shape == (2, 3, 224, 224)
+    assert (batch[0] - reference).abs().mean() < 0.01
+
+
+@patch("src.indexer.ThreadPoolExecutor", wraps=ThreadPoolExecutor)
 @patch("src.indexer.get_file_hash", return_value="mock_hash")
 @patch("src.indexer.open_clip.create_model_and_transforms")
 @patch("src.indexer.SessionLocal")
-def test_index_images_new_files(mock_session_local, mock_create_model, mock_get_hash, temp_image_dir: Path, session):
+def test_index_images_new_files(
+    mock_session_local,
+    mock_create_model,
+    mock_get_hash,
+    mock_executor,
+    temp_image_dir: Path,
+    session,
+    clip_stub,
+):
     """
     Тестирует индексацию новых файлов.
-    Проверяет, что для каждого изображения создается запись в БД.
+    Проверяет, что для каждого изображения создается запись в БД,
+    а файлы хешируются в пуле из заданного числа потоков.
     """
     # Мокаем SessionLocal, чтобы он возвращал нашу тестовую сессию
     mock_session_local.return_value.__enter__.return_value = session
 
     # Настраиваем мок модели CLIP
-    mock_model = MagicMock()
-    mock_preprocess = MagicMock(return_value=torch.zeros(3, 224, 224))
+    mock_model, mock_preprocess = clip_stub
     mock_create_model.return_value = (mock_model, None, mock_preprocess)
 
     # Настраиваем, что будет возвращать encode_image
-    features = torch.rand(3, 768) # 3 файла в фикстуре
+    features = torch.rand(3, 768)  # 3 файла в фикстуре
     features_norm = features / features.norm(dim=-1, keepdim=True)
     mock_model.encode_image.return_value = features_norm
 
     # Запускаем индексацию
-    index_images(temp_image_dir, force=True)
+    index_images(temp_image_dir, force=True, workers=2)
 
     # Проверяем, что в БД появились записи для ДВУХ валидных файлов
     records = session.query(ImageRecord).all()
@@ -92,3 +202,187 @@ def test_index_images_new_files(mock_session_local, mock_create_model, mock_get_
     paths = {Path(r.path).name for r in records}
     assert "img1.jpeg" in paths
     assert "img2.jpg" in paths
+    assert mock_executor.call_args.kwargs["max_workers"] == 2
+
+
+@patch("src.indexer.open_clip.create_model_and_transforms")
+@patch("src.indexer.SessionLocal")
+def test_index_images_skips_duplicates(
+    mock_session_local, mock_create_model, tmp_path: Path, session, clip_stub
+):
+    """
+    Тестирует пропуск побайтовых дубликатов: эмбеддинг вычисляется один раз
+    на группу копий, а для уже известного содержимого берется из БД.
+    """
+    mock_session_local.return_value.__enter__.return_value = session
+
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    Image.new("RGB", (10, 10), "red").save(image_dir / "a.jpg")
+    Image.new("RGB", (10, 10), "blue").save(image_dir / "b.jpg")
+    (image_dir / "b_copy.jpg").write_bytes((image_dir / "b.jpg").read_bytes())
+
+    # Содержимое a.jpg уже проиндексировано под другим путем
+    known_embedding = [1.0] + [0.0] * 767
+    session.add(
+        ImageRecord(
+            path="/old/a.jpg",
+            file_hash=get_file_hash(image_dir / "a.jpg"),
+            size_bytes=(image_dir / "a.jpg").stat().st_size,
+            mtime=0,
+            embedding=known_embedding,
+        )
+    )
+    session.commit()
+
+    mock_model, mock_preprocess = clip_stub
+    mock_create_model.return_value = (mock_model, None, mock_preprocess)
+    features = torch.rand(1, 768)
+    mock_model.encode_image.return_value = features / features.norm(
+        dim=-1, keepdim=True
+    )
+
+    index_images(image_dir)
+
+    # Модель видит только одно изображение - представителя группы b
+    assert mock_model.encode_image.call_count == 1
+    assert mock_model.encode_image.call_args.args[0].shape[0] == 1
+
+    records = {Path(r.path).name: r for r in session.query(ImageRecord).all()}
+    assert set(records) == {"a.jpg", "b.jpg", "b_copy.jpg"}
+    assert list(records["a.jpg"].embedding) == known_embedding
+    assert list(records["b.jpg"].embedding) == list(records["b_copy.jpg"].embedding)
+
+
+def test_probe_batch_size_uses_free_memory():
+    """
+    Бюджет батча - свободная видеопамять плюс занятая самим процессом,
+    а не весь объем карты, часть которого держат другие процессы.
+    """
+    gib = 1024**3
+    model = MagicMock()
+    model.visual.image_size = 224
+    peaks = []
+
+    def encode_image(probe):
+        # Модель (1 ГиБ) плюс 64 МиБ на изображение
+        peaks.append(gib + len(probe) * 64 * 1024**2)
+
+    model.encode_image.side_effect = encode_image
+    with (
+        patch.multiple(
+            "src.indexer.torch.cuda",
+            # Карта 24 ГиБ, свободно 4 ГиБ, процесс уже держит 1 ГиБ
+            mem_get_info=MagicMock(return_value=(4 * gib, 24 * gib)),
+            memory_reserved=MagicMock(return_value=gib),
+            max_memory_allocated=MagicMock(side_effect=lambda device: peaks[-1]),
+            reset_peak_memory_stats=MagicMock(),
+            synchronize=MagicMock(),
+            empty_cache=MagicMock(),
+        ),
+        patch(
+            "src.indexer.torch.zeros", side_effect=lambda shape, **kw: [0] * shape[0]
+        ),
+    ):
+        batch_size = probe_batch_size(model, "cuda", torch.float16)
+
+    # 5 ГиБ * 0.85 = 4.25 ГиБ: 32 изображения (3 ГиБ) помещаются, 64 (5 ГиБ) - нет
+    assert batch_size == 32
+
+
+@patch("src.indexer.EXISTING_QUERY_CHUNK", 1)
+def test_find_known_embeddings_in_chunks(session):
+    """Хеши ищутся пачками, результаты всех пачек объединяются."""
+    for i in range(3):
+        session.add(
+            ImageRecord(
+                path=f"/img/{i}.jpg",
+                file_hash=f"h{i}",
+                size_bytes=10,
+                mtime=0,
+                embedding=[float(i)] * 768,
+            )
+        )
+    session.commit()
+
+    known = find_known_embeddings(session, [(10, "h0"), (10, "h2"), (99, "h1")])
+
+    assert set(known) == {(10, "h0"), (10, "h2")}
+    assert known[(10, "h2")][0] == 2.0
+
+
+@patch("src.indexer.open_clip.create_model_and_transforms")
+@patch("src.indexer.SessionLocal")
+def test_index_images_updates_existing_record(
+    mock_session_local, mock_create_model, tmp_path: Path, session, clip_stub
+):
+    """Повторная индексация обновляет запись по пути, не создавая новую."""
+    mock_session_local.return_value.__enter__.return_value = session
+
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    Image.new("RGB", (10, 10), "red").save(image_dir / "a.jpg")
+    old = ImageRecord(
+        path=str(image_dir / "a.jpg"),
+        file_hash="old_hash",
+        size_bytes=1,
+        mtime=0,
+        cluster_id=5,
+        reviewed=True,
+        to_delete=True,
+    )
+    session.add(old)
+    session.commit()
+    old_id = old.id
+
+    mock_model, mock_preprocess = clip_stub
+    mock_create_model.return_value = (mock_model, None, mock_preprocess)
+    features = torch.rand(1, 768)
+    mock_model.encode_image.return_value = features / features.norm(
+        dim=-1, keepdim=True
+    )
+
+    index_images(image_dir)
+
+    session.expire_all()
+    records = session.query(ImageRecord).all()
+    assert len(records) == 1
+    record = records[0]
+    assert record.id == old_id
+    assert record.file_hash == get_file_hash(image_dir / "a.jpg")
+    assert record.embedding is not None
+    assert record.cluster_id is None
+    assert not record.reviewed and not record.to_delete
+
+
+@patch("src.indexer.open_clip.create_model_and_transforms")
+@patch("src.indexer.SessionLocal")
+def test_index_images_skips_unchanged(
+    mock_session_local,
+    mock_create_model,
+    tmp_path: Path,
+    session,
+    clip_stub,
+    monkeypatch,
+):
+    """Неизмененные файлы не переиндексируются, даже если папка указана относительным путем."""
+    mock_session_local.return_value.__enter__.return_value = session
+    monkeypatch.chdir(tmp_path)
+
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    Image.new("RGB", (10, 10), "red").save(image_dir / "a.jpg")
+
+    mock_model, mock_preprocess = clip_stub
+    mock_create_model.return_value = (mock_model, None, mock_preprocess)
+    features = torch.rand(1, 768)
+    mock_model.encode_image.return_value = features / features.norm(
+        dim=-1, keepdim=True
+    )
+
+    index_images(Path("images"))
+    index_images(Path("images"))
+
+    assert mock_model.encode_image.call_count == 1
+    records = session.query(ImageRecord).all()
+    assert [r.path for r in records] == [str(image_dir / "a.jpg")]
@@ -0,0 +1,126 @@
+"""Тесты для модуля manage.mp4_fixer."""
+
+import shutil
+import struct
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from src.manage.mp4_fixer import PRIMARY_CHECK_TAG, ExifToolDaemon, Mp4DateFixer
+
+# Имитация `exiftool -stay_open`, которая перед маркером выводит в stderr
+# больше, чем вмещает буфер канала
+NOISY_EXIFTOOL = """
+import sys
+for line in sys.stdin:
+    line = line.rstrip("\\n")
+    if line == "-stay_open":
+        continue
+    if line == "False":
+        break
+    if line.startswith("-execute"):
+        marker = "{ready%s}" % line[len("-execute"):]
+        sys.stderr.write("Warning: noise\\n" * 20000)
+        sys.stderr.write(marker + "\\n")
+        sys.stderr.flush()
+        sys.stdout.write("ok\\n" + marker + "\\n")
+        sys.stdout.flush()
+"""
+
+# Начало отсчета времени в атомах QuickTime
+QUICKTIME_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+
+
+def _atom(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def write_mp4_moov_after_mdat(path: Path, created: datetime) -> None:
+    """
+    Минимальный MP4, в котором moov (с датой в mvhd) записан после mdat -
+    так пишут многие камеры.
+    """
+    seconds = int((created - QUICKTIME_EPOCH).total_seconds())
+    mvhd = _atom(
+        b"mvhd",
+        struct.pack(">B3xIIII", 0, seconds, seconds, 1000, 0)
+        + struct.pack(">IH10x", 0x00010000, 0x0100)
+        + struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+        + bytes(24)
+        + struct.pack(">I", 1),
+    )
+    path.write_bytes(
+        _atom(b"ftyp", b"isom" + struct.pack(">I", 0x200) + b"isomiso2mp41")
+        + _atom(b"mdat", bytes(4096))
+        + _atom(b"moov", mvhd)
+    )
+
+
+@pytest.fixture
+def fixer(tmp_path: Path):
+    with patch("src.manage.mp4_fixer.shutil.which", return_value="/usr/bin/exiftool"):
+        fixer = Mp4DateFixer(tmp_path, False, None, "UTC", workers=1)
+    yield fixer
+    fixer.close()
+
+
+def test_metadata_reads_do_not_stop_at_mdat(fixer: Mp4DateFixer, tmp_path: Path):
+    """
+    -fast2 прекращает чтение на атоме mdat: он не используется, а проверка
+    после записи читает файл полностью.
+    """
+    calls = []
+
+    def execute(self, *args):
+        calls.append(args)
+        return "", ""
+
+    with patch.object(ExifToolDaemon, "execute", execute):
+        fixer.get_metadata_batch([tmp_path / "a.mp4"])
+        fixer.verify_update(tmp_path / "a.mp4", datetime.now(timezone.utc))
+
+    batch_args, verify_args = calls
+    assert "-fast2" not in batch_args
+    assert f"-{PRIMARY_CHECK_TAG}" in batch_args
+    assert not any(arg.startswith("-fast") for arg in verify_args)
+
+
+@pytest.mark.skipif(shutil.which("exiftool") is None, reason="exiftool не найден")
+def test_get_metadata_reads_moov_after_mdat(tmp_path: Path):
+    """Дата читается из файла, в котором moov идет после mdat."""
+    path = tmp_path / "2023-05-01" / "clip.mp4"
+    path.parent.mkdir()
+    write_mp4_moov_after_mdat(path, datetime(2023, 5, 1, 9, 0, tzinfo=timezone.utc))
+
+    fixer = Mp4DateFixer(tmp_path, False, None, "UTC", workers=1)
+    try:
+        meta = fixer.get_metadata(path)
+        verified = fixer.get_metadata(path, fast=False)
+    finally:
+        fixer.close()
+
+    assert meta[PRIMARY_CHECK_TAG].startswith("2023:05:01")
+    assert verified[PRIMARY_CHECK_TAG] == meta[PRIMARY_CHECK_TAG]
+
+
+def test_execute_does_not_block_on_full_stderr():
+    """Объемный stderr не блокирует ожидание маркера в stdout."""
+    popen = subprocess.Popen
+
+    def fake_popen(args, **kwargs):
+        return popen([sys.executable, "-c", NOISY_EXIFTOOL], **kwargs)
+
+    with patch("src.manage.mp4_fixer.subprocess.Popen", fake_popen):
+        daemon = ExifToolDaemon()
+        daemon.start()
+    try:
+        stdout, stderr = daemon.execute("-ver")
+    finally:
+        daemon.close()
+
+    assert stdout == "ok\n"
+    assert stderr.count("Warning") == 20000
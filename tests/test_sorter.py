@@ -0,0 +1,189 @@
+"""Тесты для модуля manage.sorter."""
+
+import datetime
+import errno
+import os
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+from src.manage.sorter import (
+    DISPATCH,
+    get_jpg_creation_date,
+    get_mov_creation_dates_batch,
+    is_same_content,
+    iter_files,
+    move_file,
+    next_free_index,
+    process_files,
+    safe_move_file,
+)
+
+
+def test_is_same_content(tmp_path: Path):
+    """Проверяет сравнение файлов по размеру, началу и CRC32."""
+    a = tmp_path / "a.jpg"
+    b = tmp_path / "b.jpg"
+    c = tmp_path / "c.jpg"
+    d = tmp_path / "d.jpg"
+    a.write_bytes(b"x" * 10000)
+    b.write_bytes(b"x" * 10000)
+    c.write_bytes(b"x" * 9999)  # Другой размер
+    d.write_bytes(b"x" * 9999 + b"y")  # Тот же размер, отличается хвост
+
+    assert is_same_content(a, b)
+    assert not is_same_content(a, c)
+    assert not is_same_content(a, d)
+
+
+def test_safe_move_file_collision(tmp_path: Path):
+    """
+    Проверяет перемещение при коллизии имен: идентичный файл пропускается,
+    отличающийся получает суффикс.
+    """
+    src_dir = tmp_path / "src"
+    dest_dir = tmp_path / "dest"
+    src_dir.mkdir()
+    dest_dir.mkdir()
+    (dest_dir / "img.jpg").write_bytes(b"original")
+
+    same = src_dir / "img.jpg"
+    same.write_bytes(b"original")
+    safe_move_file(same, dest_dir)
+    assert same.exists()  # Дубликат остается на месте
+
+    same.write_bytes(b"modified")
+    safe_move_file(same, dest_dir)
+    assert not same.exists()
+    assert (dest_dir / "img_1.jpg").read_bytes() == b"modified"
+
+
+def test_move_file_across_filesystems(tmp_path: Path):
+    """При EXDEV (разные ФС) файл перемещается копированием."""
+    source = tmp_path / "a.jpg"
+    dest = tmp_path / "b.jpg"
+    source.write_bytes(b"data")
+
+    with patch(
+        "src.manage.sorter.os.rename",
+        side_effect=OSError(errno.EXDEV, "Invalid cross-device link"),
+    ):
+        move_file(source, dest)
+
+    assert not source.exists()
+    assert dest.read_bytes() == b"data"
+
+
+def test_next_free_index(tmp_path: Path):
+    """Номер берется больше максимального занятого, пропуски не заполняются."""
+    assert next_free_index(tmp_path, "img", ".jpg") == 1
+    for name in ("img.jpg", "img_1.jpg", "img_7.jpg", "img_9.png", "img_x.jpg"):
+        (tmp_path / name).touch()
+    assert next_free_index(tmp_path, "img", ".jpg") == 8
+
+
+def test_iter_files(tmp_path: Path):
+    """Проверяет обход директории с рекурсией и без нее."""
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "top.jpg").touch()
+    (tmp_path / "a" / "mid.mov").touch()
+    (tmp_path / "a" / "b" / "deep.jpg").touch()
+
+    assert {p.name for p in iter_files(tmp_path, recursive=False)} == {"top.jpg"}
+    assert {p.name for p in iter_files(tmp_path, recursive=True)} == {
+        "top.jpg",
+        "mid.mov",
+        "deep.jpg",
+    }
+
+
+def test_get_jpg_creation_date_from_exif(tmp_path: Path):
+    """Проверяет чтение DateTimeOriginal из EXIF большого JPEG."""
+    path = tmp_path / "photo.jpg"
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9003] = "2021:06:15 10:20:30"  # DateTimeOriginal
+    # Шум, чтобы сами данные изображения были заметно больше EXIF_PROBE_SIZE
+    Image.effect_noise((1024, 1024), 100).convert("RGB").save(
+        path, exif=exif, quality=95
+    )
+
+    assert get_jpg_creation_date(path) == datetime.date(2021, 6, 15)
+
+
+@patch("src.manage.sorter.FFPROBE_CMD", ["ffprobe-missing"])
+def test_process_files_sorts_by_date(tmp_path: Path):
+    """
+    Проверяет сортировку по папкам с датой. Без EXIF и без ffprobe
+    используется дата изменения файла; неподдерживаемые файлы не трогаем.
+    """
+    src_dir = tmp_path / "src"
+    save_dir = tmp_path / "sorted"
+    (src_dir / "nested").mkdir(parents=True)
+    save_dir.mkdir()
+
+    Image.new("RGB", (10, 10)).save(src_dir / "photo.jpg")
+    (src_dir / "nested" / "clip.MP4").write_bytes(b"not a real video")
+    (src_dir / "notes.txt").write_text("skip me")
+
+    ts = datetime.datetime(2023, 12, 31, 12, 0).timestamp()
+    for p in (src_dir / "photo.jpg", src_dir / "nested" / "clip.MP4"):
+        os.utime(p, (ts, ts))
+
+    process_files(src_dir, save_dir, recursive=True)
+
+    assert (save_dir / "2023-12-31" / "photo.jpg").exists()
+    assert (save_dir / "2023-12-31" / "clip.MP4").exists()
+    assert (src_dir / "notes.txt").exists()
+
+
+@patch("src.manage.sorter.FFPROBE_CMD", ["ffprobe-missing"])
+def test_process_files_uses_date_cache(tmp_path: Path):
+    """
+    Проверяет, что при повторном запуске даты берутся из кэша,
+    а метаданные файлов не читаются заново.
+    """
+    Image.new("RGB", (10, 10)).save(tmp_path / "photo.jpg")
+    ts = datetime.datetime(2023, 12, 31, 12, 0).timestamp()
+    os.utime(tmp_path / "photo.jpg", (ts, ts))
+
+    process_files(tmp_path, tmp_path, recursive=True)
+    moved = tmp_path / "2023-12-31" / "photo.jpg"
+    assert moved.exists()
+
+    reader = MagicMock(return_value=datetime.date(2000, 1, 1))
+    with patch.dict(DISPATCH, {".jpg": reader}):
+        process_files(tmp_path, tmp_path, recursive=True)
+
+    reader.assert_not_called()
+    assert moved.exists()
+
+
+@patch("src.manage.sorter.shutil.which", return_value="/usr/bin/exiftool")
+@patch("src.manage.sorter.subprocess.run")
+def test_get_mov_creation_dates_batch(mock_run, mock_which, tmp_path: Path):
+    """
+    Проверяет разбор пакетного JSON-вывода exiftool: нулевые и отсутствующие
+    даты не попадают в результат и остаются для поштучной обработки.
+    """
+    good = tmp_path / "good.mp4"
+    zero = tmp_path / "zero.mov"
+    missing = tmp_path / "missing.mkv"
+    mock_run.return_value = MagicMock(
+        stdout=(
+            f'[{{"SourceFile": "{good}", "CreateDate": "2023:12:31 23:59:59"}},'
+            f' {{"SourceFile": "{zero}", "CreateDate": "0000:00:00 00:00:00"}},'
+            f' {{"SourceFile": "{missing}"}}]'
+        )
+    )
+
+    dates = get_mov_creation_dates_batch([good, zero, missing])
+
+    assert dates == {good: datetime.date(2023, 12, 31)}
+    # Все пути передаются одним вызовом через stdin
+    assert mock_run.call_count == 1
+    assert mock_run.call_args.kwargs["input"].splitlines() == [
+        str(good),
+        str(zero),
+        str(missing),
+    ]